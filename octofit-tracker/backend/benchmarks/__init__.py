@@ -0,0 +1,18 @@
+"""
+Micro-benchmarks for the OctoFit Tracker API.
+
+Measures throughput and memory allocations of every serializer and viewset
+action at dataset sizes from 10 to 1M rows. Run from the backend directory:
+
+    python -m benchmarks run --output baseline.json
+    python -m benchmarks run --sizes 10 1000 --only serializers --compare baseline.json
+    python -m benchmarks compare baseline.json current.json --threshold 0.1
+
+Serializer benchmarks run on in-memory documents. Viewset benchmarks need a
+local mongod and seed a separate database (octofit_benchmark by default),
+which is dropped and reseeded for every dataset size.
+
+benchmarks.load is the end-to-end load harness run against a live server,
+and benchmarks.deployments uses it to compare gunicorn (WSGI) with uvicorn
+(ASGI) on the async read endpoints; see their module docstrings.
+"""
@@ -0,0 +1,117 @@
+"""Command line entry point: python -m benchmarks {run,compare} ..."""
+import argparse
+import os
+import sys
+
+
+def setup_django(database):
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'octofit_tracker.settings')
+    import django
+    django.setup()
+    from django.db import connections
+    # Point djongo and the pooled client at the benchmark database
+    connections['default'].settings_dict['NAME'] = database
+
+
+def connect():
+    """Return the benchmark database, or None when mongod cannot be reached"""
+    from pymongo.errors import PyMongoError
+    from octofit_tracker.mongo import get_client, get_db
+    try:
+        get_client().admin.command('ping')
+    except PyMongoError as exc:
+        print(f'MongoDB is not available, skipping database benchmarks: {exc}', file=sys.stderr)
+        return None
+    return get_db()
+
+
+def report(name, size, result):
+    print(
+        f'{name:<58} {size:>8} {result["ops_per_second"]:>14,.0f} ops/s '
+        f'{result["seconds"] / result["operations"] * 1e6:>10.2f} us/op '
+        f'{result["peak_bytes"] / 1024:>12,.1f} KiB peak'
+    )
+
+
+def print_comparison(rows, threshold):
+    regressions = 0
+    for name, size, speed, memory, regressed in rows:
+        flag = 'REGRESSION' if regressed else ''
+        print(f'{name:<58} {size:>8} speed x{speed:6.3f}  memory x{memory:6.3f}  {flag}')
+        regressions += regressed
+    print(f'{len(rows)} comparisons, {regressions} regressions beyond {threshold:.0%}')
+    return regressions
+
+
+def run(args):
+    setup_django(args.database)
+    from . import bench_serializers, bench_views  # noqa: F401 (registers benchmarks)
+    from .core import Context, SkipBenchmark, compare, load, measure, save, select
+
+    benchmarks = select(args.only)
+    db = connect() if any(bench.requires_db for bench in benchmarks) else None
+
+    results = {}
+    for size in args.sizes:
+        context = Context(size, db)
+        for bench in benchmarks:
+            try:
+                function, operations = bench.setup(context)
+                result = measure(function, operations, args.repeat)
+            except SkipBenchmark as exc:
+                print(f'{bench.name:<58} {size:>8} skipped: {exc}')
+                continue
+            results.setdefault(bench.name, {})[str(size)] = result
+            report(bench.name, size, result)
+
+    if db is not None:
+        db.client.drop_database(db.name)
+    save(args.output, results, sizes=args.sizes, repeat=args.repeat)
+    print(f'Results written to {args.output}')
+
+    if args.compare:
+        rows = compare(load(args.compare), {'results': results}, args.threshold)
+        return 1 if print_comparison(rows, args.threshold) else 0
+    return 0
+
+
+def compare_files(args):
+    from .core import compare, load
+    rows = compare(load(args.baseline), load(args.current), args.threshold)
+    return 1 if print_comparison(rows, args.threshold) else 0
+
+
+def main(argv=None):
+    from .core import SIZES
+    parser = argparse.ArgumentParser(prog='python -m benchmarks', description=__doc__)
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = commands.add_parser('run', help='Run benchmarks and write a results file')
+    run_parser.add_argument('--sizes', type=int, nargs='+', default=list(SIZES),
+                            help='Dataset sizes in rows (default: 10 to 1M)')
+    run_parser.add_argument('--only', help='Regular expression selecting benchmark names')
+    run_parser.add_argument('--repeat', type=int, default=3,
+                            help='Timed samples per benchmark; the best is kept (default 3)')
+    run_parser.add_argument('--output', default='benchmark-results.json',
+                            help='Results file (default benchmark-results.json)')
+    run_parser.add_argument('--database', default='octofit_benchmark',
+                            help='Scratch MongoDB database, dropped afterwards')
+    run_parser.add_argument('--compare', metavar='BASELINE',
+                            help='Compare against a baseline file and exit 1 on regressions')
+    run_parser.add_argument('--threshold', type=float, default=0.10,
+                            help='Allowed slowdown or memory growth (default 0.10)')
+    run_parser.set_defaults(handler=run)
+
+    compare_parser = commands.add_parser('compare', help='Compare two results files')
+    compare_parser.add_argument('baseline')
+    compare_parser.add_argument('current')
+    compare_parser.add_argument('--threshold', type=float, default=0.10,
+                                help='Allowed slowdown or memory growth (default 0.10)')
+    compare_parser.set_defaults(handler=compare_files)
+
+    args = parser.parse_args(argv)
+    return args.handler(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,189 @@
+"""
+Serializer benchmarks.
+
+Every serializer in octofit_tracker.serializers is timed serializing (or,
+for BulkActivitySerializer, validating) `size` rows built from raw documents
+with to_instance, as the viewsets do. ActivitySerializer.get_user_name,
+which dominates row cost, is also timed on its own, as is building the
+in-memory workout catalog the workout routes read from, and scoring users
+against the workout feature matrix, and scoring activities with the points
+rules one at a time and in vectorized batches.
+
+The [fast] variants time the FAST_SERIALIZATION path straight from the raw
+documents, and the renderer benchmarks encode a page of serialized
+activities with JSONRenderer and FastJSONRenderer.
+"""
+from types import SimpleNamespace
+from rest_framework.renderers import JSONRenderer
+from octofit_tracker.catalog import WorkoutCatalog
+from octofit_tracker.documents import to_instance
+from octofit_tracker.fast import FastJSONRenderer
+from octofit_tracker.models import Team, User, Activity, Leaderboard, Workout
+from octofit_tracker.points import rules
+from octofit_tracker.recommendations import (
+    WorkoutMatrix, feature_deltas, merge_feature_deltas, top, user_matrix
+)
+from octofit_tracker.serializers import (
+    TeamSerializer, UserSerializer, ActivitySerializer, BulkActivitySerializer,
+    LeaderboardSerializer, WorkoutSerializer, UserNameMap
+)
+from .core import benchmark
+
+
+def instances(context, model, collection, **options):
+    return [to_instance(model, document) for document in context.documents(collection, **options)]
+
+
+def warm_names(context):
+    """A request stand-in whose user name map already holds every owner"""
+    names = UserNameMap({
+        str(user['_id']): user['name'] for user in context.documents('users')
+    })
+    return SimpleNamespace(_user_names=names)
+
+
+def serialize_many(serializer_class, model, collection, **options):
+    def setup(context):
+        rows = instances(context, model, collection, **options)
+        return (lambda: serializer_class(rows, many=True).data), len(rows)
+    return setup
+
+
+benchmark('serializers.TeamSerializer')(serialize_many(TeamSerializer, Team, 'teams'))
+benchmark('serializers.UserSerializer')(serialize_many(UserSerializer, User, 'users'))
+benchmark('serializers.LeaderboardSerializer')(
+    serialize_many(LeaderboardSerializer, Leaderboard, 'leaderboard')
+)
+benchmark('serializers.WorkoutSerializer')(
+    serialize_many(WorkoutSerializer, Workout, 'workouts')
+)
+
+
+def fast_many(serializer_class, collection, **options):
+    def setup(context):
+        documents = context.documents(collection, **options)
+        request = warm_names(context)
+        return (
+            lambda: serializer_class(context={'request': request})
+            .to_documents_representation(documents)
+        ), len(documents)
+    return setup
+
+
+benchmark('serializers.TeamSerializer[fast]')(fast_many(TeamSerializer, 'teams'))
+benchmark('serializers.LeaderboardSerializer[fast]')(
+    fast_many(LeaderboardSerializer, 'leaderboard')
+)
+benchmark('serializers.WorkoutSerializer[fast]')(fast_many(WorkoutSerializer, 'workouts'))
+benchmark('serializers.ActivitySerializer[fast]')(fast_many(ActivitySerializer, 'activities'))
+
+
+@benchmark('renderers.JSONRenderer')
+def json_renderer(context):
+    rows = instances(context, Activity, 'activities')
+    data = ActivitySerializer(rows, many=True, context={'request': warm_names(context)}).data
+    renderer = JSONRenderer()
+    return (lambda: renderer.render(data)), len(rows)
+
+
+@benchmark('renderers.FastJSONRenderer')
+def fast_json_renderer(context):
+    documents = context.documents('activities')
+    data = ActivitySerializer(context={'request': warm_names(context)}).to_documents_representation(documents)
+    renderer = FastJSONRenderer()
+    return (lambda: renderer.render(data)), len(documents)
+
+
+@benchmark('serializers.ActivitySerializer')
+def activity_serializer(context):
+    """User names already resolved, as on every page after the first lookup"""
+    rows = instances(context, Activity, 'activities')
+    request = warm_names(context)
+    return (
+        lambda: ActivitySerializer(rows, many=True, context={'request': request}).data
+    ), len(rows)
+
+
+@benchmark('serializers.ActivitySerializer[cold]', requires_db=True)
+def activity_serializer_cold(context):
+    """Fresh name map per call: includes the $in lookup of every owner"""
+    context.database()
+    rows = instances(context, Activity, 'activities')
+
+    def run():
+        request = SimpleNamespace(_user_names=None)
+        return ActivitySerializer(rows, many=True, context={'request': request}).data
+    return run, len(rows)
+
+
+@benchmark('serializers.BulkActivitySerializer.run_validation')
+def bulk_activity_validation(context):
+    records = [
+        dict(
+            document,
+            _id=str(document['_id']),
+            user_id=str(document['user_id']),
+            date=document['date'].isoformat(),
+        )
+        for document in context.documents('activities')
+    ]
+    validator = BulkActivitySerializer()
+
+    def run():
+        for record in records:
+            validator.run_validation(record)
+    return run, len(records)
+
+
+@benchmark('catalog.WorkoutCatalog')
+def workout_catalog(context):
+    """Snapshot build: sort keys and the difficulty, category and exercise indexes"""
+    documents = context.documents('workouts')
+    return (lambda: WorkoutCatalog(documents, 0)), len(documents)
+
+
+@benchmark('points.PointsRules.points')
+def score_activities(context):
+    documents = context.documents('activities')
+
+    def run():
+        for document in documents:
+            rules.points(document)
+    return run, len(documents)
+
+
+@benchmark('points.PointsRules.points_array')
+def score_activities_vectorized(context):
+    documents = context.documents('activities')
+    return (lambda: rules.points_array(documents)), len(documents)
+
+
+@benchmark('recommendations.score')
+def score_users(context):
+    """Feature vectors of every activity owner scored in one batch, then top 10 each"""
+    sums = {}
+    for activity in context.documents('activities'):
+        merge_feature_deltas(sums, feature_deltas(after=activity))
+    rows = [
+        dict({field: value for field, value in delta.items() if '.' not in field}, minutes={
+            field.split('.', 1)[1]: value for field, value in delta.items() if '.' in field
+        })
+        for delta in sums.values()
+    ]
+    matrix = WorkoutMatrix(WorkoutCatalog(context.documents('workouts'), 0))
+
+    def run():
+        for scores in user_matrix(rows) @ matrix.features.T:
+            top(scores, 10)
+    return run, len(rows)
+
+
+@benchmark('serializers.ActivitySerializer.get_user_name')
+def get_user_name(context):
+    rows = instances(context, Activity, 'activities')
+    serializer = ActivitySerializer(context={'request': warm_names(context)})
+
+    def run():
+        for row in rows:
+            serializer.get_user_name(row)
+    return run, len(rows)
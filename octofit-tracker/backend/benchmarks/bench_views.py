@@ -0,0 +1,180 @@
+"""
+Viewset action benchmarks.
+
+Actions are discovered from the router in octofit_tracker.urls: list,
+retrieve and every extra action of each registered viewset, plus the write
+actions listed in WRITES. Each one is called in-process through
+APIRequestFactory against the seeded benchmark database and its response is
+rendered, so serialization and JSON encoding are included. The response
+cache is disabled while timing so every call does the full work.
+"""
+from itertools import count
+from rest_framework.test import APIRequestFactory
+from octofit_tracker.cache import LocalLRUCache, response_cache
+from octofit_tracker.urls import router
+from . import fixtures
+from .core import SkipBenchmark, benchmark
+
+factory = APIRequestFactory(SERVER_NAME='localhost')
+
+# Requests per timed call; export streams the whole collection in one
+REQUESTS = 20
+
+BULK_RECORDS = 100
+
+WRITES = {
+    'team': ['partial_update'],
+    'user': ['partial_update'],
+    'activity': ['create', 'partial_update', 'destroy'],
+    'workout': ['partial_update'],
+}
+
+
+def middle(size):
+    return size // 2
+
+
+def request_specs(context):
+    """
+    Return {(basename, action): (kwargs, params or body, operations per
+    request)} for this dataset. Actions without an entry are skipped.
+    """
+    size = context.size
+    user_id = str(fixtures.object_id(1, middle(fixtures.owner_count(size))))
+    team = fixtures.team_id(1)
+    serial = count()
+
+    def new_activity():
+        document = next(fixtures.activities(1))
+        return dict(
+            document,
+            _id=f'bench-{size}-{next(serial)}',
+            user_id=user_id,
+            date=document['date'].isoformat(),
+        )
+
+    return {
+        ('team', 'list'): ({}, {}, 1),
+        ('team', 'retrieve'): ({'_id': team}, {}, 1),
+        ('team', 'members'): ({'_id': team}, {}, 1),
+        ('team', 'partial_update'): ({'_id': team}, lambda: {'description': 'Benchmark team'}, 1),
+        ('user', 'list'): ({}, {}, 1),
+        ('user', 'retrieve'): ({'_id': user_id}, {}, 1),
+        ('user', 'activities'): ({'_id': user_id}, {}, 1),
+        ('user', 'by_team'): ({}, {'team_id': team}, 1),
+        ('user', 'recommended_workouts'): ({'_id': user_id}, {'limit': 10}, 1),
+        ('user', 'partial_update'): ({'_id': user_id}, lambda: {'role': 'member'}, 1),
+        ('activity', 'list'): ({}, {}, 1),
+        ('activity', 'retrieve'): (
+            {'_id': str(fixtures.object_id(2, middle(size)))}, {}, 1
+        ),
+        ('activity', 'by_user'): ({}, {'user_id': user_id}, 1),
+        ('activity', 'by_type'): ({}, {'type': 'Running'}, 1),
+        ('activity', 'export'): ({}, {}, size),
+        ('activity', 'stats'): ({}, {'user_id': user_id, 'period': 'week'}, 1),
+        ('activity', 'team_stats'): ({}, {'team_id': team}, 1),
+        ('activity', 'search'): ({}, {'q': 'running session'}, 1),
+        ('activity', 'create'): ({}, new_activity, 1),
+        ('activity', 'partial_update'): (
+            {'_id': str(fixtures.object_id(2, middle(size)))}, lambda: {'duration': 45}, 1
+        ),
+        ('activity', 'destroy'): ({}, None, 1),
+        ('activity', 'bulk'): (
+            {}, lambda: [
+                {key: value for key, value in new_activity().items() if key != '_id'}
+                for _ in range(BULK_RECORDS)
+            ],
+            BULK_RECORDS
+        ),
+        ('leaderboard', 'list'): ({}, {}, 1),
+        ('leaderboard', 'retrieve'): ({'_id': str(fixtures.object_id(3, middle(size)))}, {}, 1),
+        ('leaderboard', 'by_team'): ({}, {'team_id': team}, 1),
+        ('leaderboard', 'top'): ({}, {'limit': 10}, 1),
+        ('leaderboard', 'rank'): ({}, {'user_id': user_id, 'k': 5}, 1),
+        ('workout', 'list'): ({}, {}, 1),
+        ('workout', 'retrieve'): ({'_id': str(fixtures.object_id(4, middle(size)))}, {}, 1),
+        ('workout', 'by_difficulty'): ({}, {'difficulty': 'advanced'}, 1),
+        ('workout', 'by_category'): ({}, {'category': 'strength'}, 1),
+        ('workout', 'by_exercise'): ({}, {'name': 'squats'}, 1),
+        ('workout', 'search'): ({}, {'q': 'squats workout'}, 1),
+        ('workout', 'partial_update'): (
+            {'_id': str(fixtures.object_id(4, middle(size)))}, lambda: {'duration': 45}, 1
+        ),
+    }
+
+
+def actions(viewset, basename):
+    """Yield (action, method) for every benchmarked action of a viewset"""
+    yield 'list', 'get'
+    yield 'retrieve', 'get'
+    for extra in viewset.get_extra_actions():
+        for method in extra.mapping:
+            yield extra.__name__, method
+    methods = {'create': 'post', 'partial_update': 'patch', 'destroy': 'delete'}
+    for name in WRITES.get(basename, []):
+        yield name, methods[name]
+
+
+def disable_response_cache():
+    # A zero-entry LRU stores nothing, so every call misses
+    if not isinstance(response_cache.backend, LocalLRUCache) or response_cache.backend.max_entries:
+        response_cache.backend = LocalLRUCache(0)
+
+
+def render(response):
+    if response.status_code >= 400:
+        raise RuntimeError(f'HTTP {response.status_code}: {getattr(response, "data", "")}')
+    if response.streaming:
+        return sum(len(chunk) for chunk in response.streaming_content)
+    return len(response.render().content)
+
+
+def call(view, method, path, kwargs, payload):
+    if method == 'get':
+        request = factory.get(path, payload)
+    else:
+        request = getattr(factory, method)(path, payload, format='json')
+    return render(view(request, **kwargs))
+
+
+def view_benchmark(prefix, viewset, basename, action, method):
+    def setup(context):
+        db = context.database()
+        disable_response_cache()
+        spec = request_specs(context).get((basename, action))
+        if spec is None:
+            raise SkipBenchmark(f'no request spec for {basename}.{action}')
+        kwargs, payload, operations = spec
+        view = viewset.as_view({method: action})
+        path = f'/api/{prefix}/'
+
+        if action == 'destroy':
+            # Each call deletes freshly inserted activities; the single
+            # insert_many that provides them is included in the timing
+            serial = count()
+
+            def run():
+                documents = [
+                    dict(document, _id=f'bench-delete-{next(serial)}')
+                    for document in fixtures.activities(REQUESTS)
+                ]
+                db.activities.insert_many(documents)
+                for document in documents:
+                    call(view, method, path, {'_id': document['_id']}, None)
+            return run, REQUESTS
+
+        requests = 1 if action == 'export' else REQUESTS
+
+        def run():
+            for _ in range(requests):
+                body = payload() if callable(payload) else payload
+                call(view, method, path, kwargs, body)
+        return run, operations * requests
+    return setup
+
+
+for prefix, viewset, basename in router.registry:
+    for action, method in actions(viewset, basename):
+        benchmark(f'views.{basename}.{action}', requires_db=True)(
+            view_benchmark(prefix, viewset, basename, action, method)
+        )
@@ -0,0 +1,162 @@
+"""
+Benchmark registry, measurement and baseline files.
+
+A benchmark is a setup function taking a Context and returning the callable
+to time and the number of operations (rows or requests) one call performs.
+Throughput is the best of `repeat` timed samples; allocations are the peak
+traced by tracemalloc during one extra, untimed call.
+"""
+import gc
+import json
+import math
+import platform
+import re
+import statistics
+import time
+import tracemalloc
+from datetime import datetime, timezone
+import django
+from octofit_tracker.indexes import ensure_indexes
+from . import fixtures
+
+SIZES = (10, 100, 1000, 10000, 100000, 1000000)
+
+# Calls faster than this are looped so each sample is long enough to time
+MIN_SAMPLE_TIME = 0.05
+
+# Peak allocation growth below this is noise, whatever the ratio
+MIN_MEMORY_DELTA = 64 * 1024
+
+registry = []
+
+
+class SkipBenchmark(Exception):
+    """Raised by a setup function when a benchmark cannot run here"""
+
+
+class Benchmark:
+    """A named benchmark and the setup function that prepares one run"""
+
+    def __init__(self, name, setup, requires_db=False):
+        self.name = name
+        self.setup = setup
+        self.requires_db = requires_db
+
+
+class Context:
+    """Dataset of one size, shared by every benchmark run at that size"""
+
+    def __init__(self, size, db=None):
+        self.size = size
+        self.db = db
+        self.seeded = False
+        self._documents = {}
+
+    def documents(self, collection, **options):
+        """Return the in-memory documents of a collection, generated once"""
+        key = (collection, tuple(sorted(options.items())))
+        if key not in self._documents:
+            self._documents[key] = list(fixtures.DATASETS[collection](self.size, **options))
+        return self._documents[key]
+
+    def database(self):
+        """Return the benchmark database, seeded with this size on first use"""
+        if self.db is None:
+            raise SkipBenchmark('MongoDB is not available')
+        if not self.seeded:
+            fixtures.load(self.db, self.size)
+            ensure_indexes(self.db)
+            self.seeded = True
+        return self.db
+
+
+def benchmark(name, requires_db=False):
+    """Register a setup function as a benchmark"""
+    def decorator(setup):
+        registry.append(Benchmark(name, setup, requires_db))
+        return setup
+    return decorator
+
+
+def select(pattern=None):
+    """Return registered benchmarks whose name matches `pattern`"""
+    if not pattern:
+        return list(registry)
+    return [bench for bench in registry if re.search(pattern, bench.name)]
+
+
+def measure(run, operations, repeat):
+    """Time `run` and trace its allocations"""
+    gc.collect()
+    started = time.perf_counter()
+    run()
+    first = time.perf_counter() - started
+    loops = max(1, math.ceil(MIN_SAMPLE_TIME / first)) if first > 0 else 1
+
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for _ in range(loops):
+            run()
+        samples.append((time.perf_counter() - started) / loops)
+
+    gc.collect()
+    tracemalloc.start()
+    try:
+        run()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    best = min(samples)
+    return {
+        'operations': operations,
+        'seconds': best,
+        'median_seconds': statistics.median(samples),
+        'ops_per_second': operations / best if best else float('inf'),
+        'peak_bytes': peak,
+        'bytes_per_op': peak / operations if operations else 0,
+    }
+
+
+def environment():
+    return {
+        'created': datetime.now(timezone.utc).isoformat(),
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'django': django.get_version(),
+        'machine': platform.machine(),
+        'platform': platform.platform(),
+    }
+
+
+def save(path, results, **meta):
+    with open(path, 'w') as output:
+        json.dump({'meta': dict(environment(), **meta), 'results': results}, output, indent=2)
+
+
+def load(path):
+    with open(path) as source:
+        return json.load(source)
+
+
+def compare(baseline, current, threshold):
+    """
+    Return one row per benchmark and size present in both result sets:
+    (name, size, speed ratio, memory ratio, regressed).
+    A speed ratio below 1 - threshold or peak memory above 1 + threshold
+    of the baseline is a regression.
+    """
+    rows = []
+    for name, sizes in current['results'].items():
+        for size, result in sizes.items():
+            base = baseline['results'].get(name, {}).get(size)
+            if base is None:
+                continue
+            speed = result['ops_per_second'] / base['ops_per_second']
+            memory = result['peak_bytes'] / base['peak_bytes'] if base['peak_bytes'] else 1.0
+            grown = result['peak_bytes'] - base['peak_bytes'] > MIN_MEMORY_DELTA
+            regressed = speed < 1 - threshold or (memory > 1 + threshold and grown)
+            rows.append((name, int(size), speed, memory, regressed))
+    rows.sort(key=lambda row: (row[0], row[1]))
+    return rows
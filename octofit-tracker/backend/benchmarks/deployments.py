@@ -0,0 +1,147 @@
+"""
+WSGI vs ASGI throughput on the hot read endpoints.
+
+Starts the API under gunicorn (octofit_tracker.wsgi, threaded workers) and
+under uvicorn (octofit_tracker.asgi, which serves the async views), then
+drives both closed-loop with benchmarks.load at each concurrency level:
+
+    python -m benchmarks.deployments
+    python -m benchmarks.deployments --concurrency 16 64 256 --workers 4 --output deployments.json
+    python -m benchmarks.deployments --no-cache
+
+Only the routes with async views are loaded. --no-cache turns the response
+cache off in both servers so every request reaches MongoDB.
+"""
+import argparse
+import json
+import os
+import sys
+from urllib.parse import urlsplit
+from .load import Client, Runner, discover_routes, start_server, summarize
+
+HOT_ROUTES = {
+    'leaderboard.list': 1,
+    'leaderboard.top': 1,
+    'team.list': 1,
+    'workout.list': 1,
+    'activity.by_user': 1,
+}
+
+
+def gunicorn(workers, threads):
+    def command(address):
+        return [
+            sys.executable, '-m', 'gunicorn', 'octofit_tracker.wsgi:application',
+            '--bind', address, '--workers', str(workers),
+            '--worker-class', 'gthread', '--threads', str(threads),
+        ]
+    return command
+
+
+def uvicorn(workers):
+    def command(address):
+        host, _, port = address.rpartition(':')
+        return [
+            sys.executable, '-m', 'uvicorn', 'octofit_tracker.asgi:application',
+            '--host', host, '--port', port, '--workers', str(workers),
+            '--no-access-log',
+        ]
+    return command
+
+
+def hot_routes(base_url):
+    client = Client(base_url, timeout=10)
+    routes, skipped = discover_routes(client, HOT_ROUTES)
+    client.close()
+    for name, reason in skipped:
+        print(f'skipping {name}: {reason}', file=sys.stderr)
+    return [(weight, route) for weight, route in routes if route.name in HOT_ROUTES]
+
+
+def run_deployment(name, command, base_url, levels, duration, timeout):
+    """Load one server at every concurrency level and return the reports"""
+    server = start_server(base_url, command)
+    try:
+        routes = hot_routes(base_url)
+        if not routes:
+            raise RuntimeError('no routes to load')
+        reports = {}
+        for concurrency in levels:
+            # Untimed warm-up fills connection pools and caches
+            Runner(base_url, routes, concurrency, min(duration, 2), timeout=timeout).run()
+            runner = Runner(base_url, routes, concurrency, duration, timeout=timeout)
+            reports[concurrency] = summarize(runner.stats, runner.run())
+            total = reports[concurrency]['total']
+            print(f'{name} c={concurrency}: {total["throughput_rps"]:.1f} rps, '
+                  f'p99 {total["latency"]["p99_ms"]:.2f} ms', file=sys.stderr)
+        return reports
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def print_comparison(results, out=sys.stdout):
+    header = (f'{"concurrency":>11} {"wsgi rps":>10} {"asgi rps":>10} {"speedup":>8} '
+              f'{"wsgi p99":>10} {"asgi p99":>10} {"wsgi err":>9} {"asgi err":>9}')
+    out.write(header + '\n' + '-' * len(header) + '\n')
+    for concurrency in results['wsgi']:
+        wsgi = results['wsgi'][concurrency]['total']
+        asgi = results['asgi'][concurrency]['total']
+        speedup = asgi['throughput_rps'] / wsgi['throughput_rps'] if wsgi['throughput_rps'] else 0.0
+        out.write(
+            f'{concurrency:>11} {wsgi["throughput_rps"]:>10.1f} {asgi["throughput_rps"]:>10.1f} '
+            f'{speedup:>7.2f}x {wsgi["latency"]["p99_ms"]:>10.2f} {asgi["latency"]["p99_ms"]:>10.2f} '
+            f'{wsgi["error_rate"]:>9.2%} {asgi["error_rate"]:>9.2%}\n'
+        )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.deployments', description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8100,
+                        help='WSGI port; ASGI uses the next one (default 8100)')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[16, 64, 256],
+                        help='Client concurrency levels (default 16 64 256)')
+    parser.add_argument('--duration', type=float, default=15,
+                        help='Seconds per concurrency level (default 15)')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                        help='Server processes for both deployments (default: CPU count)')
+    parser.add_argument('--threads', type=int, default=8,
+                        help='Threads per gunicorn worker (default 8)')
+    parser.add_argument('--timeout', type=float, default=30, help='Per-request timeout in seconds')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='Disable the response cache in both servers')
+    parser.add_argument('--output', help='Write the JSON reports to this file')
+    args = parser.parse_args(argv)
+
+    if args.no_cache:
+        os.environ['RESPONSE_CACHE_BACKEND'] = 'local'
+        os.environ['RESPONSE_CACHE_MAX_ENTRIES'] = '0'
+
+    deployments = {
+        'wsgi': (gunicorn(args.workers, args.threads), f'http://{args.host}:{args.port}'),
+        'asgi': (uvicorn(args.workers), f'http://{args.host}:{args.port + 1}'),
+    }
+    results = {
+        name: run_deployment(name, command, base_url, args.concurrency, args.duration, args.timeout)
+        for name, (command, base_url) in deployments.items()
+    }
+    print_comparison(results)
+
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump({
+                'config': {
+                    'concurrency': args.concurrency, 'duration': args.duration,
+                    'workers': args.workers, 'threads': args.threads,
+                    'cache': not args.no_cache, 'routes': sorted(HOT_ROUTES),
+                    'servers': {name: urlsplit(url).netloc for name, (_, url) in deployments.items()},
+                },
+                'results': results,
+            }, output, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,153 @@
+"""
+Deterministic documents for benchmark datasets.
+
+Documents have the same shape populate_db writes. Every generator is seeded
+from the dataset size, so a given size always produces the same data.
+"""
+import random
+from datetime import datetime, timedelta, timezone
+from bson import ObjectId
+from octofit_tracker.synthetic import (
+    ACTIVITY_TYPES, DISTANCE_TYPES, FIRST_NAMES, LAST_NAMES, points_for, team_id
+)
+
+DIFFICULTIES = ['beginner', 'intermediate', 'advanced']
+CATEGORIES = ['strength', 'cardio', 'flexibility', 'core']
+EXERCISES = ['Push-ups', 'Pull-ups', 'Squats', 'Plank', 'Burpees', 'Deadlifts', 'Lunges']
+BATCH_SIZE = 10000
+
+NOW = datetime(2025, 1, 1, tzinfo=timezone.utc)
+
+
+def object_id(kind, number):
+    """Stable ObjectId for the number-th document of a collection"""
+    return ObjectId(f'{kind:02x}{number:022x}')
+
+
+def team_count(size):
+    return max(1, min(size // 10, 100))
+
+
+def owner_count(size):
+    # Activities belong to a tenth of the users, ten each like populate_db's default
+    return max(1, size // 10)
+
+
+def user_name(number):
+    first = FIRST_NAMES[number % len(FIRST_NAMES)]
+    last = LAST_NAMES[number // len(FIRST_NAMES) % len(LAST_NAMES)]
+    return f'{first} {last}'
+
+
+def teams(size):
+    for number in range(1, team_count(size) + 1):
+        yield {
+            '_id': team_id(number),
+            'name': f'Team {number}',
+            'description': f'Benchmark team {number}',
+            'created_at': NOW,
+            'member_count': 0,
+        }
+
+
+def users(size):
+    for number in range(size):
+        yield {
+            '_id': object_id(1, number),
+            'name': user_name(number),
+            'email': f'user{number}@octofit.example',
+            'password': f'hashed_password_{number}',
+            'team_id': team_id(number % team_count(size) + 1),
+            'role': 'member',
+            'total_points': size - number,
+            'created_at': NOW,
+        }
+
+
+def activities(size):
+    rng = random.Random(size)
+    owners = owner_count(size)
+    for number in range(size):
+        activity_type = ACTIVITY_TYPES[number % len(ACTIVITY_TYPES)]
+        duration = rng.randint(15, 180)
+        distance = round(rng.uniform(1, 25), 2) if activity_type in DISTANCE_TYPES else 0
+        yield {
+            '_id': object_id(2, number),
+            'user_id': object_id(1, number % owners),
+            'activity_type': activity_type,
+            'duration': duration,
+            'distance': distance,
+            'calories_burned': duration * 10,
+            'points_earned': points_for(activity_type, duration, distance),
+            'date': NOW - timedelta(minutes=number),
+            'notes': f'{activity_type} session',
+        }
+
+
+def leaderboard(size):
+    # Points strictly decrease with position, so rank == position
+    for number in range(size):
+        yield {
+            '_id': object_id(3, number),
+            'user_id': object_id(1, number),
+            'user_name': user_name(number),
+            'team_id': team_id(number % team_count(size) + 1),
+            'total_points': size - number,
+            'activities_count': 10,
+            'rank': number + 1,
+            'last_updated': NOW,
+        }
+
+
+def workouts(size):
+    """Workouts with their exercises as embedded documents"""
+    rng = random.Random(size)
+    for number in range(size):
+        exercises = [
+            {'name': rng.choice(EXERCISES), 'sets': rng.randint(1, 5), 'reps': rng.randint(5, 30)}
+            for _ in range(4)
+        ]
+        yield {
+            '_id': object_id(4, number),
+            'name': f'Workout {number}',
+            'description': 'Benchmark workout',
+            'duration': rng.randint(20, 90),
+            'difficulty': DIFFICULTIES[number % len(DIFFICULTIES)],
+            'exercises': exercises,
+            'category': CATEGORIES[number % len(CATEGORIES)],
+            'created_at': NOW,
+        }
+
+
+DATASETS = {
+    'teams': teams,
+    'users': users,
+    'activities': activities,
+    'leaderboard': leaderboard,
+    'workouts': workouts,
+}
+
+
+def load(db, size):
+    """
+    Drop and reseed every collection of the benchmark database, its rollups,
+    the recommendation features and the search index
+    """
+    # Imported here: these read settings, which are configured after this module loads
+    from octofit_tracker.recommendations import backfill as backfill_features
+    from octofit_tracker.rollups import backfill
+    from octofit_tracker.search import rebuild
+
+    for collection, generate in DATASETS.items():
+        db[collection].drop()
+        batch = []
+        for document in generate(size):
+            batch.append(document)
+            if len(batch) >= BATCH_SIZE:
+                db[collection].insert_many(batch, ordered=False)
+                batch = []
+        if batch:
+            db[collection].insert_many(batch, ordered=False)
+    backfill(db)
+    backfill_features(db)
+    rebuild(db)
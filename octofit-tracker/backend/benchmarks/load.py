@@ -0,0 +1,517 @@
+"""
+Concurrent end-to-end load harness.
+
+Replays a weighted mix of the routes registered on the API router against a
+running server, from a pool of worker threads with keep-alive connections:
+
+    python -m benchmarks.load --duration 30 --concurrency 16
+    python -m benchmarks.load --rate 200 --weight activity.create=0 --output load.json
+    python -m benchmarks.load --start-server --smoke
+
+Without --rate the workers run closed-loop, sending requests back to back.
+With --rate requests are scheduled open-loop at a fixed rate. Latency is then
+measured from the scheduled send time, so queueing behind a slow server is
+counted rather than hidden. Each route reports throughput, its error rate and
+p50/p95/p99 latencies from a log-bucketed histogram.
+"""
+import argparse
+import http.client
+import itertools
+import json
+import math
+import os
+import queue
+import random
+import subprocess
+import sys
+import threading
+import time
+from urllib.parse import urlencode, urlsplit
+
+# Histogram resolution: buckets per decade of milliseconds (~2.3% wide)
+BUCKETS_PER_DECADE = 100
+MIN_LATENCY_MS = 0.01
+
+# Relative frequency of each route; anything discovered but not listed gets 1
+DEFAULT_WEIGHTS = {
+    'leaderboard.list': 10,
+    'leaderboard.top': 20,
+    'leaderboard.rank': 5,
+    'activity.list': 10,
+    'activity.by_user': 8,
+    'user.activities': 8,
+    'activity.create': 2,
+    'activity.export': 0,
+    'activity.bulk': 0,
+}
+
+
+class Histogram:
+    """Log-bucketed latency histogram with bounded memory"""
+
+    def __init__(self):
+        self.buckets = {}
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, latency_ms):
+        bucket = math.floor(math.log10(max(latency_ms, MIN_LATENCY_MS)) * BUCKETS_PER_DECADE)
+        self.buckets[bucket] = self.buckets.get(bucket, 0) + 1
+        self.count += 1
+        self.total += latency_ms
+        self.max = max(self.max, latency_ms)
+
+    def merge(self, other):
+        for bucket, count in other.buckets.items():
+            self.buckets[bucket] = self.buckets.get(bucket, 0) + count
+        self.count += other.count
+        self.total += other.total
+        self.max = max(self.max, other.max)
+
+    def percentile(self, percent):
+        """Upper bound of the bucket holding the given percentile"""
+        if not self.count:
+            return 0.0
+        rank = math.ceil(self.count * percent / 100)
+        seen = 0
+        for bucket in sorted(self.buckets):
+            seen += self.buckets[bucket]
+            if seen >= rank:
+                return min(10 ** ((bucket + 1) / BUCKETS_PER_DECADE), self.max)
+        return self.max
+
+    def to_dict(self):
+        return {
+            'count': self.count,
+            'mean_ms': self.total / self.count if self.count else 0.0,
+            'p50_ms': self.percentile(50),
+            'p95_ms': self.percentile(95),
+            'p99_ms': self.percentile(99),
+            'max_ms': self.max,
+            'buckets': {
+                f'{10 ** (bucket / BUCKETS_PER_DECADE):.4g}': count
+                for bucket, count in sorted(self.buckets.items())
+            },
+        }
+
+
+class RouteStats:
+    def __init__(self):
+        self.latency = Histogram()
+        self.errors = 0
+        self.statuses = {}
+
+    def record(self, status, latency_ms):
+        self.latency.record(latency_ms)
+        self.statuses[status] = self.statuses.get(status, 0) + 1
+        if not isinstance(status, int) or status >= 400:
+            self.errors += 1
+
+    def merge(self, other):
+        self.latency.merge(other.latency)
+        self.errors += other.errors
+        for status, count in other.statuses.items():
+            self.statuses[status] = self.statuses.get(status, 0) + count
+
+
+class Route:
+    """One routed action; ids, params and body are callables drawing fresh values"""
+
+    def __init__(self, name, method, prefix, url_path=None, ids=None, params=None, body=None):
+        self.name = name
+        self.method = method
+        self.prefix = prefix
+        self.url_path = url_path
+        self.ids = ids
+        self.params = params
+        self.body = body
+
+    def request(self):
+        path = f'/api/{self.prefix}/'
+        if self.ids:
+            path += f'{self.ids()}/'
+        if self.url_path:
+            path += f'{self.url_path}/'
+        if self.params:
+            path += '?' + urlencode(self.params())
+        body = self.body() if self.body else None
+        return self.method, path, None if body is None else json.dumps(body)
+
+
+class Client:
+    """Keep-alive HTTP connection owned by one worker thread"""
+
+    def __init__(self, base_url, timeout):
+        parts = urlsplit(base_url)
+        self.connection_class = (
+            http.client.HTTPSConnection if parts.scheme == 'https' else http.client.HTTPConnection
+        )
+        self.netloc = parts.netloc
+        self.prefix = parts.path.rstrip('/')
+        self.timeout = timeout
+        self.connection = None
+
+    def send(self, method, path, body=None):
+        """Return (status, payload bytes); reconnects once on a dropped connection"""
+        headers = {'Accept': 'application/json'}
+        if body is not None:
+            headers['Content-Type'] = 'application/json'
+        for attempt in (1, 2):
+            if self.connection is None:
+                self.connection = self.connection_class(self.netloc, timeout=self.timeout)
+            try:
+                self.connection.request(method, self.prefix + path, body=body, headers=headers)
+                response = self.connection.getresponse()
+                return response.status, response.read()
+            except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                self.close()
+                if attempt == 2:
+                    raise
+            except Exception:
+                self.close()
+                raise
+
+    def get_json(self, path):
+        status, payload = self.send('GET', path)
+        if status != 200:
+            raise RuntimeError(f'GET {path} returned HTTP {status}')
+        return json.loads(payload)
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+
+def results_of(data):
+    return data.get('results', []) if isinstance(data, dict) else data
+
+
+def sample(client, prefix):
+    """Return up to 50 documents of a collection for building requests"""
+    try:
+        return results_of(client.get_json(f'/api/{prefix}/?page_size=50'))
+    except (OSError, RuntimeError, ValueError):
+        return []
+
+
+def discover_routes(client, weights):
+    """
+    Build the weighted route mix from the router in octofit_tracker.urls.
+    Ids and filter values are sampled from the running server; routes whose
+    parameters cannot be filled are reported and left out.
+    """
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'octofit_tracker.settings')
+    import django
+    django.setup()
+    from octofit_tracker.urls import router
+
+    samples = {prefix: sample(client, prefix) for prefix, _, _ in router.registry}
+    users = samples.get('users', [])
+    workouts = samples.get('workouts', [])
+    serial = itertools.count()
+    run_id = f'{os.getpid()}-{int(time.time())}'
+
+    def pick(documents, field='_id'):
+        values = [document[field] for document in documents if document.get(field)]
+        return (lambda: random.choice(values)) if values else None
+
+    user_id = pick(users)
+    team_id = pick(users, 'team_id')
+    difficulty = pick(workouts, 'difficulty')
+    category = pick(workouts, 'category')
+
+    def new_activity():
+        return {
+            '_id': f'load-{run_id}-{next(serial)}',
+            'user_id': user_id(),
+            'activity_type': 'Running',
+            'duration': 30,
+            'distance': 5.0,
+            'calories_burned': 300,
+            'points_earned': 110,
+            'date': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+            'notes': 'load test',
+        }
+
+    params = {
+        'user.by_team': team_id and (lambda: {'team_id': team_id()}),
+        'leaderboard.by_team': team_id and (lambda: {'team_id': team_id()}),
+        'activity.by_user': user_id and (lambda: {'user_id': user_id()}),
+        'activity.stats': user_id and (lambda: {'user_id': user_id(), 'period': 'week'}),
+        'activity.team_stats': team_id and (lambda: {'team_id': team_id()}),
+        'activity.by_type': lambda: {'type': random.choice(['Running', 'Cycling', 'Yoga'])},
+        'leaderboard.rank': user_id and (lambda: {'user_id': user_id(), 'k': 5}),
+        'leaderboard.top': lambda: {'limit': 10},
+        'workout.by_difficulty': difficulty and (lambda: {'difficulty': difficulty()}),
+        'workout.by_category': category and (lambda: {'category': category()}),
+        'activity.export': lambda: {'type': 'Running'},
+    }
+    bodies = {
+        'activity.create': user_id and new_activity,
+        'activity.bulk': user_id and (
+            lambda: [
+                {key: value for key, value in new_activity().items() if key != '_id'}
+                for _ in range(10)
+            ]
+        ),
+    }
+
+    routes, skipped = [], []
+    for prefix, viewset, basename in router.registry:
+        ids = pick(samples[prefix])
+        templates = [('list', 'GET', False, None), ('retrieve', 'GET', True, None)]
+        templates += [
+            (extra.__name__, method.upper(), extra.detail, extra.url_path)
+            for extra in viewset.get_extra_actions() for method in extra.mapping
+        ]
+        if basename == 'activity':
+            templates.append(('create', 'POST', False, None))
+        for action, method, detail, url_path in templates:
+            name = f'{basename}.{action}'
+            weight = weights.get(name, 1)
+            if weight <= 0:
+                continue
+            if detail and ids is None:
+                skipped.append((name, f'no {prefix} to address'))
+                continue
+            if (name in params and params[name] is None) or (name in bodies and bodies[name] is None):
+                skipped.append((name, 'no sample data for its parameters'))
+                continue
+            routes.append((weight, Route(
+                name, method, prefix, url_path,
+                ids=ids if detail else None, params=params.get(name), body=bodies.get(name)
+            )))
+    return routes, skipped
+
+
+class Runner:
+    """Drive the route mix closed-loop or open-loop and collect stats"""
+
+    def __init__(self, base_url, routes, concurrency, duration, rate=None, timeout=30, seed=None):
+        self.base_url = base_url
+        self.routes = [route for _, route in routes]
+        self.weights = list(itertools.accumulate(weight for weight, _ in routes))
+        self.concurrency = concurrency
+        self.duration = duration
+        self.rate = rate
+        self.timeout = timeout
+        self.random = random.Random(seed)
+        self.stats = {}
+        self._lock = threading.Lock()
+
+    def choose(self):
+        with self._lock:
+            return self.random.choices(self.routes, cum_weights=self.weights)[0]
+
+    def execute(self, client, local, route, scheduled):
+        method, path, body = route.request()
+        try:
+            status, _ = client.send(method, path, body)
+        except Exception as exc:
+            status = type(exc).__name__
+        latency_ms = (time.perf_counter() - scheduled) * 1000
+        local.setdefault(route.name, RouteStats()).record(status, latency_ms)
+
+    def closed_loop_worker(self, deadline):
+        client, local = Client(self.base_url, self.timeout), {}
+        while time.perf_counter() < deadline:
+            self.execute(client, local, self.choose(), time.perf_counter())
+        client.close()
+        self.collect(local)
+
+    def open_loop_worker(self, schedule):
+        client, local = Client(self.base_url, self.timeout), {}
+        while True:
+            item = schedule.get()
+            if item is None:
+                break
+            route, scheduled = item
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            self.execute(client, local, route, scheduled)
+        client.close()
+        self.collect(local)
+
+    def collect(self, local):
+        with self._lock:
+            for name, route_stats in local.items():
+                self.stats.setdefault(name, RouteStats()).merge(route_stats)
+
+    def run(self):
+        started = time.perf_counter()
+        deadline = started + self.duration
+        if self.rate:
+            # Unbounded queue: a saturated server shows up as latency, not as
+            # a slower send rate
+            schedule = queue.Queue()
+            workers = [
+                threading.Thread(target=self.open_loop_worker, args=(schedule,), daemon=True)
+                for _ in range(self.concurrency)
+            ]
+            for worker in workers:
+                worker.start()
+            for number in itertools.count():
+                scheduled = started + number / self.rate
+                if scheduled >= deadline:
+                    break
+                schedule.put((self.choose(), scheduled))
+                ahead = scheduled - time.perf_counter()
+                if ahead > 0.05:
+                    time.sleep(ahead - 0.05)
+            for _ in workers:
+                schedule.put(None)
+        else:
+            workers = [
+                threading.Thread(target=self.closed_loop_worker, args=(deadline,), daemon=True)
+                for _ in range(self.concurrency)
+            ]
+            for worker in workers:
+                worker.start()
+        for worker in workers:
+            worker.join()
+        return time.perf_counter() - started
+
+
+def summarize(stats, elapsed):
+    """Return the JSON report: per-route and overall throughput, errors and latency"""
+    total = RouteStats()
+    routes = {}
+    for name in sorted(stats):
+        total.merge(stats[name])
+        routes[name] = route_summary(stats[name], elapsed)
+    return {'elapsed_seconds': elapsed, 'total': route_summary(total, elapsed), 'routes': routes}
+
+
+def route_summary(route_stats, elapsed):
+    latency = route_stats.latency.to_dict()
+    return {
+        'requests': latency['count'],
+        'throughput_rps': latency['count'] / elapsed if elapsed else 0.0,
+        'errors': route_stats.errors,
+        'error_rate': route_stats.errors / latency['count'] if latency['count'] else 0.0,
+        'statuses': {str(status): count for status, count in route_stats.statuses.items()},
+        'latency': latency,
+    }
+
+
+def print_report(report, out=sys.stdout):
+    header = (f'{"route":<28} {"requests":>9} {"rps":>9} {"errors":>8} '
+              f'{"p50 ms":>9} {"p95 ms":>9} {"p99 ms":>9} {"max ms":>9}')
+    out.write(header + '\n' + '-' * len(header) + '\n')
+    rows = list(report['routes'].items()) + [('TOTAL', report['total'])]
+    for name, row in rows:
+        latency = row['latency']
+        out.write(
+            f'{name:<28} {row["requests"]:>9} {row["throughput_rps"]:>9.1f} '
+            f'{row["error_rate"]:>8.2%} {latency["p50_ms"]:>9.2f} {latency["p95_ms"]:>9.2f} '
+            f'{latency["p99_ms"]:>9.2f} {latency["max_ms"]:>9.2f}\n'
+        )
+
+
+def start_server(base_url, command=None):
+    """
+    Start a server for base_url and wait until it answers. `command` is
+    called with the bind address and returns the argv to run; the default
+    is manage.py runserver.
+    """
+    parts = urlsplit(base_url)
+    address = f'{parts.hostname}:{parts.port or 80}'
+    if command is None:
+        argv = [sys.executable, 'manage.py', 'runserver', address, '--noreload']
+    else:
+        argv = command(address)
+    backend = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    process = subprocess.Popen(
+        argv, cwd=backend, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    client = Client(base_url, timeout=2)
+    for _ in range(100):
+        if process.poll() is not None:
+            raise RuntimeError(f'{" ".join(argv)} exited during startup')
+        try:
+            client.send('GET', '/api/')
+            client.close()
+            return process
+        except OSError:
+            time.sleep(0.1)
+    process.terminate()
+    raise RuntimeError(f'server at {base_url} did not start')
+
+
+def parse_weights(values):
+    weights = dict(DEFAULT_WEIGHTS)
+    for value in values or []:
+        name, _, weight = value.partition('=')
+        weights[name] = float(weight)
+    return weights
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.load', description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--base-url', default=os.getenv('BASE_URL', 'http://localhost:8000'))
+    parser.add_argument('--concurrency', type=int, default=8, help='Worker threads (default 8)')
+    parser.add_argument('--duration', type=float, default=30, help='Seconds to run (default 30)')
+    parser.add_argument('--rate', type=float,
+                        help='Open-loop requests per second; closed-loop when omitted')
+    parser.add_argument('--weight', action='append', metavar='ROUTE=WEIGHT',
+                        help='Override a route weight, e.g. activity.create=0 (repeatable)')
+    parser.add_argument('--timeout', type=float, default=30, help='Per-request timeout in seconds')
+    parser.add_argument('--seed', type=int, help='Seed for the route choice sequence')
+    parser.add_argument('--output', help='Write the JSON report to this file')
+    parser.add_argument('--start-server', action='store_true',
+                        help='Start manage.py runserver on --base-url for the run')
+    parser.add_argument('--smoke', action='store_true',
+                        help='Call every route once, serially, and fail on any error')
+    args = parser.parse_args(argv)
+
+    server = start_server(args.base_url) if args.start_server else None
+    try:
+        client = Client(args.base_url, args.timeout)
+        weights = parse_weights(args.weight)
+        if args.smoke:
+            weights = {name: 1 for name in weights}
+        routes, skipped = discover_routes(client, weights)
+        client.close()
+        for name, reason in skipped:
+            print(f'skipping {name}: {reason}', file=sys.stderr)
+        if not routes:
+            print('no routes to load', file=sys.stderr)
+            return 1
+
+        if args.smoke:
+            runner = Runner(args.base_url, routes, 1, 0)
+            local = {}
+            client = Client(args.base_url, args.timeout)
+            started = time.perf_counter()
+            for _, route in routes:
+                runner.execute(client, local, route, time.perf_counter())
+            client.close()
+            runner.collect(local)
+            elapsed = time.perf_counter() - started
+        else:
+            runner = Runner(args.base_url, routes, args.concurrency, args.duration,
+                            rate=args.rate, timeout=args.timeout, seed=args.seed)
+            elapsed = runner.run()
+
+        report = summarize(runner.stats, elapsed)
+        report['config'] = {
+            'base_url': args.base_url, 'concurrency': args.concurrency, 'rate': args.rate,
+            'duration': args.duration, 'weights': {route.name: weight for weight, route in routes},
+        }
+        print_report(report)
+        if args.output:
+            with open(args.output, 'w') as output:
+                json.dump(report, output, indent=2)
+        return 1 if args.smoke and report['total']['errors'] else 0
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
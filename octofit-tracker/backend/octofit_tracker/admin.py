@@ -1,5 +1,41 @@
 from django.contrib import admin
+from django.shortcuts import redirect
+from django.template.response import TemplateResponse
+from .documents import get_collection, id_candidates, id_filter
 from .models import Team, User, Activity, Leaderboard, Workout
+from .search import KINDS, matches
+from .slowlog import slow_log
+
+
+class IndexedSearchMixin:
+    """
+    Admin search through the inverted search index instead of regex scans.
+    Text is matched in the index for `search_kind`; `exact_search_fields`
+    are matched on the whole search term, and those also in `id_search_fields`
+    on every form an id may be stored under. The index holds ids as strings,
+    so each is expanded the same way.
+    """
+    search_kind = None
+    exact_search_fields = ()
+    id_search_fields = ()
+    max_search_results = 1000
+
+    def get_search_results(self, request, queryset, search_term):
+        search_term = search_term.strip()
+        if not search_term:
+            return queryset, False
+        ranked = matches(self.search_kind, search_term, self.max_search_results)
+        ids = [doc_id for doc_id, _ in ranked]
+        if self.exact_search_fields:
+            collection = get_collection(KINDS[self.search_kind].model)
+            exact = collection.find({'$or': [
+                id_filter(search_term, field) if field in self.id_search_fields
+                else {field: search_term}
+                for field in self.exact_search_fields
+            ]}, {'_id': 1}).limit(self.max_search_results)
+            ids.extend(str(document['_id']) for document in exact)
+        candidates = [candidate for doc_id in ids for candidate in id_candidates(doc_id)]
+        return queryset.filter(pk__in=candidates), False
 
 
 @admin.register(Team)
@@ -22,11 +58,14 @@ class UserAdmin(admin.ModelAdmin):
 
 
 @admin.register(Activity)
-class ActivityAdmin(admin.ModelAdmin):
+class ActivityAdmin(IndexedSearchMixin, admin.ModelAdmin):
     """Admin interface for Activity model"""
     list_display = ['_id', 'user_id', 'activity_type', 'duration', 'distance', 
                     'calories_burned', 'points_earned', 'date']
     search_fields = ['user_id', 'activity_type', 'notes']
+    search_kind = 'activity'
+    exact_search_fields = ('user_id', 'activity_type')
+    id_search_fields = ('user_id',)
     list_filter = ['activity_type', 'date']
     ordering = ['-date']
     date_hierarchy = 'date'
@@ -44,10 +83,32 @@ class LeaderboardAdmin(admin.ModelAdmin):
 
 
 @admin.register(Workout)
-class WorkoutAdmin(admin.ModelAdmin):
+class WorkoutAdmin(IndexedSearchMixin, admin.ModelAdmin):
     """Admin interface for Workout model"""
     list_display = ['_id', 'name', 'category', 'difficulty', 'duration', 'created_at']
     search_fields = ['name', 'description', 'category']
+    search_kind = 'workout'
+    exact_search_fields = ('category',)
     list_filter = ['difficulty', 'category', 'created_at']
     ordering = ['name']
     readonly_fields = ['created_at']
+
+
+def slow_commands(request):
+    """Admin page listing the slow MongoDB command log, newest first"""
+    if request.method == 'POST':
+        slow_log.clear()
+        return redirect('admin-slow-commands')
+    entries = slow_log.records()
+    if request.GET.get('collscan'):
+        entries = [entry for entry in entries if entry.collscan]
+    context = dict(
+        admin.site.each_context(request),
+        title='Slow MongoDB commands',
+        entries=entries,
+        threshold_ms=slow_log.threshold * 1000,
+        sample_rate=slow_log.sample_rate,
+        enabled=slow_log.enabled,
+        collscan_only=bool(request.GET.get('collscan')),
+    )
+    return TemplateResponse(request, 'admin/octofit_tracker/slow_commands.html', context)
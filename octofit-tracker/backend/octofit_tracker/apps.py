@@ -0,0 +1,24 @@
+from django.apps import AppConfig
+from django.db.models.signals import post_delete, post_save
+
+
+class OctofitTrackerConfig(AppConfig):
+    name = 'octofit_tracker'
+
+    def ready(self):
+        from pymongo import monitoring
+        from . import catalog, search
+        from .metrics import command_listener
+        from .models import Activity, Workout
+        from .slowlog import slow_log
+        # Registered before any client exists so every MongoClient,
+        # djongo's included, reports its commands
+        monitoring.register(command_listener)
+        monitoring.register(slow_log)
+        # ORM writes made outside WorkoutViewSet, e.g. in the admin
+        post_save.connect(catalog.invalidate, sender=Workout)
+        post_delete.connect(catalog.invalidate, sender=Workout)
+        # Raw PyMongo writes update the search index themselves
+        for model in (Activity, Workout):
+            post_save.connect(search.index_saved, sender=model)
+            post_delete.connect(search.remove_deleted, sender=model)
@@ -12,5 +12,13 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'octofit_tracker.settings')
+# Serve the hot read endpoints from the native async views
+os.environ.setdefault('OCTOFIT_URLCONF', 'octofit_tracker.urls_async')
 
 application = get_asgi_application()
+
+from octofit_tracker.writebehind import write_behind  # noqa: E402  (needs the app registry)
+
+if write_behind.enabled:
+    # Persist any activities a stopped server left in the queue
+    write_behind.start()
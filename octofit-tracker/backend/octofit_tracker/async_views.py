@@ -0,0 +1,192 @@
+"""
+Native async versions of the hot read endpoints.
+
+Served through asgi.py, whose URLconf (urls_async) routes these paths here
+ahead of the DRF router. Reads go through Motor, so a slow MongoDB response
+parks a coroutine instead of a worker thread; the workout list is paged
+from the in-memory catalog. Responses match the DRF views:
+the same serializers, keyset pagination and response cache entries. Any
+method other than GET falls through to the DRF viewset.
+"""
+from collections import OrderedDict
+from types import SimpleNamespace
+from asgiref.sync import sync_to_async
+from django.http import HttpResponse
+from rest_framework.exceptions import APIException
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+from . import catalog, fast, leaderboard
+from .cache import response_cache
+from .documents import id_candidates, id_filter, to_instance
+from .models import Team, Activity, Leaderboard, Workout
+from .mongo import get_async_db
+from .pagination import ActivityPagination, KeysetPagination, LeaderboardPagination
+from .serializers import (
+    UNKNOWN_USER, FastReadMixin, TeamSerializer, ActivitySerializer, LeaderboardSerializer,
+    WorkoutSerializer, UserNameMap
+)
+from .views import TeamViewSet, ActivityViewSet, LeaderboardViewSet, WorkoutViewSet
+from .writebehind import write_behind
+
+renderer = api_settings.DEFAULT_RENDERER_CLASSES[0]()
+
+# The response cache backend may block on the network, so it runs off the event loop
+cache_get = sync_to_async(response_cache.get, thread_sensitive=False)
+cache_set = sync_to_async(response_cache.set, thread_sensitive=False)
+
+
+def render(data, status=200):
+    return HttpResponse(renderer.render(data), status=status, content_type='application/json')
+
+
+def read_view(viewset, actions):
+    """
+    Turn an async GET handler into a view that hands other methods to the
+    DRF viewset and renders API exceptions the way DRF does.
+    """
+    sync_view = sync_to_async(viewset.as_view(actions))
+
+    def decorator(handler):
+        async def view(request, *args, **kwargs):
+            if request.method != 'GET':
+                return await sync_view(request, *args, **kwargs)
+            try:
+                return await handler(Request(request), *args, **kwargs)
+            except APIException as exc:
+                data = exc.detail if isinstance(exc.detail, (list, dict)) else {'detail': exc.detail}
+                return render(data, status=exc.status_code)
+        # csrf_exempt() would wrap the coroutine in a sync function on Django 4.1
+        view.csrf_exempt = True
+        # Read by MetricsMiddleware, as on DRF viewset views
+        view.actions = actions
+        return view
+    return decorator
+
+
+async def cached(request, basename, action, collections, build):
+    """Serve from the response cache shared with the DRF views, or build and store"""
+    view = SimpleNamespace(basename=basename, action=action)
+    key = response_cache.make_key(view, request, collections, {})
+    data = await cache_get(key)
+    if data is not None:
+        response = render(data)
+        response['X-Cache'] = 'HIT'
+        return response
+    data = await build()
+    await cache_set(key, data)
+    response = render(data)
+    response['X-Cache'] = 'MISS'
+    return response
+
+
+async def resolve_user_names(db, user_ids):
+    """Async counterpart of UserNameMap.resolve"""
+    user_names = UserNameMap()
+    missing = {str(user_id) for user_id in user_ids if user_id is not None}
+    if missing:
+        candidates = [candidate for user_id in missing for candidate in id_candidates(user_id)]
+        async for user in db.users.find({'_id': {'$in': candidates}}, {'name': 1}):
+            user_names[str(user['_id'])] = user.get('name', UNKNOWN_USER)
+    for user_id in missing:
+        user_names.setdefault(user_id, UNKNOWN_USER)
+    return user_names
+
+
+async def page(request, model, serializer_class, query, pagination_class=KeysetPagination,
+               pending=()):
+    """Serialize one keyset page of `model` documents, as MongoListMixin does"""
+    db = get_async_db()
+    paginator = pagination_class()
+    selection = serializer_class(context={'request': request})
+    projection = paginator.get_projection(selection.get_projection())
+    cursor = (
+        db[model._meta.db_table]
+        .find(paginator.get_page_query(query, request), projection)
+        .sort(paginator.get_sort())
+        .limit(paginator.page_size + 1)
+    )
+    documents = paginator.set_page(await cursor.to_list(length=None))
+    documents = paginator.merge_first_page(documents, list(pending))
+    if model is Activity and 'user_name' in selection.fields:
+        request._user_names = await resolve_user_names(
+            db, [document.get('user_id') for document in documents]
+        )
+    data = serialize(selection, model, documents)
+    return OrderedDict([('next', paginator.get_next_link()), ('results', data)])
+
+
+async def catalog_page(request):
+    """Serialize one keyset page of the workout catalog, as WorkoutViewSet does"""
+    workouts = catalog.current_catalog() or await sync_to_async(catalog.get_catalog)()
+    paginator = KeysetPagination()
+    selection = WorkoutSerializer(context={'request': request})
+    documents = paginator.paginate_sorted(workouts.all.documents, workouts.all.keys, request)
+    data = serialize(selection, Workout, documents)
+    return OrderedDict([('next', paginator.get_next_link()), ('results', data)])
+
+
+def serialize(selection, model, documents):
+    """Serialize raw documents with the serializer class and context of `selection`"""
+    if fast.enabled() and isinstance(selection, FastReadMixin):
+        return selection.to_documents_representation(documents)
+    instances = [to_instance(model, document) for document in documents]
+    return type(selection)(instances, many=True, context=selection.context).data
+
+
+@read_view(TeamViewSet, {'get': 'list', 'post': 'create'})
+async def team_list(request):
+    return await cached(request, 'team', 'list', ('teams',), lambda: page(
+        request, Team, TeamSerializer, {}
+    ))
+
+
+@read_view(WorkoutViewSet, {'get': 'list', 'post': 'create'})
+async def workout_list(request):
+    return await cached(request, 'workout', 'list', ('workouts',), lambda: catalog_page(request))
+
+
+@read_view(LeaderboardViewSet, {'get': 'list', 'post': 'create'})
+async def leaderboard_list(request):
+    return await cached(request, 'leaderboard', 'list', ('leaderboard',), lambda: page(
+        request, Leaderboard, LeaderboardSerializer, {}, LeaderboardPagination
+    ))
+
+
+@read_view(LeaderboardViewSet, {'get': 'top'})
+async def leaderboard_top(request):
+    try:
+        limit = int(request.query_params.get('limit', 10))
+    except ValueError:
+        return render({'error': 'limit must be an integer'}, status=400)
+    limit = max(1, min(limit, leaderboard.HEAD_SIZE))
+
+    async def build():
+        documents = leaderboard.cached_head()
+        if documents is None:
+            cursor = (
+                get_async_db()[Leaderboard._meta.db_table]
+                .find()
+                .sort(leaderboard.HEAD_SORT)
+                .limit(leaderboard.HEAD_SIZE)
+            )
+            documents = leaderboard.store_head(await cursor.to_list(length=None))
+        entries = [to_instance(Leaderboard, entry) for entry in documents[:limit]]
+        return LeaderboardSerializer(entries, many=True, context={'request': request}).data
+
+    return await cached(request, 'leaderboard', 'top', ('leaderboard',), build)
+
+
+@read_view(ActivityViewSet, {'get': 'by_user'})
+async def activities_by_user(request):
+    user_id = request.query_params.get('user_id', None)
+    if not user_id:
+        return render({'error': 'user_id parameter is required'}, status=400)
+    # Other workers' queued segments are read from disk, off the event loop
+    pending = ()
+    if write_behind.enabled:
+        read_pending = sync_to_async(write_behind.pending_for_user, thread_sensitive=False)
+        pending = await read_pending(user_id)
+    return render(await page(
+        request, Activity, ActivitySerializer, id_filter(user_id, 'user_id'), ActivityPagination,
+        pending=pending
+    ))
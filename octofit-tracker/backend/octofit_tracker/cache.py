@@ -0,0 +1,239 @@
+"""
+Read-through response cache for hot read endpoints.
+
+Entries are keyed on the viewset, action, URL kwargs, normalized query
+parameters and the current generation of every collection the response
+reads. Writes bump the generation of the collections they touch, so a stale
+entry can never be served again and simply ages out of the cache.
+
+The default backend is a per-process LRU with a TTL and a size bound. Set
+RESPONSE_CACHE['BACKEND'] to a CACHES alias to share entries (and
+generations) between workers.
+"""
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework import status
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework.response import Response
+
+DEFAULTS = {
+    'BACKEND': 'local',
+    'TTL': 30,
+    'MAX_ENTRIES': 1024,
+    'KEY_PREFIX': 'octofit',
+}
+
+
+class LocalLRUCache:
+    """Thread-safe in-process LRU cache with per-entry expiry"""
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._generations = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires = entry
+            if time.monotonic() >= expires:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def get_generations(self, names):
+        with self._lock:
+            return [self._generations.get(name, 0) for name in names]
+
+    def bump_generation(self, name):
+        with self._lock:
+            self._generations[name] = self._generations.get(name, 0) + 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._generations.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class SharedCache:
+    """Adapter storing entries and generations in a Django cache alias"""
+
+    def __init__(self, alias, prefix):
+        self.cache = caches[alias]
+        self.prefix = prefix
+
+    def _generation_key(self, name):
+        return f'{self.prefix}:generation:{name}'
+
+    def get(self, key):
+        return self.cache.get(key)
+
+    def set(self, key, value, ttl):
+        self.cache.set(key, value, ttl)
+
+    def get_generations(self, names):
+        keys = [self._generation_key(name) for name in names]
+        found = self.cache.get_many(keys)
+        return [found.get(key, 0) for key in keys]
+
+    def bump_generation(self, name):
+        key = self._generation_key(name)
+        # Generations must outlive every entry built on them
+        if not self.cache.add(key, 1, timeout=None):
+            try:
+                self.cache.incr(key)
+            except ValueError:
+                self.cache.set(key, 1, timeout=None)
+
+    def clear(self):
+        self.cache.clear()
+
+
+class ResponseCache:
+    """Response cache with hit/miss counters and generation-based invalidation"""
+
+    def __init__(self, backend, ttl, prefix):
+        self.backend = backend
+        self.ttl = ttl
+        self.prefix = prefix
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self._lock = threading.Lock()
+
+    def make_key(self, view, request, collections, kwargs):
+        params = sorted(
+            (name, sorted(request.query_params.getlist(name)))
+            for name in request.query_params
+        )
+        generations = self.backend.get_generations(collections)
+        raw = repr((
+            request.get_host(), view.basename, view.action, sorted(kwargs.items()),
+            params, list(zip(collections, generations)),
+        ))
+        return f'{self.prefix}:response:{hashlib.sha1(raw.encode("utf-8")).hexdigest()}'
+
+    def get(self, key):
+        data = self.backend.get(key)
+        with self._lock:
+            if data is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return data
+
+    def set(self, key, data):
+        self.backend.set(key, data, self.ttl)
+
+    def generation(self, collection):
+        """Return the collection's current generation, bumped by every write"""
+        return self.backend.get_generations([collection])[0]
+
+    def invalidate(self, *collections):
+        for name in collections:
+            self.backend.bump_generation(name)
+        with self._lock:
+            self.invalidations += 1
+
+    def clear(self):
+        self.backend.clear()
+        with self._lock:
+            self.hits = self.misses = self.invalidations = 0
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        stats = {
+            'backend': type(self.backend).__name__,
+            'ttl': self.ttl,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': round(self.hits / lookups, 4) if lookups else 0.0,
+            'invalidations': self.invalidations,
+        }
+        if isinstance(self.backend, LocalLRUCache):
+            stats['entries'] = len(self.backend)
+            stats['max_entries'] = self.backend.max_entries
+        return stats
+
+
+def _build_cache():
+    config = dict(DEFAULTS, **getattr(settings, 'RESPONSE_CACHE', {}))
+    if config['BACKEND'] == 'local':
+        backend = LocalLRUCache(config['MAX_ENTRIES'])
+    else:
+        backend = SharedCache(config['BACKEND'], config['KEY_PREFIX'])
+    return ResponseCache(backend, config['TTL'], config['KEY_PREFIX'])
+
+
+response_cache = _build_cache()
+
+
+def invalidate(*collections):
+    """Invalidate every cached response that reads any of `collections`"""
+    response_cache.invalidate(*collections)
+
+
+class TaggedEntry:
+    """A cached response body with the ETag it was served with"""
+    __slots__ = ('data', 'etag')
+
+    def __init__(self, data, etag):
+        self.data = data
+        self.etag = etag
+
+
+def cache_response(*collections):
+    """
+    Cache a viewset handler's successful responses, with their ETag if any.
+    `collections` names every MongoDB collection the response reads.
+    """
+    def decorator(method):
+        @wraps(method)
+        def wrapper(self, request, *args, **kwargs):
+            key = response_cache.make_key(self, request, collections, kwargs)
+            data = response_cache.get(key)
+            if data is not None:
+                if isinstance(data, TaggedEntry):
+                    response = Response(data.data)
+                    response['ETag'] = data.etag
+                else:
+                    response = Response(data)
+                response['X-Cache'] = 'HIT'
+                return response
+
+            response = method(self, request, *args, **kwargs)
+            if response.status_code == status.HTTP_200_OK:
+                etag = response.get('ETag')
+                response_cache.set(key, response.data if etag is None else TaggedEntry(response.data, etag))
+            response['X-Cache'] = 'MISS'
+            return response
+        return wrapper
+    return decorator
+
+
+class CacheInvalidationMixin:
+    """Invalidate the viewset's collection after any successful write"""
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        if request.method not in SAFE_METHODS and status.is_success(response.status_code):
+            invalidate(self.queryset.model._meta.db_table)
+        return super().finalize_response(request, response, *args, **kwargs)
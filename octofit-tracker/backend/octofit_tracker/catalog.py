@@ -0,0 +1,176 @@
+"""
+In-memory workout catalog.
+
+The catalog is small and changes rarely, so each worker keeps every
+workout document in memory. Documents are kept in `_id` order, with
+prebuilt indexes by id, difficulty, category and exercise name. Workout
+lists and searches page through these lists and never query MongoDB.
+
+Each snapshot is immutable and carries a version number. A snapshot is
+replaced when:
+- the viewset writes a workout (refresh());
+- ORM writes happen elsewhere, through the post_save and post_delete
+  signals (invalidate());
+- another worker writes, seen through the 'workouts' response cache
+  generation when the cache is shared;
+- WORKOUT_CATALOG_TTL runs out, for writes made outside Django.
+
+Documents still holding exercises as JSON text are served with the text
+parsed; `manage.py convert_workout_exercises` stores them as embedded
+documents.
+"""
+import json
+import os
+import threading
+import time
+from collections import namedtuple
+from itertools import count
+from django.conf import settings
+from pymongo import UpdateOne
+from .cache import invalidate as invalidate_responses, response_cache
+from .documents import get_collection
+from .export import iter_batches
+from .models import Workout
+from .pagination import KeysetPagination
+
+CATALOG_TTL = getattr(settings, 'WORKOUT_CATALOG_TTL', 60)
+COLLECTION = Workout._meta.db_table
+
+# Documents in _id order with their KeysetPagination sort keys
+Listing = namedtuple('Listing', ['documents', 'keys'])
+EMPTY_LISTING = Listing((), ())
+
+_lock = threading.Lock()
+_versions = count(1)
+_catalog = None
+
+
+def parse_exercises(value):
+    """Return stored exercises as a list of embedded documents"""
+    if isinstance(value, str):
+        try:
+            value = json.loads(value)
+        except ValueError:
+            return []
+    return value if isinstance(value, list) else []
+
+
+def exercise_names(document):
+    return {
+        exercise['name'].lower() for exercise in document['exercises']
+        if isinstance(exercise, dict) and isinstance(exercise.get('name'), str)
+    }
+
+
+class WorkoutCatalog:
+    """Immutable snapshot of every workout and its indexes"""
+
+    def __init__(self, documents, generation):
+        self.version = next(_versions)
+        self.generation = generation
+        self.expires = time.monotonic() + CATALOG_TTL
+        paginator = KeysetPagination()
+        documents = sorted(documents, key=paginator.sort_key)
+        self.all = Listing(documents, [paginator.sort_key(document) for document in documents])
+        self.by_id = {str(document['_id']): document for document in documents}
+        self.by_difficulty = self.index(lambda document: [document.get('difficulty')])
+        self.by_category = self.index(lambda document: [document.get('category')])
+        self.by_exercise = self.index(exercise_names)
+
+    def index(self, values):
+        """Group the sorted documents by each value `values` returns for them"""
+        groups = {}
+        for document, key in zip(self.all.documents, self.all.keys):
+            for value in values(document):
+                listing = groups.setdefault(value, Listing([], []))
+                listing.documents.append(document)
+                listing.keys.append(key)
+        return groups
+
+    def is_current(self):
+        return (time.monotonic() < self.expires
+                and response_cache.generation(COLLECTION) == self.generation)
+
+    def __len__(self):
+        return len(self.all.documents)
+
+
+def load():
+    """Read every workout, with JSON text exercises parsed"""
+    documents = list(get_collection(Workout).find())
+    for document in documents:
+        if not isinstance(document.get('exercises'), list):
+            document['exercises'] = parse_exercises(document.get('exercises'))
+    return documents
+
+
+def convert_exercises(batch_size=1000):
+    """
+    Store exercises kept as JSON text as embedded documents and return the
+    number of workouts converted. A workout changed meanwhile is left alone.
+    """
+    collection = get_collection(Workout)
+    cursor = collection.find(
+        {'exercises': {'$not': {'$type': 'array'}}}, {'exercises': 1}
+    ).batch_size(batch_size)
+    converted = 0
+    for batch in iter_batches(cursor, batch_size):
+        result = collection.bulk_write([
+            UpdateOne(
+                {'_id': document['_id'], 'exercises': document.get('exercises')},
+                {'$set': {'exercises': parse_exercises(document.get('exercises'))}}
+            )
+            for document in batch
+        ], ordered=False)
+        converted += result.modified_count
+    if converted:
+        invalidate_responses(COLLECTION)
+    return converted
+
+
+def current_catalog():
+    """Return the catalog if it is still current, otherwise None"""
+    catalog = _catalog
+    if catalog is not None and catalog.is_current():
+        return catalog
+    return None
+
+
+def get_catalog():
+    """Return the current catalog, loading it when missing or stale"""
+    catalog = current_catalog()
+    if catalog is None:
+        with _lock:
+            # Another thread may have loaded it while this one waited
+            catalog = current_catalog() or _rebuild()
+    return catalog
+
+
+def refresh():
+    """Rebuild the catalog from MongoDB and return it, e.g. after a write"""
+    with _lock:
+        return _rebuild()
+
+
+def _rebuild():
+    global _catalog
+    # Read before loading: a write landing during the load bumps it again
+    generation = response_cache.generation(COLLECTION)
+    _catalog = WorkoutCatalog(load(), generation)
+    return _catalog
+
+
+def invalidate(*args, **kwargs):
+    """Drop the catalog; usable as a signal receiver"""
+    global _catalog
+    _catalog = None
+
+
+def _reset_after_fork():
+    # The lock may have been held by another thread at fork time
+    global _lock
+    _lock = threading.Lock()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
@@ -0,0 +1,43 @@
+from bson import ObjectId
+from django.db import connection
+from .mongo import get_db
+
+# Counter incremented by every API update, served as the ETag (see mixins.MongoUpdateMixin)
+VERSION = 'version'
+
+
+def get_collection(model):
+    """Return the PyMongo collection backing a model on the pooled client"""
+    return get_db()[model._meta.db_table]
+
+
+def id_candidates(value):
+    """
+    Return every form an `_id` may be stored in.
+    Documents inserted through the ORM use string ids while documents
+    inserted with PyMongo (populate_db) use ObjectIds.
+    """
+    if isinstance(value, ObjectId):
+        return [value, str(value)]
+    value = str(value)
+    if ObjectId.is_valid(value):
+        return [value, ObjectId(value)]
+    return [value]
+
+
+def id_filter(value, field='_id'):
+    """Build an indexed equality filter matching string and ObjectId ids"""
+    return {field: {'$in': id_candidates(value)}}
+
+
+def to_instance(model, document):
+    """Build a model instance from a raw MongoDB document without a query"""
+    fields = model._meta.concrete_fields
+    values = [
+        document[field.attname] if field.attname in document else field.get_default()
+        for field in fields
+    ]
+    instance = model.from_db(connection.alias, [field.attname for field in fields], values)
+    # Not a model field; documents never updated through the API are at 0
+    instance._version = document.get(VERSION, 0)
+    return instance
@@ -0,0 +1,64 @@
+"""
+Streaming exports of raw MongoDB cursors.
+
+Documents are pulled from the server `batch_size` at a time, serialized a
+batch at a time and written straight to the response, so memory use stays
+constant however many rows an export returns.
+"""
+import csv
+import json
+from .documents import to_instance
+
+FORMATS = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+
+
+class Echo:
+    """File-like object whose write() returns the value for csv.writer"""
+
+    def write(self, value):
+        return value
+
+
+def iter_batches(cursor, batch_size):
+    """Group a PyMongo cursor into lists of at most batch_size documents"""
+    batch = []
+    for document in cursor:
+        batch.append(document)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def serialize_batches(cursor, model, serializer_class, batch_size):
+    """
+    Yield lists of serialized rows, one list per cursor batch.
+    Each batch gets its own serializer tree without the request, so
+    per-request caches such as the user name map stay bounded by batch_size.
+    """
+    for batch in iter_batches(cursor, batch_size):
+        instances = [to_instance(model, document) for document in batch]
+        yield serializer_class(instances, many=True).data
+
+
+def stream_ndjson(batches):
+    for rows in batches:
+        yield ''.join(json.dumps(row, ensure_ascii=False) + '\n' for row in rows)
+
+
+def stream_csv(batches, fields):
+    writer = csv.writer(Echo())
+    yield writer.writerow(fields)
+    for rows in batches:
+        yield ''.join(writer.writerow([row.get(field) for field in fields]) for row in rows)
+
+
+def stream(output, batches, fields):
+    """Return the chunk generator for an export format"""
+    if output == 'csv':
+        return stream_csv(batches, fields)
+    return stream_ndjson(batches)
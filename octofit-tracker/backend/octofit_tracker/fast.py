@@ -0,0 +1,210 @@
+"""
+Fast read-only serialization for hot list endpoints.
+
+With settings.FAST_SERIALIZATION on, serializers that include
+FastReadMixin map raw MongoDB documents straight to output dicts. No model
+instances are built and DRF's per-field dispatch is skipped. Each field is
+compiled once per response into a converter that reproduces the field's
+to_representation. FastJSONRenderer encodes with orjson when it is
+installed. Both produce the same bytes as the regular serializer and
+JSONRenderer.
+"""
+import math
+from datetime import date, datetime, time, timezone
+from bson import ObjectId
+from django.conf import settings
+from rest_framework import fields as serializer_fields
+from rest_framework.renderers import JSONRenderer
+from rest_framework.settings import ISO_8601, api_settings
+from rest_framework.utils import encoders
+
+try:
+    import orjson
+except ImportError:  # FastJSONRenderer falls back to JSONRenderer without orjson
+    orjson = None
+
+# Encoded by the renderer's default() to the same strings JSONEncoder produces
+SCALARS = (str, int, bool, type(None), datetime, date, time, ObjectId)
+
+
+def enabled():
+    return getattr(settings, 'FAST_SERIALIZATION', False)
+
+
+def exact(value):
+    """
+    True when orjson encodes `value` byte for byte as json does. orjson
+    writes floats below 1e-4 or from 1e16 up in a different notation and
+    NaN as null, which json refuses.
+    """
+    if type(value) is float:
+        return value == 0 or 1e-4 <= abs(value) < 1e16
+    if isinstance(value, dict):
+        return all(type(key) is str for key in value) and all(map(exact, value.values()))
+    if isinstance(value, (list, tuple)):
+        return all(map(exact, value))
+    return isinstance(value, SCALARS)
+
+
+class Documents(list):
+    """Output of serialize_documents(); `exact` vouches for it to FastJSONRenderer"""
+    exact = True
+
+
+def to_float(value):
+    value = float(value)
+    if not math.isfinite(value):
+        # What JSONRenderer raises for the same value with STRICT_JSON
+        raise ValueError('Out of range float values are not JSON compliant')
+    return value
+
+
+def datetime_converter(field):
+    """ISO 8601 in UTC without enforce_timezone when the field allows it"""
+    output_format = getattr(field, 'format', api_settings.DATETIME_FORMAT)
+    field_timezone = field.timezone if hasattr(field, 'timezone') else field.default_timezone()
+    if (output_format is None or output_format.lower() != ISO_8601
+            or field_timezone is None or str(field_timezone) != 'UTC'):
+        return field.to_representation
+
+    def convert(value):
+        # PyMongo returns naive UTC datetimes, or aware ones with tz_aware=True
+        if type(value) is datetime:
+            if value.tzinfo is None:
+                return value.isoformat() + 'Z'
+            if value.tzinfo is timezone.utc:
+                return value.isoformat()[:-6] + 'Z'
+        return field.to_representation(value)
+    return convert
+
+
+def converter(field):
+    """
+    Return a callable equivalent to field.to_representation, and whether
+    its output needs vetting with exact()
+    """
+    representation = type(field).to_representation
+    if representation is serializer_fields.CharField.to_representation:
+        return str, False
+    if representation is serializer_fields.IntegerField.to_representation:
+        return int, False
+    if representation is serializer_fields.FloatField.to_representation:
+        return to_float, True
+    if representation is serializer_fields.DateTimeField.to_representation:
+        return datetime_converter(field), False
+    return field.to_representation, True
+
+
+class Row:
+    """
+    Attribute view of a raw document, standing in for the model instance
+    to_instance() would build. Missing fields read as the model default.
+    """
+    __slots__ = ('document', 'defaults')
+
+    def __init__(self, document, defaults):
+        self.document = document
+        self.defaults = defaults
+
+    def __getattr__(self, name):
+        try:
+            return self.document[name]
+        except KeyError:
+            pass
+        try:
+            return self.defaults[name]()
+        except KeyError:
+            raise AttributeError(name) from None
+
+
+def compile_fields(serializer, defaults):
+    """
+    Return [(name, key, convert, field, check)] for the serializer's
+    readable fields. `key` is the document field read directly, or None
+    when the value has to go through field.get_attribute(). `check` marks
+    converters whose output exact() has to vet.
+    """
+    plan = []
+    for name, field in serializer.fields.items():
+        if field.write_only:
+            continue
+        if isinstance(field, serializer_fields.SerializerMethodField):
+            plan.append((name, None, getattr(serializer, field.method_name), None, True))
+        elif field.source in defaults:
+            convert, check = converter(field)
+            plan.append((name, field.source, convert, field, check))
+        else:
+            plan.append((name, None, field.to_representation, field, True))
+    return plan
+
+
+def serialize_documents(serializer, documents):
+    """Return what serializer_class(instances, many=True).data would for `documents`"""
+    model = serializer.Meta.model
+    defaults = {field.attname: field.get_default for field in model._meta.concrete_fields}
+    plan = compile_fields(serializer, defaults)
+    prefetch = getattr(serializer, 'prefetch_documents', None)
+    if prefetch is not None:
+        prefetch(documents)
+
+    results = Documents()
+    for document in documents:
+        row = None
+        data = {}
+        for name, key, convert, field, check in plan:
+            if key is not None:
+                value = document[key] if key in document else defaults[key]()
+            else:
+                row = row or Row(document, defaults)
+                # Method fields are called with the row itself
+                value = row if field is None else field.get_attribute(row)
+            if field is None or value is not None:
+                value = convert(value)
+            if check and results.exact and not exact(value):
+                results.exact = False
+            data[name] = value
+        results.append(data)
+    return results
+
+
+def vouched(data):
+    """True when `data` is serialize_documents() output, bare or in a pagination envelope"""
+    if isinstance(data, Documents):
+        return data.exact
+    if isinstance(data, dict):
+        return all(type(key) is str and vouched(value) for key, value in data.items())
+    return isinstance(data, (str, int, type(None)))
+
+
+class JSONEncoder(encoders.JSONEncoder):
+    """DRF's JSONEncoder, plus ObjectIds as their hex string"""
+
+    def default(self, obj):
+        if isinstance(obj, ObjectId):
+            return str(obj)
+        return super().default(obj)
+
+
+class FastJSONRenderer(JSONRenderer):
+    """
+    JSONRenderer that encodes fast-serialized responses with orjson.
+    orjson is only used for compact UTF-8 output of data vouched for by
+    serialize_documents(); everything else goes through JSONRenderer, so
+    the bytes are the same either way.
+    """
+    encoder_class = JSONEncoder
+
+    def __init__(self):
+        super().__init__()
+        self.default = self.encoder_class().default
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if (orjson is None or data is None or self.ensure_ascii or not self.compact or not vouched(data)
+                or self.get_indent(accepted_media_type, renderer_context or {}) is not None):
+            return super().render(data, accepted_media_type, renderer_context)
+        try:
+            ret = orjson.dumps(data, default=self.default, option=orjson.OPT_PASSTHROUGH_DATETIME)
+        except orjson.JSONEncodeError:
+            return super().render(data, accepted_media_type, renderer_context)
+        # Escaped by JSONRenderer for JavaScript; valid JSON but not valid JS
+        return ret.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
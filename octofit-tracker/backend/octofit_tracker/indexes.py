@@ -0,0 +1,149 @@
+"""
+Declarative registry of the MongoDB indexes each query pattern needs.
+
+Every filter, sort and keyset pagination order used by the viewsets and
+the leaderboard maintenance code should be backed by an entry here. Run
+`manage.py ensure_indexes` to build missing indexes; it is idempotent and
+safe to run at every deploy.
+"""
+from pymongo import ASCENDING, DESCENDING, IndexModel
+from pymongo.errors import OperationFailure
+
+
+class Index:
+    """One declared index and the query pattern that needs it"""
+
+    def __init__(self, name, keys, purpose, **options):
+        self.name = name
+        self.keys = keys
+        self.purpose = purpose
+        self.options = options
+
+    def model(self):
+        return IndexModel(self.keys, name=self.name, background=True, **self.options)
+
+    def matches(self, info):
+        """Return True when an existing index has the same keys and options"""
+        if [(field, _direction(value)) for field, value in info['key']] != self.keys:
+            return False
+        return all(info.get(option) == value for option, value in self.options.items())
+
+
+def _direction(value):
+    # Indexes built by other tools may report directions as doubles
+    return int(value) if isinstance(value, (int, float)) else value
+
+
+INDEXES = {
+    'users': [
+        Index('users_email', [('email', ASCENDING)],
+              'unique login email', unique=True),
+        Index('users_team', [('team_id', ASCENDING), ('_id', ASCENDING)],
+              'UserViewSet.by_team and TeamViewSet.members pages'),
+    ],
+    'activities': [
+        Index('activities_date', [('date', DESCENDING), ('_id', DESCENDING)],
+              'activity list pages, newest first'),
+        Index('activities_user_date',
+              [('user_id', ASCENDING), ('date', DESCENDING), ('_id', DESCENDING)],
+              'ActivityViewSet.by_user, UserViewSet.activities, export by user'),
+        Index('activities_type_date',
+              [('activity_type', ASCENDING), ('date', DESCENDING), ('_id', DESCENDING)],
+              'ActivityViewSet.by_type and export by type'),
+    ],
+    'leaderboard': [
+        Index('leaderboard_user', [('user_id', ASCENDING)],
+              'entry lookup for rank and incremental updates, one entry per user',
+              unique=True),
+        Index('leaderboard_rank', [('rank', ASCENDING), ('_id', ASCENDING)],
+              'leaderboard pages, top head and rank neighbourhoods'),
+        Index('leaderboard_team_rank',
+              [('team_id', ASCENDING), ('rank', ASCENDING), ('_id', ASCENDING)],
+              'LeaderboardViewSet.by_team pages'),
+        Index('leaderboard_points', [('total_points', DESCENDING)],
+              'rank shifts and count-above queries'),
+    ],
+    'workouts': [
+        Index('workouts_difficulty', [('difficulty', ASCENDING), ('_id', ASCENDING)],
+              'WorkoutViewSet.by_difficulty pages'),
+        Index('workouts_category', [('category', ASCENDING), ('_id', ASCENDING)],
+              'WorkoutViewSet.by_category pages'),
+    ],
+    'user_daily_stats': [
+        Index('user_daily_stats_user_day', [('user_id', ASCENDING), ('day', ASCENDING)],
+              'ActivityViewSet.stats date ranges'),
+    ],
+    'team_weekly_stats': [
+        Index('team_weekly_stats_team_week', [('team_id', ASCENDING), ('week', ASCENDING)],
+              'ActivityViewSet.team_stats date ranges'),
+    ],
+    'search_postings': [
+        Index('search_postings_term',
+              [('kind', ASCENDING), ('term', ASCENDING), ('weight', DESCENDING)],
+              'search queries, best postings of a term first'),
+        Index('search_postings_document', [('kind', ASCENDING), ('doc_id', ASCENDING)],
+              "replacing and removing a document's postings"),
+    ],
+}
+
+
+def ensure_indexes(db, dry_run=False):
+    """
+    Create every declared index that is missing and return them as
+    (collection, Index) pairs. An existing index with a declared name but
+    other keys or options, e.g. one declared unique since, is rebuilt.
+    Nothing is created or dropped when dry_run is True.
+    """
+    missing = []
+    collections = set(db.list_collection_names())
+    for collection_name, declared in INDEXES.items():
+        collection = db[collection_name]
+        existing = {}
+        if collection_name in collections:
+            existing = collection.index_information()
+        to_create = [
+            index for index in declared
+            if not any(index.matches(info) for info in existing.values())
+        ]
+        if to_create and not dry_run:
+            for index in to_create:
+                if index.name in existing:
+                    collection.drop_index(index.name)
+            collection.create_indexes([index.model() for index in to_create])
+        missing.extend((collection_name, index) for index in to_create)
+    return missing
+
+
+def undeclared_indexes(db):
+    """Return (collection, name) for existing indexes the registry does not declare"""
+    undeclared = []
+    collections = set(db.list_collection_names())
+    for collection_name, declared in INDEXES.items():
+        if collection_name not in collections:
+            continue
+        for name, info in db[collection_name].index_information().items():
+            if name == '_id_':
+                continue
+            if not any(index.matches(info) for index in declared):
+                undeclared.append((collection_name, name))
+    return undeclared
+
+
+def unused_indexes(db):
+    """
+    Return (collection, name, since) for indexes with no recorded accesses.
+    Counters reset when mongod restarts; returns None when $indexStats is
+    not permitted.
+    """
+    unused = []
+    collections = set(db.list_collection_names())
+    try:
+        for collection_name in INDEXES:
+            if collection_name not in collections:
+                continue
+            for stats in db[collection_name].aggregate([{'$indexStats': {}}]):
+                if stats['name'] != '_id_' and stats['accesses']['ops'] == 0:
+                    unused.append((collection_name, stats['name'], stats['accesses']['since']))
+    except OperationFailure:
+        return None
+    return unused
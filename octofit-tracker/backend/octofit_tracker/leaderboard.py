@@ -0,0 +1,334 @@
+"""
+Incremental leaderboard maintenance.
+
+Activity writes are turned into per-user point and count deltas that are
+applied with atomic $inc updates to `users` and `leaderboard`. Ranks use
+standard competition ranking (1 + number of entries with more points), so
+a change from `old` to `new` points only shifts the entries whose totals lie
+between the two values instead of re-ranking the whole board.
+"""
+import time
+from collections import defaultdict
+from datetime import datetime, timezone
+from django.conf import settings
+from pymongo import ASCENDING, DESCENDING, ReturnDocument, UpdateOne
+from pymongo.errors import DuplicateKeyError
+from .cache import invalidate
+from .documents import get_collection, id_candidates, id_filter
+from .models import User, Activity, Leaderboard
+from .pagination import KeysetPagination
+
+# Precomputed head of the board served by LeaderboardViewSet.top
+HEAD_SIZE = getattr(settings, 'LEADERBOARD_HEAD_SIZE', 100)
+HEAD_TTL = getattr(settings, 'LEADERBOARD_HEAD_TTL', 5)
+
+HEAD_SORT = [('rank', ASCENDING), ('_id', ASCENDING)]
+
+_head = (None, 0.0)
+
+
+def activity_deltas(before=None, after=None):
+    """
+    Return {user_id: [points, activities]} for an activity write.
+    `before` is None for creates and `after` is None for deletes.
+    """
+    deltas = defaultdict(lambda: [0, 0])
+    if before is not None:
+        delta = deltas[str(before['user_id'])]
+        delta[0] -= before.get('points_earned') or 0
+        delta[1] -= 1
+    if after is not None:
+        delta = deltas[str(after['user_id'])]
+        delta[0] += after.get('points_earned') or 0
+        delta[1] += 1
+    return {user_id: delta for user_id, delta in deltas.items() if delta != [0, 0]}
+
+
+def merge_deltas(target, deltas):
+    """Accumulate `deltas` into `target` in place and return it"""
+    for user_id, (points, activities) in deltas.items():
+        delta = target.setdefault(user_id, [0, 0])
+        delta[0] += points
+        delta[1] += activities
+    return target
+
+
+def apply_deltas(deltas):
+    """Apply {user_id: [points, activities]} to user totals and the leaderboard"""
+    for user_id, (points, activities) in deltas.items():
+        apply_user_delta(user_id, points, activities)
+
+
+def apply_user_delta(user_id, points, activities):
+    """Apply one user's delta and repair the ranks it affects"""
+    users = get_collection(User)
+    leaderboard = get_collection(Leaderboard)
+    now = datetime.now(timezone.utc)
+
+    user = users.find_one_and_update(
+        id_filter(user_id),
+        {'$inc': {'total_points': points}},
+        projection={'name': 1, 'team_id': 1, 'total_points': 1},
+        return_document=ReturnDocument.AFTER
+    )
+
+    previous = leaderboard.find_one_and_update(
+        id_filter(user_id, 'user_id'),
+        {
+            '$inc': {'total_points': points, 'activities_count': activities},
+            '$set': {'last_updated': now},
+        },
+        projection={'total_points': 1}
+    )
+    if previous is not None:
+        old_points = previous.get('total_points') or 0
+        shift_ranks(leaderboard, previous['_id'], old_points, old_points + points)
+    elif user is not None:
+        create_entry(leaderboard, user, now)
+    else:
+        return
+
+    invalidate_head()
+    invalidate(User._meta.db_table, Leaderboard._meta.db_table)
+
+
+def apply_bulk_deltas(deltas):
+    """
+    Apply many users' deltas with one bulk write per collection.
+    Only entries whose totals lie inside the points range spanned by the
+    changes can move, so ranks are repaired over that range alone.
+    """
+    if not deltas:
+        return
+    users = get_collection(User)
+    leaderboard = get_collection(Leaderboard)
+    now = datetime.now(timezone.utc)
+
+    user_updates = [
+        UpdateOne(id_filter(user_id), {'$inc': {'total_points': points}})
+        for user_id, (points, _) in deltas.items() if points
+    ]
+    if user_updates:
+        users.bulk_write(user_updates, ordered=False)
+
+    candidates = [candidate for user_id in deltas for candidate in id_candidates(user_id)]
+    entries = {
+        str(entry['user_id']): entry
+        for entry in leaderboard.find(
+            {'user_id': {'$in': candidates}}, {'user_id': 1, 'total_points': 1}
+        )
+    }
+
+    entry_updates = []
+    low = high = None
+    for user_id, entry in entries.items():
+        points, activities = deltas[user_id]
+        entry_updates.append(UpdateOne({'_id': entry['_id']}, {
+            '$inc': {'total_points': points, 'activities_count': activities},
+            '$set': {'last_updated': now},
+        }))
+        if points:
+            old_points = entry.get('total_points') or 0
+            span = (old_points, old_points + points)
+            low = min(span) if low is None else min(low, *span)
+            high = max(span) if high is None else max(high, *span)
+    if entry_updates:
+        leaderboard.bulk_write(entry_updates, ordered=False)
+    if low is not None:
+        repair_ranks(leaderboard, low, high)
+
+    for user_id in deltas.keys() - entries.keys():
+        user = users.find_one(id_filter(user_id), {'name': 1, 'team_id': 1, 'total_points': 1})
+        if user is not None:
+            create_entry(leaderboard, user, now)
+
+    invalidate_head()
+    invalidate(User._meta.db_table, Leaderboard._meta.db_table)
+
+
+def create_entry(leaderboard, user, now):
+    """
+    Create the leaderboard entry for a user's first activity, from the
+    user's totals. Concurrent first activities race on the unique user_id
+    index; the one that does not insert the entry brings it up to the
+    user's totals instead, which by then include both activities.
+    """
+    fields = entry_fields(user)
+    try:
+        result = leaderboard.update_one(
+            {'user_id': user['_id']},
+            {
+                '$setOnInsert': dict(fields, user_id=user['_id'], rank=0),
+                '$set': {'last_updated': now},
+            },
+            upsert=True
+        )
+    except DuplicateKeyError:
+        result = None
+    if result is not None and result.upserted_id is not None:
+        shift_ranks(leaderboard, result.upserted_id, None, fields['total_points'])
+        return
+
+    user = get_collection(User).find_one(
+        {'_id': user['_id']}, {'name': 1, 'team_id': 1, 'total_points': 1}
+    )
+    fields = entry_fields(user)
+    previous = leaderboard.find_one_and_update(
+        {'user_id': user['_id']}, {'$set': dict(fields, last_updated=now)},
+        projection={'total_points': 1}
+    )
+    if previous is not None:
+        shift_ranks(
+            leaderboard, previous['_id'], previous.get('total_points') or 0, fields['total_points']
+        )
+
+
+def entry_fields(user):
+    """Leaderboard entry fields derived from a user document and their activities"""
+    return {
+        'user_name': user.get('name', ''),
+        'team_id': user.get('team_id', ''),
+        'total_points': user.get('total_points') or 0,
+        'activities_count': get_collection(Activity).count_documents(
+            id_filter(user['_id'], 'user_id')
+        ),
+    }
+
+
+def shift_ranks(leaderboard, entry_id, old_points, new_points):
+    """Move one entry from `old_points` to `new_points` (None for a new entry)"""
+    others = {'_id': {'$ne': entry_id}}
+    if old_points is None:
+        leaderboard.update_many(
+            dict(others, total_points={'$lt': new_points}), {'$inc': {'rank': 1}}
+        )
+    elif new_points > old_points:
+        leaderboard.update_many(
+            dict(others, total_points={'$gte': old_points, '$lt': new_points}),
+            {'$inc': {'rank': 1}}
+        )
+    elif new_points < old_points:
+        leaderboard.update_many(
+            dict(others, total_points={'$gte': new_points, '$lt': old_points}),
+            {'$inc': {'rank': -1}}
+        )
+    else:
+        return
+
+    rank = leaderboard.count_documents({'total_points': {'$gt': new_points}}) + 1
+    leaderboard.update_one({'_id': entry_id}, {'$set': {'rank': rank}})
+
+
+def assign_ranks(entries):
+    """Sort leaderboard entries by points and assign competition ranks in place"""
+    entries.sort(key=lambda entry: entry['total_points'], reverse=True)
+    rank = 0
+    previous_points = None
+    for position, entry in enumerate(entries, start=1):
+        if entry['total_points'] != previous_points:
+            rank = position
+            previous_points = entry['total_points']
+        entry['rank'] = rank
+    return entries
+
+
+def repair_ranks(leaderboard, low=None, high=None):
+    """
+    Recompute ranks for entries with totals in [low, high] (unbounded when
+    None) using one count for the entries above the range.
+    """
+    points_range = {}
+    if low is not None:
+        points_range['$gte'] = low
+    if high is not None:
+        points_range['$lte'] = high
+    query = {'total_points': points_range} if points_range else {}
+
+    position = 0
+    if high is not None:
+        position = leaderboard.count_documents({'total_points': {'$gt': high}})
+
+    updates = []
+    rank = 0
+    previous_points = None
+    entries = leaderboard.find(query, {'total_points': 1, 'rank': 1}).sort('total_points', DESCENDING)
+    for entry in entries:
+        position += 1
+        if entry['total_points'] != previous_points:
+            rank = position
+            previous_points = entry['total_points']
+        if entry.get('rank') != rank:
+            updates.append(UpdateOne({'_id': entry['_id']}, {'$set': {'rank': rank}}))
+        if len(updates) >= 1000:
+            leaderboard.bulk_write(updates, ordered=False)
+            updates = []
+    if updates:
+        leaderboard.bulk_write(updates, ordered=False)
+
+
+def get_head():
+    """
+    Return the top HEAD_SIZE leaderboard documents.
+    The head is cached per process, dropped on local rank changes and
+    refreshed after HEAD_TTL seconds to pick up writes from other workers.
+    """
+    documents = cached_head()
+    if documents is None:
+        documents = store_head(list(
+            get_collection(Leaderboard).find().sort(HEAD_SORT).limit(HEAD_SIZE)
+        ))
+    return documents
+
+
+def cached_head():
+    """Return the cached head, or None when it is missing or expired"""
+    documents, expires = _head
+    if documents is None or time.monotonic() >= expires:
+        return None
+    return documents
+
+
+def store_head(documents):
+    global _head
+    _head = (documents, time.monotonic() + HEAD_TTL)
+    return documents
+
+
+def invalidate_head():
+    global _head
+    _head = (None, 0.0)
+
+
+def find_entry(user_id):
+    """Return a user's leaderboard entry with its rank filled in"""
+    entry = get_collection(Leaderboard).find_one(id_filter(user_id, 'user_id'))
+    if entry is not None and entry.get('rank') is None:
+        # Indexed count-above fallback for entries not ranked yet
+        entry['rank'] = get_collection(Leaderboard).count_documents(
+            {'total_points': {'$gt': entry.get('total_points') or 0}}
+        ) + 1
+    return entry
+
+
+def neighbours(entry, k):
+    """
+    Return the k entries ranked directly above and below `entry`.
+    Both sides are index range scans on (rank, _id) that stop after k
+    documents, so the cost does not depend on the size of the board.
+    """
+    collection = get_collection(Leaderboard)
+    key = [entry['rank'], entry['_id']]
+
+    after = KeysetPagination()
+    after.ordering = ('rank', '_id')
+    below = list(
+        collection.find(after.get_key_filter(key)).sort(after.get_sort()).limit(k)
+    )
+
+    before = KeysetPagination()
+    before.ordering = ('-rank', '-_id')
+    above = list(
+        collection.find(before.get_key_filter(key)).sort(before.get_sort()).limit(k)
+    )
+    above.reverse()
+    return above, below
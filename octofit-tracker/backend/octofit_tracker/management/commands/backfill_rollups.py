@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+from octofit_tracker.indexes import ensure_indexes
+from octofit_tracker.mongo import get_db, close_client
+from octofit_tracker.rollups import TEAM_WEEKLY, USER_DAILY, backfill
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the daily user and weekly team activity rollups from activities'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='Rollup documents written per insert_many (default 1000)'
+        )
+
+    def handle(self, *args, **options):
+        db = get_db()
+        ensure_indexes(db)
+
+        self.stdout.write('Rebuilding activity rollups...')
+        days, weeks = backfill(db, batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Wrote {days} {USER_DAILY} and {weeks} {TEAM_WEEKLY} documents.'
+        ))
+
+        close_client()
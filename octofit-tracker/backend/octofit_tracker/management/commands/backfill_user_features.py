@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+from octofit_tracker.mongo import get_db, close_client
+from octofit_tracker.recommendations import USER_FEATURES, backfill
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the per-user recommendation features from activities'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='Feature documents written per insert_many (default 1000)'
+        )
+
+    def handle(self, *args, **options):
+        self.stdout.write('Rebuilding user features...')
+        users = backfill(get_db(), batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Wrote {users} {USER_FEATURES} documents.'))
+
+        close_client()
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+from octofit_tracker.catalog import convert_exercises
+from octofit_tracker.mongo import close_client
+
+
+class Command(BaseCommand):
+    help = 'Store workout exercises still held as JSON text as embedded documents'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='Workouts read and updated per batch (default 1000)'
+        )
+
+    def handle(self, *args, **options):
+        self.stdout.write('Converting workout exercises...')
+        converted = convert_exercises(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Converted {converted} workouts.'))
+
+        close_client()
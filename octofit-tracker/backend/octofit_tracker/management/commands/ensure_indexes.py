@@ -0,0 +1,47 @@
+from django.core.management.base import BaseCommand
+from octofit_tracker.indexes import INDEXES, ensure_indexes, undeclared_indexes, unused_indexes
+from octofit_tracker.mongo import get_db, close_client
+
+
+class Command(BaseCommand):
+    help = 'Build the MongoDB indexes declared in octofit_tracker.indexes'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Only report missing indexes, do not build them'
+        )
+
+    def handle(self, *args, **options):
+        db = get_db()
+        dry_run = options['dry_run']
+
+        declared = sum(len(indexes) for indexes in INDEXES.values())
+        self.stdout.write(f'Checking {declared} declared indexes...')
+        missing = ensure_indexes(db, dry_run=dry_run)
+        for collection, index in missing:
+            verb = 'Missing' if dry_run else 'Built'
+            self.stdout.write(f'  {verb} {collection}.{index.name} {index.keys} ({index.purpose})')
+        if not missing:
+            self.stdout.write(self.style.SUCCESS('All declared indexes exist.'))
+        elif dry_run:
+            self.stdout.write(self.style.WARNING(f'{len(missing)} indexes missing.'))
+        else:
+            self.stdout.write(self.style.SUCCESS(f'Built {len(missing)} indexes.'))
+
+        for collection, name in undeclared_indexes(db):
+            self.stdout.write(self.style.WARNING(
+                f'  Undeclared index {collection}.{name} (not in the registry)'
+            ))
+
+        unused = unused_indexes(db)
+        if unused is None:
+            self.stdout.write('Index usage statistics are not available.')
+        else:
+            for collection, name, since in unused:
+                self.stdout.write(self.style.WARNING(
+                    f'  Unused index {collection}.{name} (no accesses since {since})'
+                ))
+
+        close_client()
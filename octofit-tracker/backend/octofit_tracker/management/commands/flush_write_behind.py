@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+from octofit_tracker.mongo import close_client
+from octofit_tracker.writebehind import write_behind
+
+
+class Command(BaseCommand):
+    help = (
+        'Persist the write-behind activity segments of stopped server processes, '
+        'e.g. after a crash or before moving a host'
+    )
+
+    def handle(self, *args, **options):
+        self.stdout.write(f'Recovering queued activities from {write_behind.directory}...')
+        inserted = write_behind.recover()
+        stats = write_behind.stats()
+        if stats['last_error']:
+            self.stderr.write(f'Last error: {stats["last_error"]}')
+        self.stdout.write(self.style.SUCCESS(
+            f'Persisted {inserted} activities from {stats["recovered"]} segments '
+            f'({stats["duplicates"]} already stored, {stats["pending_segments"]} segments still queued).'
+        ))
+
+        close_client()
@@ -1,16 +1,61 @@
-from django.core.management.base import BaseCommand
-from pymongo import MongoClient, ASCENDING
+from django.core.management.base import BaseCommand, CommandError
+from collections import Counter
 from datetime import datetime, timedelta
+import multiprocessing
+import os
 import random
+import time
+from octofit_tracker.indexes import ensure_indexes
+from octofit_tracker.leaderboard import activity_deltas, assign_ranks, merge_deltas, repair_ranks
+from octofit_tracker.mongo import get_db, close_client
+from octofit_tracker.points import rules
+from octofit_tracker.recommendations import backfill as backfill_features
+from octofit_tracker.rollups import backfill
+from octofit_tracker.search import POSTINGS, TERMS, index_documents
+from octofit_tracker.search import rebuild as rebuild_search_index
+from octofit_tracker.synthetic import generate_chunk, team_id, user_chunks
 
 
 class Command(BaseCommand):
     help = 'Populate the octofit_db database with test data'
 
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--users', type=int,
+            help='Generate this many synthetic users instead of the sample heroes'
+        )
+        parser.add_argument(
+            '--teams', type=int, default=10,
+            help='Number of teams in scale mode (default 10)'
+        )
+        parser.add_argument(
+            '--activities-per-user', type=int, default=10,
+            help='Average activities per user in scale mode (default 10)'
+        )
+        parser.add_argument(
+            '--seed', type=int, default=0,
+            help='Random seed; the same seed always generates the same data'
+        )
+        parser.add_argument(
+            '--workers', type=int, default=os.cpu_count() or 1,
+            help='Worker processes inserting in parallel (default: CPU count)'
+        )
+        parser.add_argument(
+            '--chunk-size', type=int, default=5000,
+            help='Users generated per worker task (default 5000)'
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=10000,
+            help='Documents per insert_many call (default 10000)'
+        )
+        parser.add_argument(
+            '--rebuild-search', action='store_true',
+            help='Index activity notes for search in scale mode too; sample mode always does'
+        )
+
     def handle(self, *args, **options):
         # Connect to MongoDB
-        client = MongoClient('localhost', 27017)
-        db = client['octofit_db']
+        db = get_db()
 
         self.stdout.write('Clearing existing data...')
         
@@ -23,10 +68,129 @@ class Command(BaseCommand):
 
         self.stdout.write(self.style.SUCCESS('Existing data cleared.'))
 
-        # Create unique index on email field for users
-        self.stdout.write('Creating unique index on user email...')
-        db.users.create_index([("email", ASCENDING)], unique=True)
-        self.stdout.write(self.style.SUCCESS('Index created.'))
+        if options['users'] is not None:
+            self.populate_scale(db, options)
+        else:
+            self.populate_sample(db)
+
+        # Rollups are derived from the activities just inserted
+        self.stdout.write('Building activity rollups...')
+        days, weeks = backfill(db)
+        self.stdout.write(self.style.SUCCESS(f'Built {days} daily and {weeks} weekly rollups.'))
+        users = backfill_features(db)
+        self.stdout.write(self.style.SUCCESS(f'Built recommendation features for {users} users.'))
+
+        # Generate workout suggestions
+        self.stdout.write('Inserting workout suggestions...')
+        workouts_data = [
+            {
+                'name': 'Hero Strength Training',
+                'description': 'Build strength like a superhero',
+                'duration': 60,
+                'difficulty': 'intermediate',
+                'exercises': [
+                    {'name': 'Push-ups', 'sets': 3, 'reps': 15},
+                    {'name': 'Pull-ups', 'sets': 3, 'reps': 10},
+                    {'name': 'Squats', 'sets': 3, 'reps': 20},
+                    {'name': 'Plank', 'sets': 3, 'duration': '60 seconds'}
+                ],
+                'category': 'strength',
+                'created_at': datetime.now()
+            },
+            {
+                'name': 'Speed Force Cardio',
+                'description': 'Run as fast as The Flash',
+                'duration': 45,
+                'difficulty': 'advanced',
+                'exercises': [
+                    {'name': 'Sprint Intervals', 'sets': 5, 'duration': '2 minutes'},
+                    {'name': 'Burpees', 'sets': 3, 'reps': 15},
+                    {'name': 'Jump Rope', 'sets': 3, 'duration': '3 minutes'},
+                    {'name': 'Mountain Climbers', 'sets': 3, 'reps': 30}
+                ],
+                'category': 'cardio',
+                'created_at': datetime.now()
+            },
+            {
+                'name': 'Warrior Flexibility',
+                'description': 'Flexibility training fit for Wonder Woman',
+                'duration': 30,
+                'difficulty': 'beginner',
+                'exercises': [
+                    {'name': 'Yoga Flow', 'sets': 1, 'duration': '15 minutes'},
+                    {'name': 'Static Stretches', 'sets': 1, 'duration': '10 minutes'},
+                    {'name': 'Deep Breathing', 'sets': 1, 'duration': '5 minutes'}
+                ],
+                'category': 'flexibility',
+                'created_at': datetime.now()
+            },
+            {
+                'name': 'Asgardian Power Workout',
+                'description': 'Train like Thor with hammer swings',
+                'duration': 90,
+                'difficulty': 'advanced',
+                'exercises': [
+                    {'name': 'Deadlifts', 'sets': 4, 'reps': 8},
+                    {'name': 'Overhead Press', 'sets': 4, 'reps': 10},
+                    {'name': 'Battle Ropes', 'sets': 3, 'duration': '2 minutes'},
+                    {'name': 'Farmer\'s Walk', 'sets': 3, 'distance': '50 meters'}
+                ],
+                'category': 'strength',
+                'created_at': datetime.now()
+            },
+            {
+                'name': 'Detective Core Training',
+                'description': 'Batman\'s core workout routine',
+                'duration': 40,
+                'difficulty': 'intermediate',
+                'exercises': [
+                    {'name': 'Hanging Leg Raises', 'sets': 3, 'reps': 12},
+                    {'name': 'Russian Twists', 'sets': 3, 'reps': 30},
+                    {'name': 'Ab Wheel Rollouts', 'sets': 3, 'reps': 10},
+                    {'name': 'Side Plank', 'sets': 3, 'duration': '45 seconds'}
+                ],
+                'category': 'core',
+                'created_at': datetime.now()
+            }
+        ]
+
+        db.workouts.insert_many(workouts_data)
+        self.stdout.write(self.style.SUCCESS(f'Inserted {len(workouts_data)} workout suggestions.'))
+
+        # Indexed once workouts and activities are both in place. Indexing
+        # every activity is a serial pass, so scale mode only indexes the
+        # workouts unless asked to.
+        if options['users'] is None or options['rebuild_search']:
+            self.stdout.write('Building the search index...')
+            postings = rebuild_search_index(db)
+            self.stdout.write(self.style.SUCCESS(f'Built {postings} search postings.'))
+        else:
+            db[POSTINGS].delete_many({})
+            db[TERMS].delete_many({})
+            index_documents('workout', workouts_data, created=True)
+            self.stdout.write(self.style.SUCCESS(
+                'Indexed workouts for search; run `manage.py rebuild_search_index` '
+                'to index activity notes.'
+            ))
+
+        # Summary
+        self.stdout.write('\n' + '='*50)
+        self.stdout.write(self.style.SUCCESS('Database population completed successfully!'))
+        self.stdout.write('='*50)
+        self.stdout.write(f'Teams: {db.teams.count_documents({})}')
+        self.stdout.write(f'Users: {db.users.count_documents({})}')
+        self.stdout.write(f'Activities: {db.activities.count_documents({})}')
+        self.stdout.write(f'Leaderboard entries: {db.leaderboard.count_documents({})}')
+        self.stdout.write(f'Workout suggestions: {db.workouts.count_documents({})}')
+        self.stdout.write('='*50 + '\n')
+
+        close_client()
+
+    def populate_sample(self, db):
+        # Create the indexes declared in octofit_tracker.indexes
+        self.stdout.write('Creating indexes...')
+        ensure_indexes(db)
+        self.stdout.write(self.style.SUCCESS('Indexes created.'))
 
         # Team Marvel and Team DC
         teams_data = [
@@ -154,8 +318,8 @@ class Command(BaseCommand):
         self.stdout.write(self.style.SUCCESS(f'Inserted {len(users_data)} users.'))
 
         # Update team member counts
-        db.teams.update_one({'_id': 'team_marvel'}, {'$set': {'member_count': 5}})
-        db.teams.update_one({'_id': 'team_dc'}, {'$set': {'member_count': 5}})
+        for team, count in Counter(user['team_id'] for user in users_data).items():
+            db.teams.update_one({'_id': team}, {'$set': {'member_count': count}})
 
         # Activity types
         activity_types = ['Running', 'Cycling', 'Swimming', 'Weightlifting', 'Yoga', 'Boxing', 'CrossFit']
@@ -169,7 +333,9 @@ class Command(BaseCommand):
                 duration = random.randint(30, 180)  # 30 to 180 minutes
                 distance = round(random.uniform(1, 25), 2) if activity_type in ['Running', 'Cycling', 'Swimming'] else 0
                 calories = duration * random.randint(5, 15)
-                points = duration * 2 + int(distance * 10)
+                points = rules.points(
+                    {'activity_type': activity_type, 'duration': duration, 'distance': distance}
+                )
                 
                 activities_data.append({
                     'user_id': user_id,
@@ -185,114 +351,99 @@ class Command(BaseCommand):
         db.activities.insert_many(activities_data)
         self.stdout.write(self.style.SUCCESS(f'Inserted {len(activities_data)} activities.'))
 
+        # User totals are the sums of the scored activities
+        totals = {}
+        for activity in activities_data:
+            merge_deltas(totals, activity_deltas(after=activity))
+        for user_id in user_ids:
+            db.users.update_one(
+                {'_id': user_id}, {'$set': {'total_points': totals[str(user_id)][0]}}
+            )
+
         # Generate leaderboard entries
         self.stdout.write('Inserting leaderboard entries...')
         leaderboard_data = []
         for i, user in enumerate(users_data):
+            points, activities = totals[str(user_ids[i])]
             leaderboard_data.append({
                 'user_id': user_ids[i],
                 'user_name': user['name'],
                 'team_id': user['team_id'],
-                'total_points': user['total_points'],
-                'activities_count': random.randint(5, 10),
+                'total_points': points,
+                'activities_count': activities,
                 'rank': 0,  # Will be calculated
                 'last_updated': datetime.now()
             })
 
         # Sort by points and assign ranks
-        leaderboard_data.sort(key=lambda x: x['total_points'], reverse=True)
-        for rank, entry in enumerate(leaderboard_data, start=1):
-            entry['rank'] = rank
+        assign_ranks(leaderboard_data)
 
         db.leaderboard.insert_many(leaderboard_data)
         self.stdout.write(self.style.SUCCESS(f'Inserted {len(leaderboard_data)} leaderboard entries.'))
 
-        # Generate workout suggestions
-        self.stdout.write('Inserting workout suggestions...')
-        workouts_data = [
-            {
-                'name': 'Hero Strength Training',
-                'description': 'Build strength like a superhero',
-                'duration': 60,
-                'difficulty': 'intermediate',
-                'exercises': [
-                    {'name': 'Push-ups', 'sets': 3, 'reps': 15},
-                    {'name': 'Pull-ups', 'sets': 3, 'reps': 10},
-                    {'name': 'Squats', 'sets': 3, 'reps': 20},
-                    {'name': 'Plank', 'sets': 3, 'duration': '60 seconds'}
-                ],
-                'category': 'strength',
-                'created_at': datetime.now()
-            },
-            {
-                'name': 'Speed Force Cardio',
-                'description': 'Run as fast as The Flash',
-                'duration': 45,
-                'difficulty': 'advanced',
-                'exercises': [
-                    {'name': 'Sprint Intervals', 'sets': 5, 'duration': '2 minutes'},
-                    {'name': 'Burpees', 'sets': 3, 'reps': 15},
-                    {'name': 'Jump Rope', 'sets': 3, 'duration': '3 minutes'},
-                    {'name': 'Mountain Climbers', 'sets': 3, 'reps': 30}
-                ],
-                'category': 'cardio',
-                'created_at': datetime.now()
-            },
-            {
-                'name': 'Warrior Flexibility',
-                'description': 'Flexibility training fit for Wonder Woman',
-                'duration': 30,
-                'difficulty': 'beginner',
-                'exercises': [
-                    {'name': 'Yoga Flow', 'sets': 1, 'duration': '15 minutes'},
-                    {'name': 'Static Stretches', 'sets': 1, 'duration': '10 minutes'},
-                    {'name': 'Deep Breathing', 'sets': 1, 'duration': '5 minutes'}
-                ],
-                'category': 'flexibility',
-                'created_at': datetime.now()
-            },
-            {
-                'name': 'Asgardian Power Workout',
-                'description': 'Train like Thor with hammer swings',
-                'duration': 90,
-                'difficulty': 'advanced',
-                'exercises': [
-                    {'name': 'Deadlifts', 'sets': 4, 'reps': 8},
-                    {'name': 'Overhead Press', 'sets': 4, 'reps': 10},
-                    {'name': 'Battle Ropes', 'sets': 3, 'duration': '2 minutes'},
-                    {'name': 'Farmer\'s Walk', 'sets': 3, 'distance': '50 meters'}
-                ],
-                'category': 'strength',
-                'created_at': datetime.now()
-            },
-            {
-                'name': 'Detective Core Training',
-                'description': 'Batman\'s core workout routine',
-                'duration': 40,
-                'difficulty': 'intermediate',
-                'exercises': [
-                    {'name': 'Hanging Leg Raises', 'sets': 3, 'reps': 12},
-                    {'name': 'Russian Twists', 'sets': 3, 'reps': 30},
-                    {'name': 'Ab Wheel Rollouts', 'sets': 3, 'reps': 10},
-                    {'name': 'Side Plank', 'sets': 3, 'duration': '45 seconds'}
-                ],
-                'category': 'core',
-                'created_at': datetime.now()
-            }
+    def populate_scale(self, db, options):
+        users, teams = options['users'], options['teams']
+        if users < 1 or teams < 1 or options['activities_per_user'] < 0:
+            raise CommandError('--users and --teams must be positive and --activities-per-user non-negative')
+        if options['workers'] < 1 or options['chunk_size'] < 1 or options['batch_size'] < 1:
+            raise CommandError('--workers, --chunk-size and --batch-size must be positive')
+
+        tasks = [
+            (start, end, teams, options['activities_per_user'], options['seed'], options['batch_size'])
+            for start, end in user_chunks(users, options['chunk_size'])
         ]
+        self.stdout.write(
+            f'Generating {users} users in {len(tasks)} chunks on {options["workers"]} workers...'
+        )
 
-        db.workouts.insert_many(workouts_data)
-        self.stdout.write(self.style.SUCCESS(f'Inserted {len(workouts_data)} workout suggestions.'))
+        # Each worker drops the inherited client after the fork and opens its own
+        started = time.monotonic()
+        member_counts = Counter()
+        users_done = activities_done = 0
+        if options['workers'] == 1:
+            results = map(generate_chunk, tasks)
+            pool = None
+        else:
+            pool = multiprocessing.get_context('fork').Pool(options['workers'])
+            results = pool.imap_unordered(generate_chunk, tasks)
+        try:
+            for chunk_users, chunk_activities, chunk_counts in results:
+                users_done += chunk_users
+                activities_done += chunk_activities
+                member_counts.update(chunk_counts)
+                elapsed = time.monotonic() - started
+                self.stdout.write(
+                    f'  {users_done}/{users} users, {activities_done} activities '
+                    f'({activities_done / elapsed:,.0f} activities/s)'
+                )
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+        self.stdout.write(self.style.SUCCESS(
+            f'Inserted {users_done} users, {activities_done} activities and '
+            f'{users_done} leaderboard entries in {time.monotonic() - started:.1f}s.'
+        ))
 
-        # Summary
-        self.stdout.write('\n' + '='*50)
-        self.stdout.write(self.style.SUCCESS('Database population completed successfully!'))
-        self.stdout.write('='*50)
-        self.stdout.write(f'Teams: {db.teams.count_documents({})}')
-        self.stdout.write(f'Users: {db.users.count_documents({})}')
-        self.stdout.write(f'Activities: {db.activities.count_documents({})}')
-        self.stdout.write(f'Leaderboard entries: {db.leaderboard.count_documents({})}')
-        self.stdout.write(f'Workout suggestions: {db.workouts.count_documents({})}')
-        self.stdout.write('='*50 + '\n')
+        # Teams carry the member counts collected from the generated users
+        now = datetime.now()
+        db.teams.insert_many([
+            {
+                '_id': team_id(number),
+                'name': f'Team {number}',
+                'description': f'Synthetic team {number}',
+                'created_at': now,
+                'member_count': member_counts[team_id(number)]
+            }
+            for number in range(1, teams + 1)
+        ])
+        self.stdout.write(self.style.SUCCESS(f'Inserted {teams} teams.'))
+
+        # Indexes are cheaper to build once over the loaded data
+        self.stdout.write('Creating indexes...')
+        ensure_indexes(db)
+        self.stdout.write(self.style.SUCCESS('Indexes created.'))
 
-        client.close()
+        self.stdout.write('Ranking leaderboard...')
+        repair_ranks(db.leaderboard)
+        self.stdout.write(self.style.SUCCESS('Leaderboard ranked.'))
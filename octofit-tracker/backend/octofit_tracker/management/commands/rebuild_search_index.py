@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+from octofit_tracker.indexes import ensure_indexes
+from octofit_tracker.mongo import get_db, close_client
+from octofit_tracker.search import POSTINGS, TERMS, rebuild
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the full-text search index of workouts and activity notes'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='Documents read and postings written per batch (default 1000)'
+        )
+
+    def handle(self, *args, **options):
+        db = get_db()
+        ensure_indexes(db)
+
+        self.stdout.write('Rebuilding the search index...')
+        postings = rebuild(db, batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Wrote {postings} {POSTINGS} documents and the {TERMS} frequencies.'
+        ))
+
+        close_client()
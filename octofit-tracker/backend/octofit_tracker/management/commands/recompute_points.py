@@ -0,0 +1,54 @@
+import os
+import time
+from django.core.management.base import BaseCommand, CommandError
+from octofit_tracker.indexes import ensure_indexes
+from octofit_tracker.mongo import get_db, close_client
+from octofit_tracker.points import recompute
+
+
+class Command(BaseCommand):
+    help = (
+        'Rescore every activity with the current POINTS_RULES and re-derive '
+        'user totals, the leaderboard and the rollups'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers', type=int, default=os.cpu_count() or 1,
+            help='Worker processes rescoring in parallel (default: CPU count)'
+        )
+        parser.add_argument(
+            '--chunk-size', type=int, default=100000,
+            help='Activities per worker task (default 100000)'
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='Documents read and written per batch (default 1000)'
+        )
+
+    def handle(self, *args, **options):
+        if options['workers'] < 1 or options['chunk_size'] < 1 or options['batch_size'] < 1:
+            raise CommandError('--workers, --chunk-size and --batch-size must be positive')
+        db = get_db()
+        ensure_indexes(db)
+
+        self.stdout.write(f'Rescoring activities on {options["workers"]} workers...')
+        started = time.monotonic()
+
+        def progress(activities, changed):
+            elapsed = time.monotonic() - started
+            self.stdout.write(
+                f'  {activities} activities, {changed} changed '
+                f'({activities / elapsed:,.0f} activities/s)'
+            )
+
+        activities, changed, users = recompute(
+            db, workers=options['workers'], chunk_size=options['chunk_size'],
+            batch_size=options['batch_size'], progress=progress
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f'Rescored {activities} activities ({changed} changed) and re-derived the totals '
+            f'of {users} users in {time.monotonic() - started:.1f}s.'
+        ))
+
+        close_client()
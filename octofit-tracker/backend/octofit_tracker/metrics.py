@@ -0,0 +1,360 @@
+"""
+Per-endpoint request metrics in Prometheus text format.
+
+MetricsMiddleware times every request and labels it with the route (the
+URL pattern name), the viewset action and the HTTP method. For each label
+set it keeps latency and response size histograms, a status code counter,
+an in-flight gauge and histograms of the MongoDB commands and time spent
+per request. MongoDB commands are counted by a pymongo CommandListener
+registered process-wide in apps.py, so djongo's client is covered as well
+as the pooled one.
+
+GET /api/metrics renders everything, plus the pool and response cache
+statistics. Like /api/pool-stats/ the numbers are per worker process.
+
+Commands that Motor runs on its executor threads do not see the request
+context, so the async views' commands show up in the per-command totals
+but not in the per-request histograms.
+"""
+import asyncio
+import contextvars
+import os
+import threading
+import time
+from bisect import bisect_left
+from pymongo import monitoring
+from .cache import response_cache
+from .mongo import pool_stats
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (128, 512, 2048, 8192, 32768, 131072, 524288, 2097152, 8388608)
+COMMAND_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+UNMATCHED = 'unmatched'
+LABELS = ('route', 'action', 'method')
+
+_current = contextvars.ContextVar('octofit_request_stats', default=None)
+
+
+class Histogram:
+    """Fixed-bucket histogram; callers hold the registry lock"""
+    __slots__ = ('bounds', 'counts', 'sum')
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+
+    def samples(self):
+        """Yield (le, cumulative count) pairs ending with +Inf"""
+        total = 0
+        for bound, count in zip(self.bounds, self.counts):
+            total += count
+            yield format_value(bound), total
+        yield '+Inf', total + self.counts[-1]
+
+
+class RequestStats:
+    """MongoDB commands issued while serving one request, and its labels once known"""
+    __slots__ = ('commands', 'seconds', 'labels')
+
+    def __init__(self):
+        self.commands = 0
+        self.seconds = 0.0
+        self.labels = None
+
+
+class Series:
+    """Everything recorded for one (route, action, method)"""
+    __slots__ = ('in_flight', 'statuses', 'latency', 'size', 'commands', 'mongo_time')
+
+    def __init__(self):
+        self.in_flight = 0
+        self.statuses = {}
+        self.latency = Histogram(LATENCY_BUCKETS)
+        self.size = Histogram(SIZE_BUCKETS)
+        self.commands = Histogram(COMMAND_BUCKETS)
+        self.mongo_time = Histogram(LATENCY_BUCKETS)
+
+
+class Registry:
+    """Thread-safe store of request and MongoDB command metrics"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.series = {}
+            self.mongo_commands = {}
+            self.started = time.time()
+
+    def _series(self, labels):
+        series = self.series.get(labels)
+        if series is None:
+            series = self.series[labels] = Series()
+        return series
+
+    def request_started(self, labels):
+        with self._lock:
+            self._series(labels).in_flight += 1
+
+    def request_finished(self, labels, status, seconds, size, stats, in_flight=True):
+        with self._lock:
+            series = self._series(labels)
+            if in_flight:
+                series.in_flight -= 1
+            series.statuses[status] = series.statuses.get(status, 0) + 1
+            series.latency.observe(seconds)
+            if size is not None:
+                series.size.observe(size)
+            series.commands.observe(stats.commands)
+            series.mongo_time.observe(stats.seconds)
+
+    def response_streamed(self, labels, size):
+        with self._lock:
+            self._series(labels).size.observe(size)
+
+    def command_finished(self, name, seconds, failed):
+        with self._lock:
+            counts = self.mongo_commands.get(name)
+            if counts is None:
+                counts = self.mongo_commands[name] = [0, 0, 0.0]
+            counts[1 if failed else 0] += 1
+            counts[2] += seconds
+
+    def render(self):
+        """Return the registry, pool and cache metrics in Prometheus text format"""
+        lines = []
+        with self._lock:
+            series = sorted(self.series.items())
+            commands = sorted((name, list(counts)) for name, counts in self.mongo_commands.items())
+            started = self.started
+
+        metric(lines, 'octofit_http_requests_total', 'counter', 'Requests served, by status code')
+        for labels, entry in series:
+            for status, count in sorted(entry.statuses.items()):
+                lines.append(sample('octofit_http_requests_total', labels, count, status=status))
+        metric(lines, 'octofit_http_requests_in_flight', 'gauge', 'Requests being served')
+        for labels, entry in series:
+            lines.append(sample('octofit_http_requests_in_flight', labels, entry.in_flight))
+        for name, attribute, help_text in (
+            ('octofit_http_request_duration_seconds', 'latency', 'Request latency'),
+            ('octofit_http_response_size_bytes', 'size', 'Response body size'),
+            ('octofit_http_request_mongo_commands', 'commands', 'MongoDB commands issued per request'),
+            ('octofit_http_request_mongo_seconds', 'mongo_time', 'Time spent in MongoDB per request'),
+        ):
+            metric(lines, name, 'histogram', help_text)
+            for labels, entry in series:
+                histogram(lines, name, labels, getattr(entry, attribute))
+
+        metric(lines, 'octofit_mongo_commands_total', 'counter', 'MongoDB commands, by outcome')
+        for name, (succeeded, failed, _) in commands:
+            lines.append(sample('octofit_mongo_commands_total', (), succeeded, command=name, outcome='success'))
+            if failed:
+                lines.append(sample('octofit_mongo_commands_total', (), failed, command=name, outcome='failure'))
+        metric(lines, 'octofit_mongo_command_seconds_total', 'counter', 'Time spent in MongoDB commands')
+        for name, (_, _, seconds) in commands:
+            lines.append(sample('octofit_mongo_command_seconds_total', (), seconds, command=name))
+
+        pool = pool_stats()
+        for key, name, kind, help_text in (
+            ('open_connections', 'octofit_mongo_pool_open_connections', 'gauge', 'Open pooled connections'),
+            ('checked_out', 'octofit_mongo_pool_checked_out', 'gauge', 'Connections in use'),
+            ('checkouts', 'octofit_mongo_pool_checkouts_total', 'counter', 'Connection checkouts'),
+            ('checkout_failures', 'octofit_mongo_pool_checkout_failures_total', 'counter',
+             'Connection checkouts that failed'),
+            ('pool_clears', 'octofit_mongo_pool_clears_total', 'counter', 'Times the pool was cleared'),
+        ):
+            metric(lines, name, kind, help_text)
+            lines.append(sample(name, (), pool[key]))
+        metric(lines, 'octofit_mongo_pool_wait_seconds_total', 'counter', 'Time spent waiting for a connection')
+        lines.append(sample('octofit_mongo_pool_wait_seconds_total', (), pool['wait_time_total_ms'] / 1000))
+
+        cache = response_cache.stats()
+        for key in ('hits', 'misses', 'invalidations'):
+            name = f'octofit_response_cache_{key}_total'
+            metric(lines, name, 'counter', f'Response cache {key}')
+            lines.append(sample(name, (), cache[key]))
+        if 'entries' in cache:
+            metric(lines, 'octofit_response_cache_entries', 'gauge', 'Entries in the local response cache')
+            lines.append(sample('octofit_response_cache_entries', (), cache['entries']))
+
+        metric(lines, 'octofit_process_start_time_seconds', 'gauge', 'When this worker started recording')
+        lines.append(sample('octofit_process_start_time_seconds', (), started, pid=os.getpid()))
+        return '\n'.join(lines) + '\n'
+
+
+def format_value(value):
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def sample(name, labels, value, **extra):
+    pairs = list(zip(LABELS, labels)) + list(extra.items())
+    if not pairs:
+        return f'{name} {format_value(value)}'
+    rendered = ','.join(f'{key}="{escape(label)}"' for key, label in pairs)
+    return f'{name}{{{rendered}}} {format_value(value)}'
+
+
+def metric(lines, name, kind, help_text):
+    lines.append(f'# HELP {name} {help_text}')
+    lines.append(f'# TYPE {name} {kind}')
+
+
+def histogram(lines, name, labels, values):
+    for bound, count in values.samples():
+        lines.append(sample(f'{name}_bucket', labels, count, le=bound))
+    lines.append(sample(f'{name}_sum', labels, values.sum))
+    lines.append(sample(f'{name}_count', labels, sum(values.counts)))
+
+
+registry = Registry()
+
+
+class CommandListener(monitoring.CommandListener):
+    """Count MongoDB commands per request and per command name"""
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        self._finished(event, False)
+
+    def failed(self, event):
+        self._finished(event, True)
+
+    def _finished(self, event, failed):
+        seconds = event.duration_micros / 1e6
+        stats = _current.get()
+        if stats is not None:
+            stats.commands += 1
+            stats.seconds += seconds
+        registry.command_finished(event.command_name, seconds, failed)
+
+
+command_listener = CommandListener()
+
+
+def current_labels():
+    """(route, action, method) of the request being served, or None"""
+    stats = _current.get()
+    return stats.labels if stats is not None else None
+
+
+def request_labels(request, match):
+    """Return (route, action, method) for a request from its resolver match"""
+    method = request.method
+    if match is None:
+        return UNMATCHED, '', method
+    actions = getattr(match.func, 'actions', None) or {}
+    action = actions.get(method.lower()) or getattr(match.func, '__name__', '')
+    return match.view_name or match.route, action, method
+
+
+class MetricsMiddleware:
+    """
+    Record latency, response size, status, in-flight count and MongoDB
+    usage for every request. Works under both WSGI and ASGI.
+
+    Labels come from the URL resolution Django has already done by the
+    time process_view() runs, which is also when the request starts
+    counting as in flight. Requests that never reach a view (unknown
+    paths, a middleware answering early) are labelled at the end.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = asyncio.iscoroutinefunction(get_response)
+        if self.is_async:
+            # Tells Django's handler to await this middleware
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+            # Django wraps a sync process_view() in sync_to_async under ASGI
+            self.process_view = self.aprocess_view
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        stats = RequestStats()
+        token = _current.set(stats)
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        except BaseException:
+            self.finish(request, stats, started, None)
+            raise
+        finally:
+            _current.reset(token)
+        return self.finish(request, stats, started, response)
+
+    async def __acall__(self, request):
+        stats = RequestStats()
+        token = _current.set(stats)
+        started = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        except BaseException:
+            self.finish(request, stats, started, None)
+            raise
+        finally:
+            _current.reset(token)
+        return self.finish(request, stats, started, response)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        self.view_started(request)
+
+    async def aprocess_view(self, request, view_func, view_args, view_kwargs):
+        self.view_started(request)
+
+    def view_started(self, request):
+        labels = request._metrics_labels = request_labels(request, request.resolver_match)
+        stats = _current.get()
+        if stats is not None:
+            stats.labels = labels
+        registry.request_started(labels)
+
+    def finish(self, request, stats, started, response):
+        elapsed = time.perf_counter() - started
+        labels = getattr(request, '_metrics_labels', None)
+        in_flight = labels is not None
+        if not in_flight:
+            labels = request_labels(request, getattr(request, 'resolver_match', None))
+        if response is None:
+            # Only reached when the handler lets an exception propagate
+            status, size = 500, None
+        elif response.streaming:
+            # Measured once the body has been sent
+            response.streaming_content = self.count_streamed(labels, response.streaming_content)
+            status, size = response.status_code, None
+        else:
+            status, size = response.status_code, len(response.content)
+        registry.request_finished(labels, status, elapsed, size, stats, in_flight)
+        return response
+
+    def count_streamed(self, labels, chunks):
+        size = 0
+        for chunk in chunks:
+            size += len(chunk)
+            yield chunk
+        registry.response_streamed(labels, size)
+
+
+def _reset_after_fork():
+    # A child starts counting from zero, with a lock no thread can be holding
+    registry.__init__()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
@@ -0,0 +1,264 @@
+from pymongo import ReturnDocument
+from rest_framework import status
+from rest_framework.exceptions import APIException, NotFound, ValidationError
+from rest_framework.response import Response
+from rest_framework.validators import UniqueValidator
+from . import fast
+from .documents import VERSION, get_collection, id_candidates, id_filter, to_instance
+from .search import matches
+from .serializers import FastReadMixin
+
+
+class MongoLookupMixin:
+    """
+    Resolve detail routes with a single indexed `_id` query.
+    Matches both string and ObjectId ids so the collection is never scanned.
+    """
+
+    def get_collection(self):
+        """Return the PyMongo collection backing this viewset"""
+        return get_collection(self.queryset.model)
+
+    def get_object(self):
+        """
+        Fetch the object for the URL `_id` with one find_one call.
+        Retrieves only read the fields the serializer will output.
+        """
+        model = self.queryset.model
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        lookup_value = self.kwargs[lookup_url_kwarg]
+
+        projection = None
+        if self.action == 'retrieve':
+            projection = self.get_serializer().get_projection()
+            if projection is not None:
+                projection[VERSION] = 1
+        document = self.get_collection().find_one(id_filter(lookup_value), projection)
+        if document is None:
+            raise NotFound(f'No {model._meta.object_name} matches the given query.')
+
+        obj = to_instance(model, document)
+        self.check_object_permissions(self.request, obj)
+        return obj
+
+
+class PreconditionFailed(APIException):
+    status_code = status.HTTP_412_PRECONDITION_FAILED
+    default_detail = 'The resource has been modified since it was read.'
+    default_code = 'precondition_failed'
+
+
+def etag(version):
+    return f'"{version}"'
+
+
+def parse_if_match(header):
+    """
+    Return the versions an If-Match header accepts, or None when any version
+    does (no header, or `*`). Weak tags never match, as If-Match compares
+    strongly, so the list may be empty.
+    """
+    if header is None or header.strip() == '*':
+        return None
+    versions = []
+    for tag in header.split(','):
+        tag = tag.strip()
+        if len(tag) > 2 and tag[0] == tag[-1] == '"' and tag[1:-1].isdigit():
+            versions.append(int(tag[1:-1]))
+    return versions
+
+
+def version_filter(versions):
+    # Documents never updated through the API have no version field yet
+    values = versions + [None] if 0 in versions else versions
+    return {VERSION: {'$in': values}}
+
+
+class MongoUpdateMixin:
+    """
+    Update a document with one find_one_and_update that returns it updated.
+    Every update increments the document's `version`, which retrieves and
+    updates return as the ETag. An update sent with If-Match only applies
+    while the document is still at that version and fails with 412
+    otherwise, so a client cannot overwrite a change it has not seen.
+    Server-maintained fields such as points totals and ranks change without
+    a new version. Needs MongoLookupMixin.
+    """
+
+    def retrieve(self, request, *args, **kwargs):
+        instance = self.get_object()
+        response = Response(self.get_serializer(instance).data)
+        response['ETag'] = etag(instance._version)
+        return response
+
+    def update(self, request, *args, **kwargs):
+        partial = kwargs.pop('partial', False)
+        model = self.queryset.model
+        lookup_value = self.kwargs[self.lookup_url_kwarg or self.lookup_field]
+        # Validated against a stub, so the document is only read by the update
+        serializer = self.get_serializer(
+            to_instance(model, {'_id': lookup_value}), data=request.data, partial=partial
+        )
+        # The URL names the document; an `_id` in the body is ignored
+        serializer.fields['_id'].read_only = True
+        unique = self.pop_unique_validators(serializer)
+        serializer.is_valid(raise_exception=True)
+        self.validate_unique(serializer, unique, lookup_value)
+
+        versions = parse_if_match(request.headers.get('If-Match'))
+        query = id_filter(lookup_value)
+        if versions is not None:
+            query.update(version_filter(versions))
+        document = self.perform_mongo_update(query, self.get_changes(serializer))
+        if document is None:
+            if versions is not None and self.get_collection().find_one(
+                id_filter(lookup_value), {'_id': 1}
+            ) is not None:
+                raise PreconditionFailed()
+            raise NotFound(f'No {model._meta.object_name} matches the given query.')
+
+        instance = to_instance(model, document)
+        response = Response(self.get_serializer(instance).data)
+        response['ETag'] = etag(instance._version)
+        return response
+
+    def pop_unique_validators(self, serializer):
+        """
+        Take the UniqueValidators off the serializer's fields. They exclude
+        the document by the stub's pk, which misses ids stored as ObjectIds.
+        Returns {field name: validator}.
+        """
+        unique = {}
+        for name, field in serializer.fields.items():
+            for validator in field.validators:
+                if isinstance(validator, UniqueValidator):
+                    unique[name] = validator
+            if name in unique:
+                field.validators = [
+                    validator for validator in field.validators
+                    if not isinstance(validator, UniqueValidator)
+                ]
+        return unique
+
+    def validate_unique(self, serializer, unique, lookup_value):
+        """Check unique fields against every other document, whatever form its id has"""
+        errors = {}
+        for name, validator in unique.items():
+            source = serializer.fields[name].source
+            if source not in serializer.validated_data:
+                continue
+            clash = self.get_collection().find_one({
+                source: serializer.validated_data[source],
+                '_id': {'$nin': id_candidates(lookup_value)},
+            }, {'_id': 1})
+            if clash is not None:
+                errors[name] = [str(validator.message)]
+        if errors:
+            raise ValidationError(errors)
+
+    def get_changes(self, serializer):
+        """Return the fields a validated update sets"""
+        return dict(serializer.validated_data)
+
+    def get_update(self, changes):
+        """Return the update document setting `changes` and bumping the version"""
+        update = {'$inc': {VERSION: 1}}
+        if changes:
+            update['$set'] = changes
+        return update
+
+    def perform_mongo_update(self, query, changes):
+        """Apply validated `changes` to the document matching `query`; return it updated or None"""
+        return self.get_collection().find_one_and_update(
+            query, self.get_update(changes), return_document=ReturnDocument.AFTER
+        )
+
+
+class MongoListMixin:
+    """
+    Serve list routes and filtered actions from keyset-paginated MongoDB
+    range queries instead of djongo querysets.
+    """
+
+    def list(self, request, *args, **kwargs):
+        return self.list_documents({})
+
+    def list_documents(self, query, model=None, serializer_class=None, pagination_class=None,
+                       pending=()):
+        """
+        Serialize one page of `model` documents matching a MongoDB filter,
+        reading only the fields selected with ?fields= or ?exclude=.
+        `pending` documents, matching the filter but not stored yet, are
+        merged into the first page.
+        """
+        model = model or self.queryset.model
+        collection = get_collection(model)
+        paginator = pagination_class() if pagination_class else self.paginator
+        serializer_class = serializer_class or self.get_serializer_class()
+        selection = serializer_class(context=self.get_serializer_context())
+        projection = selection.get_projection()
+
+        if paginator is None:
+            documents = list(collection.find(query, projection))
+            stored = {document['_id'] for document in documents}
+            documents += [document for document in pending if document['_id'] not in stored]
+        else:
+            documents = paginator.paginate_documents(collection, query, self.request, projection)
+            documents = paginator.merge_first_page(documents, list(pending))
+
+        data = self.serialize_documents(documents, selection, model)
+        if paginator is None:
+            return Response(data)
+        return paginator.get_paginated_response(data)
+
+    def serialize_documents(self, documents, selection, model=None):
+        """Serialize raw documents with the serializer class and context of `selection`"""
+        if fast.enabled() and isinstance(selection, FastReadMixin):
+            return selection.to_documents_representation(documents)
+        model = model or self.queryset.model
+        instances = [to_instance(model, document) for document in documents]
+        return type(selection)(instances, many=True, context=selection.context).data
+
+
+class SearchMixin:
+    """
+    Serve ranked `?q=` searches from the inverted search index.
+    Needs MongoListMixin for serialization.
+    """
+    search_kind = None
+    max_search_results = 100
+
+    def search_documents(self, request):
+        """Serialize the best matches of ?q=, best first, each with its score"""
+        query = request.query_params.get('q', '').strip()
+        if not query:
+            return Response(
+                {'error': 'q parameter is required'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        try:
+            limit = int(request.query_params.get('limit', 20))
+        except ValueError:
+            return Response(
+                {'error': 'limit must be an integer'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        limit = max(1, min(limit, self.max_search_results))
+
+        ranked = matches(self.search_kind, query, limit)
+        selection = self.get_serializer()
+        found = self.get_search_documents([doc_id for doc_id, _ in ranked], selection)
+        # Postings of a document deleted outside the API may outlive it
+        ranked = [(doc_id, score) for doc_id, score in ranked if doc_id in found]
+        data = self.serialize_documents([found[doc_id] for doc_id, _ in ranked], selection)
+        for item, (_, score) in zip(data, ranked):
+            item['score'] = round(score, 4)
+        return Response({'query': query, 'results': data})
+
+    def get_search_documents(self, doc_ids, selection):
+        """Return {id: document} for matched ids with one $in query"""
+        candidates = [candidate for doc_id in doc_ids for candidate in id_candidates(doc_id)]
+        documents = self.get_collection().find(
+            {'_id': {'$in': candidates}}, selection.get_projection()
+        )
+        return {str(document['_id']): document for document in documents}
@@ -2,6 +2,27 @@ from django.db import models
 from djongo import models as djongo_models
 
 
+class DocumentListField(models.Field):
+    """
+    A list of embedded documents stored natively in MongoDB. djongo hands
+    the value to PyMongo as is, like djongo's JSONField, which needs the
+    optional jsoneditor package.
+    """
+
+    def __init__(self, *args, **kwargs):
+        kwargs.setdefault('default', list)
+        super().__init__(*args, **kwargs)
+
+    def get_internal_type(self):
+        return 'TextField'
+
+    def get_prep_value(self, value):
+        return value
+
+    def to_python(self, value):
+        return value
+
+
 class Team(models.Model):
     """Team model representing fitness teams"""
     _id = models.CharField(max_length=100, primary_key=True)
@@ -46,6 +67,8 @@ class Activity(models.Model):
     points_earned = models.IntegerField()
     date = models.DateTimeField()
     notes = models.TextField(blank=True)
+    # Team credited in the rollups, '' for none; see rollups.assign_teams
+    team_id = models.CharField(max_length=100, null=True, editable=False)
 
     class Meta:
         db_table = 'activities'
@@ -81,7 +104,7 @@ class Workout(models.Model):
     description = models.TextField()
     duration = models.IntegerField()  # minutes
     difficulty = models.CharField(max_length=50)
-    exercises = models.TextField(null=True, blank=True)  # Will be handled by serializer
+    exercises = DocumentListField(blank=True)
     category = models.CharField(max_length=100)
     created_at = models.DateTimeField()
 
@@ -0,0 +1,208 @@
+"""
+Process-wide pooled PyMongo client.
+
+One MongoClient is created lazily per worker process and shared by views,
+serializers and management commands. It is configured from
+DATABASES['default']['CLIENT'] (the same settings djongo uses) merged with
+MONGO_POOL, and is recreated after a fork so children never reuse the
+parent's sockets.
+
+The native async read views served by asgi.py use a Motor client with the
+same options, one per event loop.
+"""
+import asyncio
+import os
+import threading
+import time
+import weakref
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connections
+from pymongo import MongoClient, monitoring
+
+try:
+    from motor.motor_asyncio import AsyncIOMotorClient
+except ImportError:  # Only the async read views need motor
+    AsyncIOMotorClient = None
+
+_lock = threading.Lock()
+_client = None
+_client_pid = None
+_async_clients = weakref.WeakKeyDictionary()
+
+
+class PoolStatsListener(monitoring.ConnectionPoolListener):
+    """Connection pool listener that tracks checkouts and wait time"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.open_connections = 0
+            self.checked_out = 0
+            self.checkouts = 0
+            self.checkout_failures = 0
+            self.total_wait = 0.0
+            self.max_wait = 0.0
+            self.pool_clears = 0
+
+    def _record_wait(self):
+        started = getattr(self._local, 'started', None)
+        self._local.started = None
+        if started is None:
+            return 0.0
+        return time.perf_counter() - started
+
+    def connection_check_out_started(self, event):
+        self._local.started = time.perf_counter()
+
+    def connection_checked_out(self, event):
+        wait = self._record_wait()
+        with self._lock:
+            self.checked_out += 1
+            self.checkouts += 1
+            self.total_wait += wait
+            self.max_wait = max(self.max_wait, wait)
+
+    def connection_check_out_failed(self, event):
+        wait = self._record_wait()
+        with self._lock:
+            self.checkout_failures += 1
+            self.total_wait += wait
+            self.max_wait = max(self.max_wait, wait)
+
+    def connection_checked_in(self, event):
+        with self._lock:
+            self.checked_out -= 1
+
+    def connection_created(self, event):
+        with self._lock:
+            self.open_connections += 1
+
+    def connection_closed(self, event):
+        with self._lock:
+            self.open_connections -= 1
+
+    def connection_ready(self, event):
+        pass
+
+    def pool_created(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        with self._lock:
+            self.pool_clears += 1
+
+    def pool_closed(self, event):
+        pass
+
+    def snapshot(self):
+        """Return the current counters as a dict"""
+        with self._lock:
+            attempts = self.checkouts + self.checkout_failures
+            return {
+                'open_connections': self.open_connections,
+                'checked_out': self.checked_out,
+                'checkouts': self.checkouts,
+                'checkout_failures': self.checkout_failures,
+                'wait_time_total_ms': round(self.total_wait * 1000, 3),
+                'wait_time_avg_ms': round(self.total_wait * 1000 / attempts, 3) if attempts else 0.0,
+                'wait_time_max_ms': round(self.max_wait * 1000, 3),
+                'pool_clears': self.pool_clears,
+            }
+
+
+pool_listener = PoolStatsListener()
+
+
+def client_options():
+    """Build MongoClient keyword arguments from the Django settings"""
+    options = dict(connections['default'].settings_dict.get('CLIENT', {}))
+    options.update(getattr(settings, 'MONGO_POOL', {}))
+    return options
+
+
+def database_name():
+    """Return the configured database name (the test database under tests)"""
+    return connections['default'].settings_dict['NAME']
+
+
+def get_client():
+    """Return this process's MongoClient, creating it on first use"""
+    global _client, _client_pid
+    pid = os.getpid()
+    if _client is not None and _client_pid == pid:
+        return _client
+    with _lock:
+        if _client is None or _client_pid != pid:
+            # A client inherited across fork is discarded, not closed: its
+            # sockets still belong to the parent process.
+            _client = MongoClient(
+                connect=False,
+                event_listeners=[pool_listener],
+                **client_options()
+            )
+            _client_pid = pid
+            pool_listener.reset()
+    return _client
+
+
+def get_db():
+    """Return the application database on the pooled client"""
+    return get_client()[database_name()]
+
+
+def get_async_db():
+    """
+    Return the application database on the running event loop's Motor
+    client. Motor clients are bound to the loop they first run on.
+    """
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        if AsyncIOMotorClient is None:
+            raise ImproperlyConfigured('motor is required for the async read views')
+        client = AsyncIOMotorClient(event_listeners=[pool_listener], **client_options())
+        _async_clients[loop] = client
+    return client[database_name()]
+
+
+def close_client():
+    """Close the pooled client, e.g. at the end of a management command"""
+    global _client, _client_pid
+    with _lock:
+        if _client is not None and _client_pid == os.getpid():
+            _client.close()
+        _client = None
+        _client_pid = None
+
+
+def pool_stats():
+    """Return pool configuration and live statistics for this process"""
+    options = client_options()
+    stats = {
+        'pid': os.getpid(),
+        'connected': _client is not None and _client_pid == os.getpid(),
+        'max_pool_size': options.get('maxPoolSize', 100),
+        'min_pool_size': options.get('minPoolSize', 0),
+        'wait_queue_timeout_ms': options.get('waitQueueTimeoutMS'),
+    }
+    stats.update(pool_listener.snapshot())
+    return stats
+
+
+def _reset_after_fork():
+    # Locks may have been held by another thread at fork time.
+    global _lock, _client, _client_pid, _async_clients
+    _lock = threading.Lock()
+    _client = None
+    _client_pid = None
+    _async_clients = weakref.WeakKeyDictionary()
+    pool_listener.__init__()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
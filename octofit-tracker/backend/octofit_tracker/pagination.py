@@ -0,0 +1,209 @@
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from bisect import bisect_right
+from collections import OrderedDict
+from datetime import datetime
+from bson import ObjectId, json_util
+from pymongo import ASCENDING, DESCENDING
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
+
+# MongoDB's sort order of the BSON types used in sort keys, so keys can be
+# compared in Python. bool comes before int, which it subclasses.
+BSON_TYPE_ORDER = (
+    (type(None), 1), (bool, 8), ((int, float), 2), (str, 3), (ObjectId, 7), (datetime, 9),
+)
+
+
+def bson_order(value):
+    """Return a tuple that sorts `value` where MongoDB would"""
+    for types, rank in BSON_TYPE_ORDER:
+        if isinstance(value, types):
+            return (rank, value)
+    raise TypeError(f'Unsupported sort key type: {type(value).__name__}')
+
+
+class KeysetPagination(BasePagination):
+    """
+    Cursor pagination over raw MongoDB documents.
+    Each page is a range query that continues after the sort key of the
+    previous page's last document, so deep pages cost the same as page one
+    as long as the ordering is backed by an index. `_id` is always the final
+    tie-breaker, which keeps the key unique.
+    """
+    ordering = ('_id',)
+    page_size = api_settings.PAGE_SIZE or 50
+    max_page_size = 500
+    page_size_query_param = 'page_size'
+    cursor_query_param = 'cursor'
+    invalid_cursor_message = 'Invalid cursor'
+
+    def get_ordering(self):
+        """Return the ordering as (field, descending) pairs ending on _id"""
+        ordering = [
+            (field.lstrip('-'), field.startswith('-')) for field in self.ordering
+        ]
+        if ordering[-1][0] != '_id':
+            ordering.append(('_id', ordering[-1][1]))
+        return ordering
+
+    def get_sort(self):
+        """Return the PyMongo sort specification for the ordering"""
+        return [
+            (field, DESCENDING if descending else ASCENDING)
+            for field, descending in self.get_ordering()
+        ]
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        if page_size <= 0:
+            return self.page_size
+        return min(page_size, self.max_page_size)
+
+    def encode_cursor(self, key):
+        """Encode a sort key as an opaque, type-preserving token"""
+        return urlsafe_b64encode(json_util.dumps(key).encode('utf-8')).decode('ascii')
+
+    def decode_cursor(self, request):
+        """Return the sort key encoded in the request's cursor, if any"""
+        token = request.query_params.get(self.cursor_query_param)
+        if not token:
+            return None
+        try:
+            key = json_util.loads(urlsafe_b64decode(token.encode('ascii')).decode('utf-8'))
+        except (TypeError, ValueError, UnicodeError):
+            raise NotFound(self.invalid_cursor_message)
+        if not isinstance(key, list) or len(key) != len(self.get_ordering()):
+            raise NotFound(self.invalid_cursor_message)
+        return key
+
+    def get_key(self, document):
+        return [document.get(field) for field, _ in self.get_ordering()]
+
+    def after(self, field, value, descending):
+        """Match values strictly after `value` in the sort direction"""
+        condition = {field: {'$lt' if descending else '$gt': value}}
+        # Range operators never cross BSON types, but strings sort before
+        # ObjectIds, so mixed string/ObjectId ids need the other type added.
+        if isinstance(value, str) and not descending:
+            return {'$or': [condition, {field: {'$type': 'objectId'}}]}
+        if isinstance(value, ObjectId) and descending:
+            return {'$or': [condition, {field: {'$type': 'string'}}]}
+        return condition
+
+    def get_key_filter(self, key):
+        """Build the filter selecting documents after `key`"""
+        clauses = []
+        equal = {}
+        for (field, descending), value in zip(self.get_ordering(), key):
+            clauses.append(dict(equal, **self.after(field, value, descending)))
+            equal[field] = value
+        return clauses[0] if len(clauses) == 1 else {'$or': clauses}
+
+    def get_page_query(self, query, request):
+        """Restrict `query` to the documents after the request's cursor"""
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        key = self.decode_cursor(request)
+        if key is not None:
+            query = {'$and': [query, self.get_key_filter(key)]}
+        return query
+
+    def set_page(self, documents):
+        """Trim the page_size + 1 documents read for a page and note the next key"""
+        self.has_next = len(documents) > self.page_size
+        documents = documents[:self.page_size]
+        self.next_key = self.get_key(documents[-1]) if self.has_next else None
+        return documents
+
+    def sort_key(self, document):
+        """Return the document's sort key in a form Python compares as MongoDB does"""
+        return tuple(bson_order(value) for value in self.get_key(document))
+
+    def paginate_sorted(self, documents, keys, request):
+        """
+        Return one page of `documents`, held in memory already sorted on an
+        ascending ordering, with the same cursors as paginate_documents().
+        `keys` holds each document's sort_key().
+        """
+        if any(descending for _, descending in self.get_ordering()):
+            raise ValueError('paginate_sorted() only supports ascending orderings')
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        key = self.decode_cursor(request)
+        start = 0
+        if key is not None:
+            try:
+                start = bisect_right(keys, tuple(bson_order(value) for value in key))
+            except TypeError:
+                raise NotFound(self.invalid_cursor_message)
+        return self.set_page(documents[start:start + self.page_size + 1])
+
+    def merge_first_page(self, documents, extra):
+        """
+        Merge documents that are not in the collection yet into a page read
+        by paginate_documents(), in sort order, if it is the first page.
+        The next cursor still follows the stored documents.
+        """
+        if not extra or self.decode_cursor(self.request) is not None:
+            return documents
+        ids = {document['_id'] for document in documents}
+        documents = documents + [document for document in extra if document['_id'] not in ids]
+        # One stable sort per field, last field first, handles mixed directions
+        for field, descending in reversed(self.get_ordering()):
+            documents.sort(key=lambda document: bson_order(document.get(field)), reverse=descending)
+        return documents
+
+    def get_projection(self, projection):
+        """Add the sort key fields, which the next cursor is built from"""
+        if projection is None:
+            return None
+        return dict(projection, **{field: 1 for field, _ in self.get_ordering()})
+
+    def paginate_documents(self, collection, query, request, projection=None):
+        """Return one page of documents matching `query`"""
+        query = self.get_page_query(query, request)
+        return self.set_page(list(
+            collection.find(query, self.get_projection(projection))
+            .sort(self.get_sort())
+            .limit(self.page_size + 1)
+        ))
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(self.next_key))
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('results', data),
+        ]))
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'properties': {
+                'next': {
+                    'type': 'string',
+                    'nullable': True,
+                },
+                'results': schema,
+            },
+        }
+
+
+class ActivityPagination(KeysetPagination):
+    """Newest activities first"""
+    ordering = ('-date', '-_id')
+
+
+class LeaderboardPagination(KeysetPagination):
+    """Leaderboard in rank order"""
+    ordering = ('rank', '_id')
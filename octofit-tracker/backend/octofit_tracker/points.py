@@ -0,0 +1,243 @@
+"""
+Server-side points rules.
+
+An activity earns
+
+    min(CAP, int(MULTIPLIER * (duration * PER_MINUTE + int(distance * PER_KM))))
+
+points, with the values from settings.POINTS_RULES['DEFAULT'] overridden per
+activity type (matched ignoring case) by POINTS_RULES['TYPES']. The API
+computes `points_earned` on every create and update and ignores the value
+clients send.
+
+After a rules change `manage.py recompute_points` rescores every activity.
+Activities are split into `_id` ranges scored by worker processes, each
+reading its range in batches, scoring a batch with one vectorized NumPy
+expression and writing back only the points that changed. The workers'
+per-user totals are then written to `users` and `leaderboard`, the board is
+re-ranked and the rollups are rebuilt. Writes made while it runs may be
+overwritten, so run it while the API is idle.
+"""
+import multiprocessing
+from datetime import datetime, timezone
+import numpy as np
+from django.conf import settings
+from pymongo import ASCENDING, UpdateOne
+from .cache import invalidate
+from .documents import id_filter
+from .export import iter_batches
+from .leaderboard import invalidate_head, merge_deltas, repair_ranks
+from .mongo import get_db
+from .rollups import TEAM_WEEKLY, USER_DAILY, backfill
+
+DEFAULT_RULE = {'PER_MINUTE': 2, 'PER_KM': 10, 'MULTIPLIER': 1.0, 'CAP': None}
+# Activity fields the points depend on
+FIELDS = ('activity_type', 'duration', 'distance')
+
+
+class PointsRules:
+    """Scores activities, one at a time or in vectorized batches"""
+
+    def __init__(self, config):
+        self.config = config
+        self.default = dict(DEFAULT_RULE, **config.get('DEFAULT', {}))
+        self.types = {
+            activity_type.lower(): dict(self.default, **rule)
+            for activity_type, rule in config.get('TYPES', {}).items()
+        }
+        # One row of (per minute, per km, multiplier, cap) per rule, default first
+        self.rows = {name: row for row, name in enumerate(self.types, start=1)}
+        self.table = np.array([
+            [rule['PER_MINUTE'], rule['PER_KM'], rule['MULTIPLIER'],
+             np.inf if rule['CAP'] is None else rule['CAP']]
+            for rule in [self.default, *self.types.values()]
+        ], dtype=np.float64)
+
+    def rule(self, activity_type):
+        if isinstance(activity_type, str):
+            return self.types.get(activity_type.lower(), self.default)
+        return self.default
+
+    def points(self, activity):
+        """Return the points of one activity document"""
+        rule = self.rule(activity.get('activity_type'))
+        raw = (activity.get('duration') or 0) * rule['PER_MINUTE'] + int(
+            (activity.get('distance') or 0) * rule['PER_KM']
+        )
+        points = int(rule['MULTIPLIER'] * raw)
+        return points if rule['CAP'] is None else min(rule['CAP'], points)
+
+    def expression(self):
+        """
+        Return an aggregation expression for the points of the document it
+        is evaluated on, so an update pipeline can rescore from stored fields
+        """
+        def score(rule):
+            raw = {'$add': [
+                {'$multiply': [{'$ifNull': ['$duration', 0]}, rule['PER_MINUTE']]},
+                {'$trunc': {'$multiply': [{'$ifNull': ['$distance', 0]}, rule['PER_KM']]}},
+            ]}
+            points = {'$toInt': {'$trunc': {'$multiply': [rule['MULTIPLIER'], raw]}}}
+            return points if rule['CAP'] is None else {'$min': [rule['CAP'], points]}
+
+        if not self.types:
+            return score(self.default)
+        activity_type = {'$toLower': {'$ifNull': ['$activity_type', '']}}
+        return {'$switch': {
+            'branches': [
+                {'case': {'$eq': [activity_type, name]}, 'then': score(rule)}
+                for name, rule in self.types.items()
+            ],
+            'default': score(self.default),
+        }}
+
+    def points_array(self, activities):
+        """Return the points of many activity documents as an int64 array"""
+        count = len(activities)
+        rows = np.fromiter((
+            self.rows.get(activity_type.lower(), 0) if isinstance(activity_type, str) else 0
+            for activity_type in (activity.get('activity_type') for activity in activities)
+        ), dtype=np.intp, count=count)
+        duration = np.fromiter(
+            (activity.get('duration') or 0 for activity in activities), dtype=np.float64, count=count
+        )
+        distance = np.fromiter(
+            (activity.get('distance') or 0 for activity in activities), dtype=np.float64, count=count
+        )
+        per_minute, per_km, multiplier, cap = self.table[rows].T
+        raw = duration * per_minute + np.trunc(distance * per_km)
+        return np.minimum(np.trunc(multiplier * raw), cap).astype(np.int64)
+
+
+rules = PointsRules(getattr(settings, 'POINTS_RULES', {}))
+
+
+def id_ranges(collection, chunk_size):
+    """
+    Split a collection into (low, high) `_id` ranges of about chunk_size
+    documents, high None for the last range. Ranges never mix BSON types,
+    since MongoDB range queries only match values of the bound's type.
+    """
+    starts = []
+    current = None
+    size = 0
+    for document in collection.find({}, {'_id': 1}).sort('_id', ASCENDING).batch_size(10000):
+        value = document['_id']
+        if current is None or size >= chunk_size or type(value) is not type(current):
+            starts.append(value)
+            current = value
+            size = 0
+        size += 1
+    return [
+        (low, high if high is not None and type(high) is type(low) else None)
+        for low, high in zip(starts, starts[1:] + [None])
+    ]
+
+
+def range_filter(low, high):
+    bounds = {'$gte': low}
+    if high is not None:
+        bounds['$lt'] = high
+    return {'_id': bounds}
+
+
+def rescore_chunk(task):
+    """
+    Rescore the activities of one `_id` range. Runs in a worker process.
+    Returns (activities, changed, {user_id: [points, activities]}).
+    """
+    low, high, config, batch_size = task
+    chunk_rules = PointsRules(config)
+    activities = get_db().activities
+    projection = dict.fromkeys(FIELDS + ('user_id', 'points_earned'), 1)
+    cursor = activities.find(range_filter(low, high), projection).batch_size(batch_size)
+
+    scanned = changed = 0
+    totals = {}
+    for batch in iter_batches(cursor, batch_size):
+        updates = []
+        for activity, points in zip(batch, chunk_rules.points_array(batch).tolist()):
+            if activity.get('points_earned') != points:
+                updates.append(UpdateOne({'_id': activity['_id']}, {'$set': {'points_earned': points}}))
+            if activity.get('user_id') is not None:
+                total = totals.setdefault(str(activity['user_id']), [0, 0])
+                total[0] += points
+                total[1] += 1
+        if updates:
+            activities.bulk_write(updates, ordered=False)
+        scanned += len(batch)
+        changed += len(updates)
+    return scanned, changed, totals
+
+
+def apply_totals(db, totals, batch_size=1000):
+    """
+    Set every user's total points and leaderboard entry from {user_id:
+    [points, activities]}; users missing from `totals` are reset to zero.
+    """
+    now = datetime.now(timezone.utc)
+    for batch in iter_batches(iter(totals.items()), batch_size):
+        db.users.bulk_write([
+            UpdateOne(id_filter(user_id), {'$set': {'total_points': points}})
+            for user_id, (points, _) in batch
+        ], ordered=False)
+        db.leaderboard.bulk_write([
+            UpdateOne(id_filter(user_id, 'user_id'), {'$set': {
+                'total_points': points, 'activities_count': activities, 'last_updated': now,
+            }})
+            for user_id, (points, activities) in batch
+        ], ordered=False)
+
+    for collection, field, reset in (
+        (db.users, '_id', {'total_points': 0}),
+        (db.leaderboard, 'user_id', {'total_points': 0, 'activities_count': 0, 'last_updated': now}),
+    ):
+        stale = (
+            document['_id'] for document in collection.find(
+                {'$or': [{'total_points': {'$ne': 0}}, {'activities_count': {'$gt': 0}}]},
+                {field: 1}
+            )
+            if str(document.get(field)) not in totals
+        )
+        for batch in iter_batches(stale, batch_size):
+            collection.update_many({'_id': {'$in': batch}}, {'$set': reset})
+
+
+def recompute(db, workers=1, chunk_size=100000, batch_size=1000, progress=None):
+    """
+    Rescore every activity with the current rules, then re-derive user
+    totals, leaderboard ranks and rollups. `progress(activities, changed)`
+    is called after each chunk. Returns (activities, changed, users).
+    """
+    tasks = [
+        (low, high, rules.config, batch_size)
+        for low, high in id_ranges(db.activities, chunk_size)
+    ]
+    # Each worker drops the inherited client after the fork and opens its own
+    if workers == 1 or len(tasks) <= 1:
+        results = map(rescore_chunk, tasks)
+        pool = None
+    else:
+        pool = multiprocessing.get_context('fork').Pool(workers)
+        results = pool.imap_unordered(rescore_chunk, tasks)
+
+    scanned = changed = 0
+    totals = {}
+    try:
+        for chunk_scanned, chunk_changed, chunk_totals in results:
+            scanned += chunk_scanned
+            changed += chunk_changed
+            merge_deltas(totals, chunk_totals)
+            if progress is not None:
+                progress(scanned, changed)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    apply_totals(db, totals, batch_size)
+    repair_ranks(db.leaderboard)
+    backfill(db, batch_size=batch_size)
+    invalidate_head()
+    invalidate('activities', 'users', 'leaderboard', USER_DAILY, TEAM_WEEKLY)
+    return scanned, changed, len(totals)
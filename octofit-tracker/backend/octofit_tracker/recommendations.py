@@ -0,0 +1,267 @@
+"""
+Workout recommendations from activity history.
+
+Users and workouts share one feature space of three blocks:
+- category: the share of a user's minutes spent on each of CATEGORIES,
+  through ACTIVITY_CATEGORIES, against a workout's category;
+- difficulty: calories burned per minute placed between the LEVELS
+  centres, against a workout's difficulty;
+- duration: the average session length placed between the DURATIONS
+  centres, against a workout's duration.
+
+`user_features` holds one document per user with the sums those features
+are computed from. Activity writes apply deltas with $inc upserts, as the
+rollups do, so a user's row is always current and is read by `_id`. The
+workout matrix is built from the workout catalog with L2-normalised rows and
+rebuilt only when the catalog snapshot changes, so scoring a user is one
+matrix-vector product and an argpartition. recommend_many() scores a batch
+of users with one matrix product. `manage.py backfill_user_features`
+rebuilds the collection from `activities`.
+"""
+import numpy as np
+from pymongo import UpdateOne
+from .cache import invalidate
+from .catalog import get_catalog
+from .export import iter_batches
+from .mongo import get_db
+
+USER_FEATURES = 'user_features'
+
+CATEGORIES = ('cardio', 'strength', 'flexibility', 'core')
+# How an activity's minutes split across the workout categories, by lower
+# case activity type. Types named after a category count fully toward it.
+ACTIVITY_CATEGORIES = {
+    'running': {'cardio': 1.0},
+    'cycling': {'cardio': 1.0},
+    'swimming': {'cardio': 0.8, 'strength': 0.2},
+    'boxing': {'cardio': 0.6, 'core': 0.4},
+    'weightlifting': {'strength': 1.0},
+    'crossfit': {'strength': 0.5, 'cardio': 0.3, 'core': 0.2},
+    'yoga': {'flexibility': 0.7, 'core': 0.3},
+}
+# Workout difficulties and the calories per minute each one suits
+LEVELS = (('beginner', 6.0), ('intermediate', 10.0), ('advanced', 14.0))
+# Session lengths in minutes
+DURATIONS = (30.0, 60.0, 90.0)
+WEIGHTS = {'category': 1.0, 'difficulty': 0.6, 'duration': 0.4}
+
+FIELDS = ('activities', 'duration', 'calories_burned') + tuple(
+    f'minutes.{category}' for category in CATEGORIES
+)
+# Pseudo-activities added to every history so new users get a neutral profile
+PRIOR = dict(
+    {'activities': 2, 'duration': 90, 'calories_burned': 720},
+    **{f'minutes.{category}': 90 / len(CATEGORIES) for category in CATEGORIES}
+)
+
+_matrix = None
+
+
+def activity_categories(activity_type):
+    activity_type = (activity_type or '').lower()
+    if activity_type in CATEGORIES:
+        return {activity_type: 1.0}
+    return ACTIVITY_CATEGORIES.get(activity_type, {})
+
+
+def empty():
+    return dict.fromkeys(FIELDS, 0)
+
+
+def feature_deltas(before=None, after=None):
+    """
+    Return {user_id: {field: delta}} for an activity write.
+    `before` is None for creates and `after` is None for deletes.
+    """
+    deltas = {}
+    for document, sign in ((before, -1), (after, 1)):
+        if document is None or document.get('user_id') is None:
+            continue
+        delta = deltas.setdefault(str(document['user_id']), empty())
+        duration = document.get('duration') or 0
+        delta['activities'] += sign
+        delta['duration'] += sign * duration
+        delta['calories_burned'] += sign * (document.get('calories_burned') or 0)
+        for category, share in activity_categories(document.get('activity_type')).items():
+            delta[f'minutes.{category}'] += sign * duration * share
+    return {user_id: delta for user_id, delta in deltas.items() if any(delta.values())}
+
+
+def merge_feature_deltas(target, deltas):
+    """Accumulate `deltas` into `target` in place and return it"""
+    for user_id, delta in deltas.items():
+        totals = target.setdefault(user_id, empty())
+        for field in FIELDS:
+            totals[field] += delta[field]
+    return target
+
+
+def apply_feature_deltas(deltas):
+    """Apply {user_id: delta} with one upserting bulk write"""
+    if not deltas:
+        return
+    get_db()[USER_FEATURES].bulk_write([
+        UpdateOne({'_id': user_id}, {'$inc': delta}, upsert=True)
+        for user_id, delta in deltas.items()
+    ], ordered=False)
+    invalidate(USER_FEATURES)
+
+
+def backfill(db, batch_size=1000):
+    """Rebuild `user_features` from `activities` and return its document count"""
+    pipeline = [
+        {'$match': {'user_id': {'$ne': None}}},
+        {'$group': {
+            '_id': {'user_id': {'$toString': '$user_id'}, 'type': '$activity_type'},
+            'activities': {'$sum': 1},
+            'duration': {'$sum': {'$ifNull': ['$duration', 0]}},
+            'calories_burned': {'$sum': {'$ifNull': ['$calories_burned', 0]}},
+        }},
+        {'$group': {
+            '_id': '$_id.user_id',
+            'types': {'$push': {'type': '$_id.type', 'duration': '$duration'}},
+            'activities': {'$sum': '$activities'},
+            'duration': {'$sum': '$duration'},
+            'calories_burned': {'$sum': '$calories_burned'},
+        }},
+    ]
+    db[USER_FEATURES].delete_many({})
+
+    written = 0
+    cursor = db.activities.aggregate(pipeline, allowDiskUse=True, batchSize=batch_size)
+    for batch in iter_batches(cursor, batch_size):
+        documents = []
+        for group in batch:
+            minutes = dict.fromkeys(CATEGORIES, 0)
+            for entry in group['types']:
+                for category, share in activity_categories(entry['type']).items():
+                    minutes[category] += entry['duration'] * share
+            documents.append({
+                '_id': group['_id'],
+                'activities': group['activities'],
+                'duration': group['duration'],
+                'calories_burned': group['calories_burned'],
+                'minutes': minutes,
+            })
+        db[USER_FEATURES].insert_many(documents, ordered=False)
+        written += len(documents)
+    invalidate(USER_FEATURES)
+    return written
+
+
+def memberships(values, centres):
+    """
+    Place each value between the two nearest centres, as an (n, len(centres))
+    array whose rows sum to 1; values outside the centres clamp to the ends.
+    """
+    identity = np.eye(len(centres))
+    return np.stack([np.interp(values, centres, column) for column in identity], axis=1)
+
+
+def normalize(matrix):
+    """Scale rows to unit length so dot products are cosine similarities"""
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix / np.where(norms == 0, 1, norms)
+
+
+def user_matrix(rows):
+    """Return the normalised feature vectors of `user_features` documents"""
+    sums = np.array([
+        [row.get(field, 0) for field in FIELDS[:3]]
+        + [(row.get('minutes') or {}).get(category, 0) for category in CATEGORIES]
+        for row in rows
+    ], dtype=np.float64).reshape(len(rows), len(FIELDS))
+    sums += np.array([PRIOR[field] for field in FIELDS])
+    activities, duration, calories = sums[:, 0], sums[:, 1], sums[:, 2]
+    minutes = sums[:, 3:]
+
+    category = minutes / np.maximum(minutes.sum(axis=1, keepdims=True), 1e-9)
+    intensity = calories / np.maximum(duration, 1)
+    session = duration / np.maximum(activities, 1)
+    return normalize(np.hstack([
+        WEIGHTS['category'] * category,
+        WEIGHTS['difficulty'] * memberships(intensity, [centre for _, centre in LEVELS]),
+        WEIGHTS['duration'] * memberships(session, DURATIONS),
+    ])).astype(np.float32)
+
+
+def workout_features(documents):
+    """Return the normalised feature vectors of workout documents"""
+    categories = {category: index for index, category in enumerate(CATEGORIES)}
+    levels = {name: index for index, (name, _) in enumerate(LEVELS)}
+    category = np.zeros((len(documents), len(CATEGORIES)))
+    difficulty = np.zeros((len(documents), len(LEVELS)))
+    durations = np.zeros(len(documents))
+    for row, document in enumerate(documents):
+        if document.get('category') in categories:
+            category[row, categories[document['category']]] = 1
+        if document.get('difficulty') in levels:
+            difficulty[row, levels[document['difficulty']]] = 1
+        durations[row] = document.get('duration') or 0
+    return normalize(np.hstack([
+        WEIGHTS['category'] * category,
+        WEIGHTS['difficulty'] * difficulty,
+        WEIGHTS['duration'] * memberships(durations, DURATIONS),
+    ])).astype(np.float32)
+
+
+class WorkoutMatrix:
+    """Feature matrix of one workout catalog snapshot, rows in catalog order"""
+
+    def __init__(self, catalog):
+        self.version = catalog.version
+        self.documents = catalog.all.documents
+        self.features = workout_features(self.documents)
+
+    def __len__(self):
+        return len(self.documents)
+
+
+def workout_matrix():
+    """Return the matrix of the current catalog, rebuilding it after a change"""
+    global _matrix
+    catalog = get_catalog()
+    matrix = _matrix
+    if matrix is None or matrix.version != catalog.version:
+        matrix = _matrix = WorkoutMatrix(catalog)
+    return matrix
+
+
+def top(scores, limit):
+    """Indexes of the `limit` best scores, best first, ties in catalog order"""
+    if limit < len(scores):
+        candidates = np.argpartition(-scores, limit - 1)[:limit]
+    else:
+        candidates = np.arange(len(scores))
+    return candidates[np.lexsort((candidates, -scores[candidates]))]
+
+
+def ranked(matrix, scores, limit):
+    return [(matrix.documents[index], float(scores[index])) for index in top(scores, limit)]
+
+
+def recommend(user_id, limit=10):
+    """Return the user's `limit` best matching workouts as (document, score) pairs"""
+    matrix = workout_matrix()
+    if not len(matrix):
+        return []
+    row = get_db()[USER_FEATURES].find_one({'_id': str(user_id)}) or {}
+    scores = matrix.features @ user_matrix([row])[0]
+    return ranked(matrix, scores, limit)
+
+
+def recommend_many(user_ids, limit=10):
+    """Return {user_id: [(document, score), ...]} for many users at once"""
+    matrix = workout_matrix()
+    user_ids = [str(user_id) for user_id in user_ids]
+    if not len(matrix):
+        return {user_id: [] for user_id in user_ids}
+    rows = {
+        row['_id']: row
+        for row in get_db()[USER_FEATURES].find({'_id': {'$in': user_ids}})
+    }
+    scores = user_matrix([rows.get(user_id, {}) for user_id in user_ids]) @ matrix.features.T
+    return {
+        user_id: ranked(matrix, user_scores, limit)
+        for user_id, user_scores in zip(user_ids, scores)
+    }
@@ -0,0 +1,268 @@
+"""
+Pre-aggregated activity rollups.
+
+`user_daily_stats` holds one document per (user, UTC day) and
+`team_weekly_stats` one per (team, week starting Monday), each with the
+activity count and the sums of METRICS. Activity writes apply deltas with
+$inc upserts, so a range query reads one document per day or week instead of
+every activity. Activities count toward the team their user belonged to when
+they were created, or last given another user: assign_teams() stores it on
+the activity as `team_id`, so updates and deletes move the totals of that
+team even after the user changes teams. Activities without a stored team
+count toward their user's current team. `manage.py backfill_rollups`
+rebuilds both collections from `activities`.
+"""
+from datetime import datetime, timedelta, timezone
+from django.utils.dateparse import parse_datetime
+from pymongo import ASCENDING, UpdateOne
+from .cache import invalidate
+from .documents import id_candidates
+from .export import iter_batches
+from .mongo import get_db
+
+USER_DAILY = 'user_daily_stats'
+TEAM_WEEKLY = 'team_weekly_stats'
+METRICS = ('duration', 'distance', 'calories_burned', 'points_earned')
+FIELDS = ('activities',) + METRICS
+PERIODS = ('day', 'week', 'month')
+
+
+def day_of(moment):
+    """Return the UTC midnight (naive, as PyMongo stores it) of a datetime"""
+    if isinstance(moment, str):
+        moment = parse_datetime(moment)
+    if moment.tzinfo is not None:
+        moment = moment.astimezone(timezone.utc)
+    return datetime(moment.year, moment.month, moment.day)
+
+
+def week_of(day):
+    return day - timedelta(days=day.weekday())
+
+
+def month_of(day):
+    return day.replace(day=1)
+
+
+def empty():
+    return dict.fromkeys(FIELDS, 0)
+
+
+def accumulate(target, delta):
+    for field in FIELDS:
+        target[field] += delta[field]
+    return target
+
+
+def rollup_deltas(before=None, after=None):
+    """
+    Return {(user_id, team_id, day): {field: delta}} for an activity write.
+    `before` is None for creates and `after` is None for deletes. team_id
+    is the team stored on the activity, None if it has none.
+    """
+    deltas = {}
+    for document, sign in ((before, -1), (after, 1)):
+        if document is None or document.get('user_id') is None or document.get('date') is None:
+            continue
+        key = (str(document['user_id']), document.get('team_id'), day_of(document['date']))
+        delta = deltas.setdefault(key, empty())
+        delta['activities'] += sign
+        for metric in METRICS:
+            delta[metric] += sign * (document.get(metric) or 0)
+    return {key: delta for key, delta in deltas.items() if any(delta.values())}
+
+
+def merge_rollup_deltas(target, deltas):
+    """Accumulate `deltas` into `target` in place and return it"""
+    for key, delta in deltas.items():
+        accumulate(target.setdefault(key, empty()), delta)
+    return target
+
+
+def daily_key(user_id, day):
+    return f'{user_id}:{day:%Y-%m-%d}'
+
+
+def weekly_key(team_id, week):
+    return f'{team_id}:{week:%Y-%m-%d}'
+
+
+def user_teams(users, user_ids):
+    """Map user ids to team ids with one $in query"""
+    candidates = [candidate for user_id in user_ids for candidate in id_candidates(user_id)]
+    if not candidates:
+        return {}
+    return {
+        str(user['_id']): user.get('team_id')
+        for user in users.find({'_id': {'$in': candidates}}, {'team_id': 1})
+    }
+
+
+def assign_teams(documents):
+    """
+    Store the current team of each activity's user on it as `team_id`,
+    '' for a user without one, with one query for all of them
+    """
+    teams = user_teams(get_db().users, {
+        str(document['user_id']) for document in documents if document.get('user_id') is not None
+    })
+    for document in documents:
+        document['team_id'] = teams.get(str(document.get('user_id'))) or ''
+    return documents
+
+
+def apply_rollup_deltas(deltas):
+    """Apply {(user_id, team_id, day): delta} with one upserting bulk write per rollup"""
+    if not deltas:
+        return
+    db = get_db()
+    teams = user_teams(db.users, {
+        user_id for user_id, team_id, _ in deltas if team_id is None
+    })
+
+    daily = {}
+    weekly = {}
+    for (user_id, team_id, day), delta in deltas.items():
+        accumulate(daily.setdefault((user_id, day), empty()), delta)
+        if team_id is None:
+            team_id = teams.get(user_id)
+        if team_id:
+            accumulate(weekly.setdefault((team_id, week_of(day)), empty()), delta)
+
+    # A change of team alone leaves the user's days as they were
+    daily = [
+        UpdateOne(
+            {'_id': daily_key(user_id, day)},
+            {'$inc': delta, '$setOnInsert': {'user_id': user_id, 'day': day}},
+            upsert=True
+        )
+        for (user_id, day), delta in daily.items() if any(delta.values())
+    ]
+    if daily:
+        db[USER_DAILY].bulk_write(daily, ordered=False)
+    if weekly:
+        db[TEAM_WEEKLY].bulk_write([
+            UpdateOne(
+                {'_id': weekly_key(team_id, week)},
+                {'$inc': delta, '$setOnInsert': {'team_id': team_id, 'week': week}},
+                upsert=True
+            )
+            for (team_id, week), delta in weekly.items()
+        ], ordered=False)
+    invalidate(USER_DAILY, TEAM_WEEKLY)
+
+
+def backfill(db, batch_size=1000):
+    """
+    Rebuild both rollups from `activities` and return their document counts.
+    Days are grouped per stored team on the server, in user and day order;
+    weeks are summed from the daily rows.
+    """
+    pipeline = [
+        {'$match': {'date': {'$type': 'date'}}},
+        {'$group': dict(
+            {
+                '_id': {
+                    'user_id': {'$toString': '$user_id'},
+                    'day': {'$dateToString': {'format': '%Y-%m-%d', 'date': '$date'}},
+                    'team_id': {'$ifNull': ['$team_id', None]},
+                },
+                'activities': {'$sum': 1},
+            },
+            **{metric: {'$sum': {'$ifNull': [f'${metric}', 0]}} for metric in METRICS}
+        )},
+        {'$sort': {'_id.user_id': ASCENDING, '_id.day': ASCENDING}},
+    ]
+    db[USER_DAILY].delete_many({})
+    db[TEAM_WEEKLY].delete_many({})
+
+    days = 0
+    weekly = {}
+    documents = []
+    cursor = db.activities.aggregate(pipeline, allowDiskUse=True, batchSize=batch_size)
+    for batch in iter_batches(cursor, batch_size):
+        teams = user_teams(db.users, {
+            group['_id']['user_id'] for group in batch if group['_id']['team_id'] is None
+        })
+        for group in batch:
+            user_id = group['_id']['user_id']
+            day = datetime.strptime(group['_id']['day'], '%Y-%m-%d')
+            delta = {field: group[field] for field in FIELDS}
+            # A day whose activities were credited to several teams spans groups
+            key = daily_key(user_id, day)
+            if documents and documents[-1]['_id'] == key:
+                accumulate(documents[-1], delta)
+            else:
+                documents.append(dict(delta, _id=key, user_id=user_id, day=day))
+            team_id = group['_id']['team_id']
+            if team_id is None:
+                team_id = teams.get(user_id)
+            if team_id:
+                accumulate(weekly.setdefault((team_id, week_of(day)), empty()), delta)
+        # The last day may continue in the next batch
+        if len(documents) > 1:
+            db[USER_DAILY].insert_many(documents[:-1], ordered=False)
+            days += len(documents) - 1
+            documents = documents[-1:]
+    if documents:
+        db[USER_DAILY].insert_many(documents, ordered=False)
+        days += len(documents)
+
+    documents = [
+        dict(delta, _id=weekly_key(team_id, week), team_id=team_id, week=week)
+        for (team_id, week), delta in weekly.items()
+    ]
+    for batch in iter_batches(documents, batch_size):
+        db[TEAM_WEEKLY].insert_many(batch, ordered=False)
+    invalidate(USER_DAILY, TEAM_WEEKLY)
+    return days, len(documents)
+
+
+def range_filter(field, start, end, bucket):
+    bounds = {}
+    if start is not None:
+        bounds['$gte'] = bucket(day_of(start))
+    if end is not None:
+        bounds['$lte'] = bucket(day_of(end))
+    return {field: bounds} if bounds else {}
+
+
+def summarize(documents, field, bucket):
+    """Return totals and the per-period series of rollup documents"""
+    totals = empty()
+    periods = {}
+    for document in documents:
+        if not document.get('activities'):
+            continue
+        accumulate(totals, document)
+        accumulate(periods.setdefault(bucket(document[field]), empty()), document)
+    return {
+        'totals': rounded(totals),
+        'results': [
+            dict(rounded(values), start=start.date().isoformat())
+            for start, values in sorted(periods.items())
+        ],
+    }
+
+
+def rounded(values):
+    # Float sums of distance drift; two decimals match the input precision
+    return dict(values, distance=round(values['distance'], 2))
+
+
+def user_stats(user_id, start=None, end=None, period='day'):
+    """Activity totals for one user per day, week or month"""
+    bucket = {'day': lambda day: day, 'week': week_of, 'month': month_of}[period]
+    query = dict({'user_id': str(user_id)}, **range_filter('day', start, end, lambda day: day))
+    documents = get_db()[USER_DAILY].find(query).sort('day', ASCENDING)
+    return dict(summarize(documents, 'day', bucket), user_id=str(user_id), period=period)
+
+
+def team_stats(team_id, start=None, end=None):
+    """
+    Activity totals for one team per week. Weeks overlapping the range
+    are included whole.
+    """
+    query = dict({'team_id': team_id}, **range_filter('week', start, end, week_of))
+    documents = get_db()[TEAM_WEEKLY].find(query).sort('week', ASCENDING)
+    return dict(summarize(documents, 'week', lambda week: week), team_id=team_id, period='week')
@@ -0,0 +1,251 @@
+"""
+Inverted-index full-text search.
+
+Workouts are indexed on their name, description and exercise names and
+activities on their notes. `search_postings` holds one document per
+(kind, document, term) with the term's weight in that document: the field
+weights of its occurrences divided by the square root of the document's
+length. `search_terms` holds each term's document frequency.
+
+Writes keep both current. ORM saves and deletes (the viewsets' creates and
+the admin) reach index_saved() and remove_deleted() through signals
+connected in apps.py; the raw PyMongo write paths call index_documents()
+and remove_documents() themselves. A document's previous terms are read
+back from its postings, so callers never need its old text.
+
+A query scores documents by the sum of weight * idf over its terms, reading
+at most MAX_POSTINGS postings per term in weight order, so a common term
+costs the same however many documents contain it. `manage.py
+rebuild_search_index` rebuilds both collections.
+"""
+import math
+import re
+from collections import Counter
+from pymongo import DeleteOne, ReplaceOne, UpdateOne
+from .cache import invalidate
+from .catalog import parse_exercises
+from .export import iter_batches
+from .models import Activity, Workout
+from .mongo import get_db
+
+POSTINGS = 'search_postings'
+TERMS = 'search_terms'
+MAX_POSTINGS = 1000
+MAX_QUERY_TERMS = 10
+
+TOKEN = re.compile(r'\w+')
+STOPWORDS = frozenset(
+    'a an and are as at be by for from in into is it of on or that the this to with'.split()
+)
+
+
+def tokenize(text):
+    """Lower case word tokens of `text`, without stopwords and single characters"""
+    if not isinstance(text, str):
+        return []
+    return [
+        token for token in TOKEN.findall(text.lower())
+        if len(token) > 1 and token not in STOPWORDS
+    ]
+
+
+def workout_text(document):
+    """Yield (field weight, text) for the searchable parts of a workout"""
+    yield 3, document.get('name')
+    yield 1, document.get('description')
+    for exercise in parse_exercises(document.get('exercises')):
+        if isinstance(exercise, dict):
+            yield 2, exercise.get('name')
+
+
+def activity_text(document):
+    yield 1, document.get('notes')
+
+
+class SearchKind:
+    """A searchable model and how its documents' text is weighted"""
+
+    def __init__(self, name, model, fields, text):
+        self.name = name
+        self.model = model
+        self.fields = fields
+        self.text = text
+
+    @property
+    def collection(self):
+        return self.model._meta.db_table
+
+    def weights(self, document):
+        """Return {term: weight} for a raw document"""
+        counts = Counter()
+        for weight, text in self.text(document):
+            for token in tokenize(text):
+                counts[token] += weight
+        if not counts:
+            return {}
+        norm = math.sqrt(sum(counts.values()))
+        return {term: round(count / norm, 6) for term, count in counts.items()}
+
+
+KINDS = {
+    'workout': SearchKind('workout', Workout, ('name', 'description', 'exercises'), workout_text),
+    'activity': SearchKind('activity', Activity, ('notes',), activity_text),
+}
+MODEL_KINDS = {kind.model: kind for kind in KINDS.values()}
+
+
+def posting_key(kind, doc_id, term):
+    return f'{kind}:{doc_id}:{term}'
+
+
+def term_key(kind, term):
+    return f'{kind}:{term}'
+
+
+def index_documents(kind, documents, created=False):
+    """
+    Write the postings of raw documents, replacing the ones they had.
+    `created` skips reading previous postings for documents just inserted.
+    """
+    kind = KINDS[kind]
+    new = {str(document['_id']): kind.weights(document) for document in documents}
+    if not new:
+        return
+    db = get_db()
+    old = {doc_id: set() for doc_id in new}
+    if not created:
+        for posting in db[POSTINGS].find(
+            {'kind': kind.name, 'doc_id': {'$in': list(new)}}, {'doc_id': 1, 'term': 1}
+        ):
+            old[posting['doc_id']].add(posting['term'])
+
+    postings = []
+    frequencies = Counter()
+    for doc_id, weights in new.items():
+        for term in old[doc_id] - set(weights):
+            postings.append(DeleteOne({'_id': posting_key(kind.name, doc_id, term)}))
+            frequencies[term] -= 1
+        for term, weight in weights.items():
+            postings.append(ReplaceOne(
+                {'_id': posting_key(kind.name, doc_id, term)},
+                {'kind': kind.name, 'term': term, 'doc_id': doc_id, 'weight': weight},
+                upsert=True
+            ))
+            if term not in old[doc_id]:
+                frequencies[term] += 1
+    write(db, kind, postings, frequencies)
+
+
+def remove_documents(kind, doc_ids):
+    """Delete the postings of deleted documents"""
+    kind = KINDS[kind]
+    doc_ids = [str(doc_id) for doc_id in doc_ids]
+    if not doc_ids:
+        return
+    db = get_db()
+    postings = []
+    frequencies = Counter()
+    for posting in db[POSTINGS].find({'kind': kind.name, 'doc_id': {'$in': doc_ids}}, {'term': 1}):
+        postings.append(DeleteOne({'_id': posting['_id']}))
+        frequencies[posting['term']] -= 1
+    write(db, kind, postings, frequencies)
+
+
+def write(db, kind, postings, frequencies):
+    if postings:
+        db[POSTINGS].bulk_write(postings, ordered=False)
+    frequencies = {term: delta for term, delta in frequencies.items() if delta}
+    if frequencies:
+        db[TERMS].bulk_write([
+            UpdateOne(
+                {'_id': term_key(kind.name, term)},
+                {'$inc': {'df': delta}, '$setOnInsert': {'kind': kind.name, 'term': term}},
+                upsert=True
+            )
+            for term, delta in frequencies.items()
+        ], ordered=False)
+    if postings or frequencies:
+        invalidate(POSTINGS)
+
+
+def document_of(instance):
+    return {
+        field.attname: getattr(instance, field.attname)
+        for field in instance._meta.concrete_fields
+    }
+
+
+def index_saved(sender, instance, **kwargs):
+    """post_save receiver indexing an ORM save"""
+    created = kwargs.get('created', False)
+    index_documents(MODEL_KINDS[sender].name, [document_of(instance)], created=created)
+
+
+def remove_deleted(sender, instance, **kwargs):
+    """post_delete receiver removing an ORM delete from the index"""
+    remove_documents(MODEL_KINDS[sender].name, [instance.pk])
+
+
+def matches(kind, query, limit=20):
+    """
+    Return [(doc_id, score), ...] for the `limit` best matches of `query`,
+    best first. Terms are OR-ed; rarer terms weigh more.
+    """
+    kind = KINDS[kind]
+    terms = list(dict.fromkeys(tokenize(query)))[:MAX_QUERY_TERMS]
+    if not terms:
+        return []
+    db = get_db()
+    frequencies = {
+        entry['term']: entry['df']
+        for entry in db[TERMS].find({'_id': {'$in': [term_key(kind.name, term) for term in terms]}})
+        if entry.get('df', 0) > 0
+    }
+    if not frequencies:
+        return []
+    total = max(db[kind.collection].estimated_document_count(), max(frequencies.values()))
+
+    scores = Counter()
+    for term, frequency in frequencies.items():
+        idf = math.log(1 + total / frequency)
+        postings = (
+            db[POSTINGS].find({'kind': kind.name, 'term': term}, {'doc_id': 1, 'weight': 1})
+            .sort('weight', -1)
+            .limit(MAX_POSTINGS)
+        )
+        for posting in postings:
+            scores[posting['doc_id']] += posting['weight'] * idf
+    # Ties in score are broken by id so results are stable
+    ranked = sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+    return ranked[:limit]
+
+
+def rebuild(db, batch_size=1000):
+    """Rebuild the postings and term frequencies of every kind; return the posting count"""
+    db[POSTINGS].delete_many({})
+    db[TERMS].delete_many({})
+    written = 0
+    for kind in KINDS.values():
+        frequencies = Counter()
+        projection = dict.fromkeys(kind.fields, 1)
+        for batch in iter_batches(db[kind.collection].find({}, projection), batch_size):
+            postings = []
+            for document in batch:
+                doc_id = str(document['_id'])
+                for term, weight in kind.weights(document).items():
+                    postings.append({
+                        '_id': posting_key(kind.name, doc_id, term),
+                        'kind': kind.name, 'term': term, 'doc_id': doc_id, 'weight': weight,
+                    })
+                    frequencies[term] += 1
+            if postings:
+                db[POSTINGS].insert_many(postings, ordered=False)
+                written += len(postings)
+        terms = [
+            {'_id': term_key(kind.name, term), 'kind': kind.name, 'term': term, 'df': frequency}
+            for term, frequency in frequencies.items()
+        ]
+        for batch in iter_batches(terms, batch_size):
+            db[TERMS].insert_many(batch, ordered=False)
+    invalidate(POSTINGS)
+    return written
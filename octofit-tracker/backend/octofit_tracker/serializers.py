@@ -1,8 +1,80 @@
+from pymongo.errors import PyMongoError
 from rest_framework import serializers
+from rest_framework.exceptions import ValidationError
+from rest_framework.permissions import SAFE_METHODS
+from . import fast
+from .catalog import parse_exercises
+from .documents import get_collection, id_candidates
 from .models import Team, User, Activity, Leaderboard, Workout
 
+UNKNOWN_USER = 'Unknown User'
 
-class TeamSerializer(serializers.ModelSerializer):
+
+def parse_field_names(request, param):
+    """Return the comma-separated names in a query parameter, or None when absent"""
+    values = request.query_params.getlist(param)
+    if not values:
+        return None
+    return [name.strip() for value in values for name in value.split(',') if name.strip()]
+
+
+class SparseFieldsMixin:
+    """
+    Let read requests pick serializer fields with ?fields=a,b or drop them
+    with ?exclude=c. `document_fields` names the document fields a computed
+    field reads, so get_projection() can push the selection down to MongoDB.
+    """
+    document_fields = {}
+
+    def get_fields(self):
+        fields = super().get_fields()
+        self._sparse = False
+        request = self.context.get('request')
+        if getattr(request, 'method', None) not in SAFE_METHODS:
+            return fields
+
+        for param, keep in (('fields', True), ('exclude', False)):
+            names = parse_field_names(request, param)
+            if names is None:
+                continue
+            unknown = [name for name in names if name not in fields]
+            if unknown:
+                raise ValidationError({param: [f'Unknown field: {name}' for name in unknown]})
+            fields = type(fields)(
+                (name, field) for name, field in fields.items() if (name in names) == keep
+            )
+            self._sparse = True
+        return fields
+
+    def get_projection(self):
+        """Return the MongoDB projection the selected fields need, or None for all"""
+        fields = self.fields
+        if not self._sparse:
+            return None
+        projection = {'_id': 1}
+        for name, field in fields.items():
+            if field.write_only:
+                continue
+            if name in self.document_fields:
+                sources = self.document_fields[name]
+            else:
+                sources = [name if field.source == '*' else field.source.split('.')[0]]
+            projection.update(dict.fromkeys(sources, 1))
+        return projection
+
+
+class FastReadMixin:
+    """
+    Opt a serializer in to fast.serialize_documents() for list responses
+    when settings.FAST_SERIALIZATION is on.
+    """
+
+    def to_documents_representation(self, documents):
+        """Serialize raw MongoDB documents without building model instances"""
+        return fast.serialize_documents(self, documents)
+
+
+class TeamSerializer(FastReadMixin, SparseFieldsMixin, serializers.ModelSerializer):
     """Serializer for Team model"""
     
     class Meta:
@@ -10,7 +82,7 @@ class TeamSerializer(serializers.ModelSerializer):
         fields = ['_id', 'name', 'description', 'created_at', 'member_count']
 
 
-class UserSerializer(serializers.ModelSerializer):
+class UserSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     """Serializer for User model"""
     
     class Meta:
@@ -21,30 +93,85 @@ class UserSerializer(serializers.ModelSerializer):
         }
 
 
-class ActivitySerializer(serializers.ModelSerializer):
+class UserNameMap(dict):
+    """Identity map of user ids to names, shared across a request"""
+
+    def resolve(self, user_ids):
+        """Load every id not yet mapped with a single $in query"""
+        missing = {str(user_id) for user_id in user_ids if user_id is not None} - self.keys()
+        if not missing:
+            return
+        candidates = [candidate for user_id in missing for candidate in id_candidates(user_id)]
+        try:
+            users = get_collection(User).find({'_id': {'$in': candidates}}, {'name': 1})
+            for user in users:
+                self[str(user['_id'])] = user.get('name', UNKNOWN_USER)
+        except PyMongoError:
+            pass
+        for user_id in missing:
+            self.setdefault(user_id, UNKNOWN_USER)
+
+
+def get_user_name_map(serializer):
+    """Return the identity map for the current request, or the serializer tree"""
+    owner = serializer.context.get('request')
+    if owner is None:
+        owner = serializer.root
+    user_names = getattr(owner, '_user_names', None)
+    if user_names is None:
+        user_names = owner._user_names = UserNameMap()
+    return user_names
+
+
+class ActivityListSerializer(serializers.ListSerializer):
+    """Resolve user names for a whole page of activities in one query"""
+
+    def to_representation(self, data):
+        activities = list(data.all() if hasattr(data, 'all') else data)
+        if 'user_name' in self.child.fields:
+            get_user_name_map(self).resolve(activity.user_id for activity in activities)
+        return super().to_representation(activities)
+
+
+class ActivitySerializer(FastReadMixin, SparseFieldsMixin, serializers.ModelSerializer):
     """Serializer for Activity model"""
     user_name = serializers.SerializerMethodField()
+    document_fields = {'user_name': ['user_id']}
     
     class Meta:
         model = Activity
         fields = ['_id', 'user_id', 'user_name', 'activity_type', 'duration', 'distance', 
                   'calories_burned', 'points_earned', 'date', 'notes']
+        # Computed from the points rules on every write
+        read_only_fields = ['points_earned']
+        list_serializer_class = ActivityListSerializer
     
+    def prefetch_documents(self, documents):
+        """Resolve the user names of a page of raw documents in one query"""
+        if 'user_name' in self.fields:
+            get_user_name_map(self).resolve(document.get('user_id') for document in documents)
+
     def get_user_name(self, obj):
-        """Get user name from user_id using MongoDB directly"""
-        try:
-            from pymongo import MongoClient
-            client = MongoClient('mongodb://localhost:27017/')
-            db = client['octofit_db']
-            user = db.users.find_one({'_id': obj.user_id})
-            if user:
-                return user.get('name', 'Unknown User')
-            return 'Unknown User'
-        except Exception as e:
-            return 'Unknown User'
-
-
-class LeaderboardSerializer(serializers.ModelSerializer):
+        """Get user name from user_id through the request's identity map"""
+        if obj.user_id is None:
+            return UNKNOWN_USER
+        user_names = get_user_name_map(self)
+        user_id = str(obj.user_id)
+        if user_id not in user_names:
+            user_names.resolve([user_id])
+        return user_names[user_id]
+
+
+class BulkActivitySerializer(ActivitySerializer):
+    """
+    Validates one record of a bulk upload.
+    `_id` is optional and not checked for uniqueness here: duplicates are
+    reported per item by the unordered insert instead of costing a query each.
+    """
+    _id = serializers.CharField(max_length=100, required=False)
+
+
+class LeaderboardSerializer(FastReadMixin, SparseFieldsMixin, serializers.ModelSerializer):
     """Serializer for Leaderboard model"""
     
     class Meta:
@@ -53,27 +180,22 @@ class LeaderboardSerializer(serializers.ModelSerializer):
                   'activities_count', 'rank', 'last_updated']
 
 
-class WorkoutSerializer(serializers.ModelSerializer):
+class ExerciseListField(serializers.ListField):
+    """
+    Exercises as embedded documents: validated as a list of objects, output
+    as stored, with exercises not converted from JSON text yet parsed
+    """
+    child = serializers.DictField()
+
+    def to_representation(self, data):
+        return data if isinstance(data, list) else parse_exercises(data)
+
+
+class WorkoutSerializer(FastReadMixin, SparseFieldsMixin, serializers.ModelSerializer):
     """Serializer for Workout model"""
-    exercises = serializers.SerializerMethodField()
+    exercises = ExerciseListField(required=False)
     
     class Meta:
         model = Workout
         fields = ['_id', 'name', 'description', 'duration', 'difficulty', 
                   'exercises', 'category', 'created_at']
-    
-    def get_exercises(self, obj):
-        """Handle exercises field which comes from MongoDB as a list"""
-        try:
-            # If exercises is already a list, return it as-is
-            if isinstance(obj.exercises, list):
-                return obj.exercises
-            # If it's None or empty, return empty list
-            elif obj.exercises is None or obj.exercises == '':
-                return []
-            # If it's a string, try to parse it as JSON
-            else:
-                import json
-                return json.loads(obj.exercises)
-        except:
-            return []
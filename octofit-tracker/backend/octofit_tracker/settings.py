@@ -54,6 +54,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'octofit_tracker.metrics.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -64,7 +65,7 @@ MIDDLEWARE = [
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
-ROOT_URLCONF = 'octofit_tracker.urls'
+ROOT_URLCONF = os.getenv('OCTOFIT_URLCONF', 'octofit_tracker.urls')
 
 TEMPLATES = [
     {
@@ -94,12 +95,29 @@ DATABASES = {
         'NAME': 'octofit_db',
         'ENFORCE_SCHEMA': False,
         'CLIENT': {
-            'host': 'localhost',
-            'port': 27017,
+            'host': os.getenv('MONGO_HOST', 'localhost'),
+            'port': int(os.getenv('MONGO_PORT', '27017')),
         }
     }
 }
 
+# Pool tuning for the process-wide PyMongo client in octofit_tracker.mongo.
+# Merged over DATABASES['default']['CLIENT'].
+MONGO_POOL = {
+    'maxPoolSize': int(os.getenv('MONGO_MAX_POOL_SIZE', '50')),
+    'minPoolSize': int(os.getenv('MONGO_MIN_POOL_SIZE', '0')),
+    'maxIdleTimeMS': int(os.getenv('MONGO_MAX_IDLE_TIME_MS', '300000')),
+    'waitQueueTimeoutMS': int(os.getenv('MONGO_WAIT_QUEUE_TIMEOUT_MS', '2000')),
+    'connectTimeoutMS': int(os.getenv('MONGO_CONNECT_TIMEOUT_MS', '5000')),
+    'socketTimeoutMS': int(os.getenv('MONGO_SOCKET_TIMEOUT_MS', '30000')),
+    'serverSelectionTimeoutMS': int(os.getenv('MONGO_SERVER_SELECTION_TIMEOUT_MS', '5000')),
+}
+
+# Wire compression, e.g. 'zstd,snappy,zlib' (zstd and snappy need extra packages)
+MONGO_COMPRESSORS = os.getenv('MONGO_COMPRESSORS')
+if MONGO_COMPRESSORS:
+    MONGO_POOL['compressors'] = MONGO_COMPRESSORS
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.1/ref/settings/#auth-password-validators
@@ -142,6 +160,63 @@ STATIC_URL = 'static/'
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
+# Django REST framework
+# List endpoints use keyset pagination; clients may lower or raise page_size
+# up to KeysetPagination.max_page_size.
+REST_FRAMEWORK = {
+    'DEFAULT_PAGINATION_CLASS': 'octofit_tracker.pagination.KeysetPagination',
+    'PAGE_SIZE': 50,
+}
+
+# Serialize list pages straight from raw documents and render with orjson
+# when installed (octofit_tracker.fast). Responses are byte-identical.
+FAST_SERIALIZATION = os.getenv('FAST_SERIALIZATION', 'false').lower() == 'true'
+if FAST_SERIALIZATION:
+    REST_FRAMEWORK['DEFAULT_RENDERER_CLASSES'] = [
+        'octofit_tracker.fast.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ]
+
+# Read-through response cache for hot read endpoints (octofit_tracker.cache).
+# BACKEND is 'local' for a per-process LRU, or a CACHES alias for a shared cache.
+RESPONSE_CACHE = {
+    'BACKEND': os.getenv('RESPONSE_CACHE_BACKEND', 'local'),
+    'TTL': int(os.getenv('RESPONSE_CACHE_TTL', '30')),
+    'MAX_ENTRIES': int(os.getenv('RESPONSE_CACHE_MAX_ENTRIES', '1024')),
+}
+
+# Slow MongoDB command log (octofit_tracker.slowlog), shown at /admin/slow-commands/.
+# Off by default; a sample of the slow reads is explained in the background to
+# catch collection scans.
+SLOW_COMMAND_LOG = {
+    'ENABLED': os.getenv('SLOW_COMMAND_LOG', 'false').lower() == 'true',
+    'THRESHOLD_MS': float(os.getenv('SLOW_COMMAND_THRESHOLD_MS', '100')),
+    'MAX_ENTRIES': int(os.getenv('SLOW_COMMAND_MAX_ENTRIES', '500')),
+    'EXPLAIN_SAMPLE_RATE': float(os.getenv('SLOW_COMMAND_EXPLAIN_RATE', '0.1')),
+}
+
+# Points rules (octofit_tracker.points). An activity earns
+# min(CAP, int(MULTIPLIER * (duration * PER_MINUTE + int(distance * PER_KM)))) points;
+# TYPES overrides any of the DEFAULT values per activity type, e.g.
+# {'Yoga': {'MULTIPLIER': 1.5}, 'Cycling': {'PER_KM': 4, 'CAP': 400}}.
+# Run `manage.py recompute_points` after changing them.
+POINTS_RULES = {
+    'DEFAULT': {'PER_MINUTE': 2, 'PER_KM': 10, 'MULTIPLIER': 1.0, 'CAP': None},
+    'TYPES': {},
+}
+
+# Write-behind activity creation (octofit_tracker.writebehind). POST /api/activities/
+# queues the activity in an append-only file under DIRECTORY and returns 202; a
+# background thread persists the queue in batches. Each worker needs DIRECTORY on
+# local disk, shared by the workers of one host so restarts can recover the queue.
+WRITE_BEHIND = {
+    'ENABLED': os.getenv('WRITE_BEHIND', 'false').lower() == 'true',
+    'DIRECTORY': os.getenv('WRITE_BEHIND_DIR', str(BASE_DIR / 'write-behind')),
+    'FLUSH_INTERVAL': float(os.getenv('WRITE_BEHIND_FLUSH_INTERVAL', '0.5')),
+    'BATCH_SIZE': int(os.getenv('WRITE_BEHIND_BATCH_SIZE', '1000')),
+    'FSYNC': os.getenv('WRITE_BEHIND_FSYNC', 'true').lower() == 'true',
+}
+
 # CORS settings
 CORS_ALLOW_ALL_ORIGINS = True
 CORS_ALLOW_CREDENTIALS = True
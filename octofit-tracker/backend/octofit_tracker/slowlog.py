@@ -0,0 +1,220 @@
+"""
+Slow MongoDB command log.
+
+Off unless SLOW_COMMAND_LOG['ENABLED']. A pymongo CommandListener,
+registered process-wide in apps.py so djongo's translated queries are seen
+too, then records every command that takes longer than
+SLOW_COMMAND_LOG['THRESHOLD_MS']. PyMongo only reports to listeners
+registered before a client is created, so the listener is always
+registered and returns at once while disabled. Each record carries the route,
+viewset action and method of the request that issued it (from
+MetricsMiddleware) and the command itself, and is kept in a ring buffer of
+SLOW_COMMAND_LOG['MAX_ENTRIES'].
+
+A sample of slow reads (EXPLAIN_SAMPLE_RATE) is explained with
+queryPlanner verbosity on a background thread, so the request never waits
+for it. The winning plan's stages and indexes are stored with the record
+and plans that scan a whole collection are flagged. The log is shown at
+/admin/slow-commands/.
+"""
+import os
+import queue
+import random
+import threading
+from collections import deque
+from datetime import datetime, timezone
+from itertools import count
+from bson import json_util
+from django.conf import settings
+from pymongo import monitoring
+from .metrics import current_labels
+from .mongo import get_client
+
+DEFAULTS = {
+    'ENABLED': False,
+    'THRESHOLD_MS': 100,
+    'MAX_ENTRIES': 500,
+    'EXPLAIN_SAMPLE_RATE': 0.1,
+}
+
+# Commands the server can explain without executing them
+EXPLAINABLE = {'find', 'aggregate', 'count', 'distinct', 'update', 'delete', 'findAndModify'}
+# Session, transaction and routing fields explain rejects or does not need
+NOT_EXPLAINED = {
+    '$db', 'lsid', '$clusterTime', '$readPreference', 'txnNumber', 'autocommit',
+    'startTransaction', 'readConcern', 'writeConcern',
+}
+MAX_COMMAND_LENGTH = 2000
+EXPLAIN_QUEUE_SIZE = 64
+MAX_PENDING = 10000
+
+
+class SlowCommand:
+    """One logged command; the explain fields fill in once the plan is back"""
+
+    def __init__(self, entry_id, event, command, seconds, failed, labels):
+        command = command or {}
+        self.id = entry_id
+        self.at = datetime.now(timezone.utc)
+        self.command_name = event.command_name
+        self.database = event.database_name
+        target = command.get(event.command_name)
+        self.collection = target if isinstance(target, str) else command.get('collection', '')
+        self.duration_ms = round(seconds * 1000, 3)
+        self.failed = failed
+        self.route, self.action, self.method = labels or ('', '', '')
+        self.command = truncate(json_util.dumps(abbreviate(without(command, NOT_EXPLAINED))))
+        self.explain_status = 'not sampled'
+        self.plan_stages = []
+        self.plan_indexes = []
+        self.collscan = False
+
+
+def without(document, keys):
+    return {key: value for key, value in (document or {}).items() if key not in keys}
+
+
+def abbreviate(command):
+    """Shorten bulk write payloads before they are encoded for display"""
+    for key in ('documents', 'updates', 'deletes'):
+        items = command.get(key)
+        if isinstance(items, list) and len(items) > 3:
+            command[key] = items[:3] + [f'... {len(items) - 3} more']
+    return command
+
+
+def truncate(text):
+    return text if len(text) <= MAX_COMMAND_LENGTH else text[:MAX_COMMAND_LENGTH] + '...'
+
+
+def plan_summary(plan):
+    """Return ([stage, ...], [index name, ...]) for a queryPlanner winning plan, root first"""
+    stages, indexes = [], []
+    pending = [plan]
+    while pending:
+        node = pending.pop()
+        if not isinstance(node, dict):
+            continue
+        if 'stage' in node:
+            stages.append(node['stage'])
+        if 'indexName' in node:
+            indexes.append(node['indexName'])
+        for key in ('inputStage', 'queryPlan'):
+            if key in node:
+                pending.append(node[key])
+        pending.extend(reversed(node.get('inputStages', [])))
+    return stages, indexes
+
+
+def winning_plans(explain):
+    """Yield the winning plans of a find/count/update or an aggregate explain"""
+    planner = explain.get('queryPlanner')
+    if planner is not None:
+        yield planner.get('winningPlan', {})
+    for stage in explain.get('stages', []):
+        cursor = stage.get('$cursor', {})
+        if 'queryPlanner' in cursor:
+            yield cursor['queryPlanner'].get('winningPlan', {})
+
+
+class SlowCommandLog(monitoring.CommandListener):
+    """Command listener that keeps the slowest commands in a ring buffer"""
+
+    def __init__(self, config):
+        self.enabled = config['ENABLED']
+        self.threshold = config['THRESHOLD_MS'] / 1000
+        self.sample_rate = config['EXPLAIN_SAMPLE_RATE']
+        self.entries = deque(maxlen=config['MAX_ENTRIES'])
+        self._started = {}
+        self._started_lock = threading.Lock()
+        self._ids = count(1)
+        self._lock = threading.Lock()
+        self._queue = None
+
+    def started(self, event):
+        if not self.enabled:
+            return
+        with self._started_lock:
+            if len(self._started) >= MAX_PENDING:
+                # Commands whose completion was never reported
+                self._started.clear()
+            # Keyed per connection: request ids are only unique per client
+            self._started[(event.connection_id, event.request_id)] = event.command
+
+    def succeeded(self, event):
+        self._finished(event, False)
+
+    def failed(self, event):
+        self._finished(event, True)
+
+    def _finished(self, event, failed):
+        if not self.enabled:
+            return
+        with self._started_lock:
+            command = self._started.pop((event.connection_id, event.request_id), None)
+        seconds = event.duration_micros / 1e6
+        if seconds < self.threshold or event.command_name == 'explain':
+            return
+        entry = SlowCommand(next(self._ids), event, command, seconds, failed, current_labels())
+        self.entries.append(entry)
+        if (not failed and command is not None and event.command_name in EXPLAINABLE
+                and random.random() < self.sample_rate):
+            self._explain_later(entry, event.database_name, without(command, NOT_EXPLAINED))
+
+    def _explain_later(self, entry, database, command):
+        with self._lock:
+            if self._queue is None:
+                self._queue = queue.Queue(EXPLAIN_QUEUE_SIZE)
+                threading.Thread(target=self._explain_worker, args=(self._queue,),
+                                 name='slow-command-explain', daemon=True).start()
+        try:
+            self._queue.put_nowait((entry, database, command))
+            entry.explain_status = 'pending'
+        except queue.Full:
+            entry.explain_status = 'skipped: queue full'
+
+    def _explain_worker(self, jobs):
+        while True:
+            entry, database, command = jobs.get()
+            try:
+                explain = get_client()[database].command(
+                    {'explain': command, 'verbosity': 'queryPlanner'}
+                )
+            except Exception as exc:  # Reported on the entry instead of killing the thread
+                entry.explain_status = f'failed: {exc}'
+                continue
+            for plan in winning_plans(explain):
+                stages, indexes = plan_summary(plan)
+                entry.plan_stages.extend(stages)
+                entry.plan_indexes.extend(indexes)
+            entry.collscan = 'COLLSCAN' in entry.plan_stages
+            entry.explain_status = 'done'
+
+    def records(self):
+        """Logged commands, newest first"""
+        return list(self.entries)[::-1]
+
+    def clear(self):
+        self.entries.clear()
+
+    def reset_after_fork(self):
+        self._started = {}
+        self._started_lock = threading.Lock()
+        self._lock = threading.Lock()
+        # The parent's explain thread did not survive the fork
+        self._queue = None
+
+
+def _build_log():
+    return SlowCommandLog(dict(DEFAULTS, **getattr(settings, 'SLOW_COMMAND_LOG', {})))
+
+
+slow_log = _build_log()
+
+
+def _reset_after_fork():
+    slow_log.reset_after_fork()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
@@ -0,0 +1,125 @@
+"""
+Synthetic data generation for `populate_db --users ...`.
+
+Users are split into chunks that worker processes generate independently.
+Each chunk draws from its own seeded RNG, so a given --seed always yields
+the same data whatever the worker count. Documents are produced lazily and
+flushed with unordered insert_many calls of at most `batch_size`, which
+keeps memory bounded by the batch size rather than the dataset size.
+"""
+import random
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from bson import ObjectId
+from .mongo import get_db
+
+ACTIVITY_TYPES = ['Running', 'Cycling', 'Swimming', 'Weightlifting', 'Yoga', 'Boxing', 'CrossFit']
+DISTANCE_TYPES = {'Running', 'Cycling', 'Swimming'}
+FIRST_NAMES = ['Tony', 'Steve', 'Natasha', 'Bruce', 'Thor', 'Clark', 'Diana', 'Barry',
+               'Arthur', 'Wanda', 'Peter', 'Carol', 'Hal', 'Kara', 'Victor', 'Shuri']
+LAST_NAMES = ['Stark', 'Rogers', 'Romanoff', 'Banner', 'Odinson', 'Kent', 'Prince', 'Allen',
+              'Curry', 'Maximoff', 'Parker', 'Danvers', 'Jordan', 'Zor-El', 'Stone', 'Udaku']
+
+
+def team_id(number):
+    return f'team_{number:04d}'
+
+
+def user_chunks(users, chunk_size):
+    """Split the user range into (start, end) chunks"""
+    return [(start, min(start + chunk_size, users)) for start in range(0, users, chunk_size)]
+
+
+class BatchWriter:
+    """Buffer documents per collection and flush them with insert_many"""
+
+    def __init__(self, db, batch_size):
+        self.db = db
+        self.batch_size = batch_size
+        self.buffers = {}
+
+    def add(self, collection, document):
+        buffer = self.buffers.setdefault(collection, [])
+        buffer.append(document)
+        if len(buffer) >= self.batch_size:
+            self.flush(collection)
+
+    def flush(self, collection=None):
+        for name in [collection] if collection else list(self.buffers):
+            if self.buffers.get(name):
+                self.db[name].insert_many(self.buffers[name], ordered=False)
+                self.buffers[name] = []
+
+
+def points_for(activity_type, duration, distance):
+    """Score a generated activity with the configured points rules"""
+    # Imported here: the rules read settings, which may not be configured yet
+    from .points import rules
+    return rules.points(
+        {'activity_type': activity_type, 'duration': duration, 'distance': distance}
+    )
+
+
+def generate_chunk(task):
+    """
+    Generate and insert one chunk of users with their activities and
+    leaderboard entries. Runs in a worker process.
+    Returns (users, activities, team member counts).
+    """
+    start, end, teams, activities_per_user, seed, batch_size = task
+    rng = random.Random(f'{seed}:{start}')
+    writer = BatchWriter(get_db(), batch_size)
+    now = datetime.now(timezone.utc)
+    team_counts = Counter()
+    activity_total = 0
+    low = max(1, activities_per_user // 2)
+    high = max(low, activities_per_user + activities_per_user // 2)
+
+    for number in range(start, end):
+        user_id = ObjectId(rng.getrandbits(96).to_bytes(12, 'big'))
+        name = f'{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}'
+        team = team_id(rng.randrange(teams) + 1)
+        total_points = 0
+        count = rng.randint(low, high) if activities_per_user else 0
+
+        for _ in range(count):
+            activity_type = rng.choice(ACTIVITY_TYPES)
+            duration = rng.randint(15, 180)
+            distance = round(rng.uniform(1, 25), 2) if activity_type in DISTANCE_TYPES else 0
+            points = points_for(activity_type, duration, distance)
+            total_points += points
+            writer.add('activities', {
+                'user_id': user_id,
+                'activity_type': activity_type,
+                'duration': duration,
+                'distance': distance,
+                'calories_burned': duration * rng.randint(5, 15),
+                'points_earned': points,
+                'date': now - timedelta(days=rng.randint(0, 365), seconds=rng.randint(0, 86399)),
+                'notes': f'{activity_type} session with {name}',
+            })
+
+        writer.add('users', {
+            '_id': user_id,
+            'name': name,
+            'email': f'user{number}@octofit.example',
+            'password': f'hashed_password_{number}',
+            'team_id': team,
+            'role': 'member',
+            'total_points': total_points,
+            'created_at': now,
+        })
+        writer.add('leaderboard', {
+            'user_id': user_id,
+            'user_name': name,
+            'team_id': team,
+            'total_points': total_points,
+            'activities_count': count,
+            'rank': 0,
+            'last_updated': now,
+        })
+        team_counts[team] += 1
+        activity_total += count
+
+    writer.flush()
+    return end - start, activity_total, team_counts
@@ -1,9 +1,29 @@
-from django.test import TestCase
+import os
+import tempfile
+import time
+from unittest import mock
+from bson import ObjectId, json_util
+from pymongo.collection import Collection
+from django.conf import settings
+from django.contrib.admin import site as admin_site
+from django.test import AsyncClient, RequestFactory, TestCase, override_settings
+from rest_framework.renderers import JSONRenderer
 from rest_framework.test import APITestCase, APIClient
 from rest_framework import status
 from django.urls import reverse
 from datetime import datetime
+from io import StringIO
+from django.core.management import call_command
 from .models import Team, User, Activity, Leaderboard, Workout
+from .documents import get_collection
+from . import catalog, fast, leaderboard, metrics, mongo, points, recommendations, rollups, search
+from .fast import FastJSONRenderer
+from .serializers import ActivitySerializer
+from .indexes import INDEXES, ensure_indexes
+from .cache import response_cache
+from .admin import slow_commands
+from .slowlog import plan_summary, slow_log, winning_plans
+from .writebehind import DEFAULTS as WRITE_BEHIND_DEFAULTS, WriteBehindQueue
 
 
 class TeamModelTest(TestCase):
@@ -188,6 +208,1394 @@ class WorkoutAPITest(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
 
 
+class ObjectLookupTest(APITestCase):
+    """Test cases for single-query detail lookups"""
+    
+    def setUp(self):
+        self.client = APIClient()
+        self.team = Team.objects.create(
+            _id='lookup_team',
+            name='Lookup Team',
+            description='Test Description',
+            created_at=datetime.now(),
+            member_count=0
+        )
+        self.workout_id = ObjectId()
+        get_collection(Workout).insert_one({
+            '_id': self.workout_id,
+            'name': 'ObjectId Workout',
+            'description': 'Inserted with PyMongo',
+            'duration': 30,
+            'difficulty': 'beginner',
+            'category': 'core',
+            'created_at': datetime.now()
+        })
+        catalog.invalidate()
+    
+    def count_finds(self):
+        """Patch Collection.find, which find_one also goes through"""
+        return mock.patch.object(
+            Collection, 'find', autospec=True, side_effect=Collection.find
+        )
+    
+    def test_string_id_detail_issues_one_query(self):
+        """Test that a string _id is resolved with a single find"""
+        url = reverse('team-detail', args=[self.team._id])
+        with self.count_finds() as find, self.assertNumQueries(0):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['name'], 'Lookup Team')
+        self.assertEqual(find.call_count, 1)
+    
+    def test_object_id_detail_issues_one_query(self):
+        """Test that an ObjectId _id is resolved with a single find"""
+        url = reverse('workout-detail', args=[str(self.workout_id)])
+        with self.count_finds() as find, self.assertNumQueries(0):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['name'], 'ObjectId Workout')
+        self.assertEqual(find.call_count, 1)
+    
+    def test_missing_id_returns_404_without_scan(self):
+        """Test that an unknown _id is a 404 after a single find"""
+        url = reverse('activity-detail', args=[str(ObjectId())])
+        with self.count_finds() as find, self.assertNumQueries(0):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(find.call_count, 1)
+
+
+class ActivityUserNameTest(APITestCase):
+    """Test cases for batched user_name resolution"""
+    
+    def setUp(self):
+        self.client = APIClient()
+        for index in range(3):
+            User.objects.create(
+                _id=f'name_user_{index}',
+                name=f'Name User {index}',
+                email=f'name{index}@example.com',
+                password='hashed_password',
+                team_id='test_team',
+                role='member',
+                total_points=0,
+                created_at=datetime.now()
+            )
+        user_ids = ['name_user_0', 'name_user_1', 'name_user_2', 'name_user_2', 'missing']
+        for index, user_id in enumerate(user_ids):
+            Activity.objects.create(
+                _id=f'name_activity_{index}',
+                user_id=user_id,
+                activity_type='Running',
+                duration=30,
+                distance=5.0,
+                calories_burned=300,
+                points_earned=50,
+                date=datetime.now(),
+                notes='Batched run'
+            )
+    
+    def test_list_resolves_user_names_in_one_query(self):
+        """Test that a page of activities issues a single users query"""
+        with mock.patch.object(
+            Collection, 'find', autospec=True, side_effect=Collection.find
+        ) as find:
+            response = self.client.get(reverse('activity-list'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        user_queries = [call for call in find.call_args_list if call.args[0].name == 'users']
+        self.assertEqual(len(user_queries), 1)
+        names = {(item['user_id'], item['user_name']) for item in response.data['results']}
+        self.assertIn(('name_user_2', 'Name User 2'), names)
+        self.assertIn(('missing', 'Unknown User'), names)
+
+
+class MongoClientTest(APITestCase):
+    """Test cases for the pooled MongoDB client"""
+    
+    def test_client_is_shared_within_a_process(self):
+        """Test that repeated calls reuse one client"""
+        self.assertIs(mongo.get_client(), mongo.get_client())
+    
+    def test_client_is_recreated_after_fork(self):
+        """Test that a different pid gets its own client"""
+        client = mongo.get_client()
+        with mock.patch('octofit_tracker.mongo.os.getpid', return_value=-1):
+            self.assertIsNot(mongo.get_client(), client)
+        mongo.close_client()
+    
+    def test_pool_stats_endpoint(self):
+        """Test that pool statistics are exposed"""
+        get_collection(Team).count_documents({})
+        response = self.client.get(reverse('mongo-pool-stats'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn('checked_out', response.data)
+        self.assertIn('wait_time_avg_ms', response.data)
+        self.assertGreaterEqual(response.data['checkouts'], 1)
+
+
+class KeysetPaginationTest(APITestCase):
+    """Test cases for cursor pagination"""
+    
+    def setUp(self):
+        self.client = APIClient()
+        response_cache.clear()
+        get_collection(Workout).insert_many([
+            {
+                '_id': workout_id,
+                'name': f'Paged Workout {index}',
+                'description': 'Paged',
+                'duration': 30,
+                'difficulty': 'beginner',
+                'category': 'paged',
+                'created_at': datetime.now()
+            }
+            for index, workout_id in enumerate(['paged_a', 'paged_b', ObjectId(), ObjectId(), ObjectId()])
+        ])
+        catalog.invalidate()
+    
+    def test_cursor_walks_every_document_once(self):
+        """Test that following next links returns each workout exactly once"""
+        url = reverse('workout-by-category') + '?category=paged&page_size=2'
+        names = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertLessEqual(len(response.data['results']), 2)
+            names.extend(item['name'] for item in response.data['results'])
+            url = response.data['next']
+        self.assertEqual(sorted(names), [f'Paged Workout {index}' for index in range(5)])
+    
+    def test_page_size_is_capped(self):
+        """Test that page_size cannot exceed the maximum"""
+        with mock.patch('octofit_tracker.pagination.KeysetPagination.max_page_size', 3):
+            response = self.client.get(reverse('workout-list') + '?page_size=1000')
+        self.assertEqual(len(response.data['results']), 3)
+    
+    def test_invalid_cursor_returns_404(self):
+        """Test that a tampered cursor is rejected"""
+        response = self.client.get(reverse('workout-list') + '?cursor=not-a-cursor')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class LeaderboardMaintenanceTest(APITestCase):
+    """Test cases for incremental leaderboard updates on activity writes"""
+    
+    def setUp(self):
+        self.client = APIClient()
+        get_collection(User).insert_many([
+            {'_id': 'lb_first', 'name': 'First', 'email': 'lb_first@example.com',
+             'team_id': 'lb_team', 'total_points': 300},
+            {'_id': 'lb_second', 'name': 'Second', 'email': 'lb_second@example.com',
+             'team_id': 'lb_team', 'total_points': 200},
+            {'_id': 'lb_third', 'name': 'Third', 'email': 'lb_third@example.com',
+             'team_id': 'lb_team', 'total_points': 100},
+        ])
+        get_collection(Leaderboard).insert_many([
+            {'_id': f'lb_entry_{rank}', 'user_id': user_id, 'user_name': user_id,
+             'team_id': 'lb_team', 'total_points': points, 'activities_count': 1,
+             'rank': rank, 'last_updated': datetime.now()}
+            for rank, (user_id, points) in enumerate(
+                [('lb_first', 300), ('lb_second', 200), ('lb_third', 100)], start=1
+            )
+        ])
+    
+    def ranks(self):
+        return {
+            entry['user_id']: (entry['rank'], entry['total_points'])
+            for entry in get_collection(Leaderboard).find({'team_id': 'lb_team'})
+        }
+    
+    def test_activity_create_and_delete_update_ranks(self):
+        """Test that posting and deleting an activity keeps ranks correct"""
+        response = self.client.post(reverse('activity-list'), {
+            '_id': 'lb_activity',
+            'user_id': 'lb_third',
+            'activity_type': 'Running',
+            'duration': 25,
+            'distance': 10.0,
+            'calories_burned': 600,
+            'date': datetime.now().isoformat(),
+            'notes': ''
+        }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(self.ranks(), {
+            'lb_first': (1, 300), 'lb_third': (2, 250), 'lb_second': (3, 200)
+        })
+        user = get_collection(User).find_one({'_id': 'lb_third'})
+        self.assertEqual(user['total_points'], 250)
+        
+        response = self.client.delete(reverse('activity-detail', args=['lb_activity']))
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertEqual(self.ranks(), {
+            'lb_first': (1, 300), 'lb_second': (2, 200), 'lb_third': (3, 100)
+        })
+    
+    def test_racing_first_activities_share_one_entry(self):
+        """Test that the losing create_entry of a race updates the winner's entry"""
+        ensure_indexes(mongo.get_db())
+        users = get_collection(User)
+        users.insert_one({'_id': 'lb_new', 'name': 'New', 'email': 'lb_new@example.com',
+                          'team_id': 'lb_team', 'total_points': 150})
+        snapshot = users.find_one({'_id': 'lb_new'})
+        leaderboard.create_entry(get_collection(Leaderboard), snapshot, datetime.now())
+        # The second activity's total landed after the winner read the user
+        users.update_one({'_id': 'lb_new'}, {'$inc': {'total_points': 250}})
+        leaderboard.create_entry(get_collection(Leaderboard), snapshot, datetime.now())
+        self.assertEqual(get_collection(Leaderboard).count_documents({'user_id': 'lb_new'}), 1)
+        self.assertEqual(self.ranks(), {
+            'lb_new': (1, 400), 'lb_first': (2, 300), 'lb_second': (3, 200), 'lb_third': (4, 100)
+        })
+
+
+class LeaderboardRankTest(APITestCase):
+    """Test cases for rank lookup and the bounded top endpoint"""
+    
+    def setUp(self):
+        self.client = APIClient()
+        response_cache.clear()
+        leaderboard.invalidate_head()
+        get_collection(Leaderboard).insert_many([
+            {'_id': f'rank_entry_{rank}', 'user_id': f'rank_user_{rank}',
+             'user_name': f'Rank User {rank}', 'team_id': 'rank_team',
+             'total_points': 1000 - rank, 'activities_count': 1,
+             'rank': rank, 'last_updated': datetime.now()}
+            for rank in range(1, 11)
+        ])
+    
+    def test_rank_returns_neighbourhood(self):
+        """Test that a user's rank comes with k entries on each side"""
+        response = self.client.get(
+            reverse('leaderboard-rank') + '?user_id=rank_user_5&k=2'
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['rank'], 5)
+        self.assertEqual([entry['rank'] for entry in response.data['above']], [3, 4])
+        self.assertEqual([entry['rank'] for entry in response.data['below']], [6, 7])
+    
+    def test_rank_for_unknown_user_returns_404(self):
+        """Test that an unknown user is a 404"""
+        response = self.client.get(reverse('leaderboard-rank') + '?user_id=nobody')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+    
+    def test_top_limit_is_bounded(self):
+        """Test that top never returns more than the precomputed head"""
+        with mock.patch.object(leaderboard, 'HEAD_SIZE', 3):
+            leaderboard.invalidate_head()
+            response = self.client.get(reverse('leaderboard-top') + '?limit=1000')
+        self.assertEqual([entry['rank'] for entry in response.data], [1, 2, 3])
+    
+    def test_top_shows_leaderboard_writes(self):
+        """Test that a leaderboard PATCH is visible in top straight away"""
+        self.client.get(reverse('leaderboard-top') + '?limit=1')
+        response = self.client.patch(
+            reverse('leaderboard-detail', args=['rank_entry_1']), {'user_name': 'Renamed'},
+            format='json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        response = self.client.get(reverse('leaderboard-top') + '?limit=1')
+        self.assertEqual(response.data[0]['user_name'], 'Renamed')
+
+
+class ResponseCacheTest(APITestCase):
+    """Test cases for the read-through response cache"""
+    
+    def setUp(self):
+        self.client = APIClient()
+        response_cache.clear()
+        self.team = Team.objects.create(
+            _id='cached_team',
+            name='Cached Team',
+            description='Test Description',
+            created_at=datetime.now(),
+            member_count=0
+        )
+    
+    def test_repeated_read_is_served_from_cache(self):
+        """Test that a second identical request does not touch MongoDB"""
+        url = reverse('team-detail', args=[self.team._id])
+        self.assertEqual(self.client.get(url)['X-Cache'], 'MISS')
+        with mock.patch.object(
+            Collection, 'find', autospec=True, side_effect=Collection.find
+        ) as find:
+            response = self.client.get(url)
+        self.assertEqual(response['X-Cache'], 'HIT')
+        self.assertEqual(response.data['name'], 'Cached Team')
+        self.assertEqual(find.call_count, 0)
+        self.assertEqual(response_cache.stats()['hits'], 1)
+    
+    def test_write_invalidates_cached_reads(self):
+        """Test that a successful write evicts responses for its collection"""
+        url = reverse('team-detail', args=[self.team._id])
+        self.client.get(url)
+        get_collection(Team).update_one({'_id': 'cached_team'}, {'$set': {'name': 'Renamed'}})
+        self.client.post(reverse('team-list'), {
+            '_id': 'other_cached_team',
+            'name': 'Other Team',
+            'description': 'Test Description',
+            'created_at': datetime.now().isoformat(),
+            'member_count': 0
+        }, format='json')
+        response = self.client.get(url)
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(response.data['name'], 'Renamed')
+
+
+class BulkActivityTest(APITestCase):
+    """Test cases for bulk activity ingestion"""
+    
+    def setUp(self):
+        self.client = APIClient()
+        get_collection(User).insert_one(
+            {'_id': 'bulk_user', 'name': 'Bulk User', 'team_id': 'bulk_team', 'total_points': 0}
+        )
+    
+    def record(self, duration):
+        return {
+            'user_id': 'bulk_user',
+            'activity_type': 'Cycling',
+            'duration': duration,
+            'distance': 0.0,
+            'calories_burned': 300,
+            'date': datetime.now().isoformat(),
+        }
+    
+    def test_bulk_reports_each_item_and_aggregates_points(self):
+        """Test that valid records are inserted, scored and invalid ones reported"""
+        records = [self.record(5), self.record(10), {'user_id': 'bulk_user'}]
+        with mock.patch.object(
+            Collection, 'insert_many', autospec=True, side_effect=Collection.insert_many
+        ) as insert_many:
+            response = self.client.post(reverse('activity-bulk'), records, format='json')
+        self.assertEqual(response.status_code, status.HTTP_207_MULTI_STATUS)
+        self.assertEqual(insert_many.call_count, 1)
+        self.assertEqual(response.data['created'], 2)
+        self.assertEqual(
+            [result['status'] for result in response.data['results']],
+            ['created', 'created', 'error']
+        )
+        user = get_collection(User).find_one({'_id': 'bulk_user'})
+        self.assertEqual(user['total_points'], 30)
+        entry = get_collection(Leaderboard).find_one({'user_id': 'bulk_user'})
+        self.assertEqual(entry['activities_count'], 2)
+    
+    def test_bulk_rejects_non_list_body(self):
+        """Test that the body must be a list"""
+        response = self.client.post(reverse('activity-bulk'), self.record(10), format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class ActivityExportTest(APITestCase):
+    """Test cases for streaming activity exports"""
+    
+    def setUp(self):
+        self.client = APIClient()
+        get_collection(Activity).insert_many([
+            {'_id': f'export_{index}', 'user_id': 'export_user', 'activity_type': 'Swimming',
+             'duration': 20 + index, 'distance': 1.0, 'calories_burned': 200,
+             'points_earned': 40, 'date': datetime(2026, 1, index + 1), 'notes': 'Laps'}
+            for index in range(5)
+        ])
+    
+    def test_ndjson_export_streams_filtered_rows(self):
+        """Test that NDJSON export honours user and date filters"""
+        url = reverse('activity-export') + (
+            '?user_id=export_user&date_from=2026-01-02&date_to=2026-01-04'
+        )
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.streaming)
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(len(lines), 3)
+    
+    def test_csv_export_has_header(self):
+        """Test that CSV export starts with the serializer fields"""
+        response = self.client.get(reverse('activity-export') + '?output=csv&user_id=export_user')
+        rows = b''.join(response.streaming_content).decode().splitlines()
+        self.assertTrue(rows[0].startswith('_id,user_id,user_name'))
+        self.assertEqual(len(rows), 6)
+    
+    def test_unknown_output_format_is_rejected(self):
+        """Test that an unsupported format is a 400"""
+        response = self.client.get(reverse('activity-export') + '?output=xml')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class EnsureIndexesTest(TestCase):
+    """Test cases for the ensure_indexes management command"""
+    
+    def test_declared_indexes_are_built_idempotently(self):
+        """Test that every declared index exists and a rerun builds nothing"""
+        call_command('ensure_indexes', stdout=StringIO())
+        for collection, indexes in INDEXES.items():
+            existing = mongo.get_db()[collection].index_information()
+            for index in indexes:
+                self.assertTrue(
+                    any(index.matches(info) for info in existing.values()),
+                    f'{collection}.{index.name} was not built'
+                )
+        output = StringIO()
+        call_command('ensure_indexes', stdout=output)
+        self.assertIn('All declared indexes exist.', output.getvalue())
+
+
+class ActivityRollupTest(APITestCase):
+    """Test cases for daily and weekly activity rollups"""
+
+    def setUp(self):
+        self.client = APIClient()
+        response_cache.clear()
+        # Not model tables, so the test database flush leaves them behind
+        for collection in (rollups.USER_DAILY, rollups.TEAM_WEEKLY):
+            mongo.get_db()[collection].delete_many({})
+        get_collection(User).insert_one(
+            {'_id': 'rollup_user', 'name': 'Rollup User', 'team_id': 'rollup_team', 'total_points': 0}
+        )
+
+    def post_activity(self, activity_id, date, duration):
+        return self.client.post(reverse('activity-list'), {
+            '_id': activity_id,
+            'user_id': 'rollup_user',
+            'activity_type': 'Running',
+            'duration': duration,
+            'distance': 0.0,
+            'calories_burned': 300,
+            'date': date,
+            'notes': ''
+        }, format='json')
+
+    def test_stats_follow_activity_writes(self):
+        """Test that creates, updates and deletes keep the rollups current"""
+        self.post_activity('rollup_1', '2025-03-03T08:00:00Z', 5)
+        self.post_activity('rollup_2', '2025-03-03T18:00:00Z', 10)
+        self.post_activity('rollup_3', '2025-03-05T08:00:00Z', 20)
+        self.client.patch(
+            reverse('activity-detail', args=['rollup_2']), {'duration': 55}, format='json'
+        )
+        self.client.delete(reverse('activity-detail', args=['rollup_3']))
+
+        response = self.client.get(reverse('activity-stats') + '?user_id=rollup_user')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['totals']['activities'], 2)
+        self.assertEqual(response.data['totals']['points_earned'], 120)
+        self.assertEqual(
+            [(day['start'], day['activities']) for day in response.data['results']],
+            [('2025-03-03', 2)]
+        )
+
+        response = self.client.get(reverse('activity-team-stats') + '?team_id=rollup_team')
+        self.assertEqual(response.data['results'][0]['start'], '2025-03-03')
+        self.assertEqual(response.data['totals']['duration'], 60)
+
+    def test_writes_stay_with_the_team_credited_at_creation(self):
+        """Test that deleting an activity after a team change debits the original team"""
+        self.post_activity('rollup_6', '2025-03-03T08:00:00Z', 30)
+        get_collection(User).update_one({'_id': 'rollup_user'}, {'$set': {'team_id': 'other_team'}})
+        self.client.patch(
+            reverse('activity-detail', args=['rollup_6']), {'notes': 'edited'}, format='json'
+        )
+        self.client.delete(reverse('activity-detail', args=['rollup_6']))
+
+        for team_id in ('rollup_team', 'other_team'):
+            response = self.client.get(reverse('activity-team-stats') + f'?team_id={team_id}')
+            self.assertEqual(response.data['totals']['activities'], 0)
+            self.assertEqual(response.data['totals']['duration'], 0)
+
+    def test_backfill_matches_incremental_rollups(self):
+        """Test that the backfill command rebuilds the same rollups"""
+        self.post_activity('rollup_4', '2025-03-10T08:00:00Z', 10)
+        self.post_activity('rollup_5', '2025-03-18T08:00:00Z', 20)
+        before = self.client.get(
+            reverse('activity-stats') + '?user_id=rollup_user&period=week'
+        ).data
+        call_command('backfill_rollups', stdout=StringIO())
+        response_cache.clear()
+        after = self.client.get(
+            reverse('activity-stats') + '?user_id=rollup_user&period=week'
+        ).data
+        self.assertEqual(before, after)
+        self.assertEqual(len(after['results']), 2)
+
+    def test_stats_requires_user_id(self):
+        """Test that stats without user_id is a 400"""
+        response = self.client.get(reverse('activity-stats'))
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class SparseFieldsTest(APITestCase):
+    """Test cases for ?fields= and ?exclude= sparse fieldsets"""
+
+    def setUp(self):
+        self.client = APIClient()
+        response_cache.clear()
+        get_collection(User).insert_one({'_id': 'sparse_user', 'name': 'Sparse User'})
+        get_collection(Activity).insert_many([
+            {'_id': f'sparse_{n}', 'user_id': 'sparse_user', 'activity_type': 'Running',
+             'duration': 30, 'distance': 5.0, 'calories_burned': 300, 'points_earned': 50,
+             'date': datetime(2025, 3, n + 1), 'notes': 'long notes ' * 50}
+            for n in range(3)
+        ])
+
+    def test_fields_trims_output_and_projection(self):
+        """Test that only the selected fields are serialized and fetched"""
+        url = reverse('activity-by-user') + '?user_id=sparse_user&fields=_id,user_name&page_size=2'
+        with mock.patch.object(Collection, 'find', autospec=True, side_effect=Collection.find) as find:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['results'][0], {'_id': 'sparse_2', 'user_name': 'Sparse User'})
+        projection = find.call_args_list[0].args[2]
+        self.assertNotIn('notes', projection)
+        self.assertIn('user_id', projection)
+
+        response = self.client.get(response.data['next'])
+        self.assertEqual([activity['_id'] for activity in response.data['results']], ['sparse_0'])
+
+    def test_exclude_on_detail(self):
+        """Test that ?exclude= drops fields from a retrieve"""
+        url = reverse('activity-detail', args=['sparse_0']) + '?exclude=notes,user_name'
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotIn('notes', response.data)
+        self.assertEqual(response.data['duration'], 30)
+
+    def test_unknown_field(self):
+        """Test that unknown field names are rejected"""
+        response = self.client.get(reverse('activity-list') + '?fields=_id,bogus')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('fields', response.data)
+
+
+class FastSerializationTest(APITestCase):
+    """Test cases for the FAST_SERIALIZATION list path and FastJSONRenderer"""
+
+    def setUp(self):
+        self.client = APIClient()
+        get_collection(User).insert_one({'_id': 'fast_user', 'name': 'Fast User'})
+        get_collection(Activity).insert_many([
+            {'_id': f'fast_{n}', 'user_id': 'fast_user', 'activity_type': 'Running',
+             'duration': 30, 'distance': distance, 'calories_burned': 300, 'points_earned': 50,
+             'date': datetime(2025, 3, n + 1, 7, 30), 'notes': 'line\u2028break'}
+            for n, distance in enumerate([5.0, 0.00001, 2e16])
+        ])
+        get_collection(Activity).insert_one({'_id': 'fast_sparse', 'user_id': 'nobody'})
+
+    def get_bytes(self, url, fast):
+        response_cache.clear()
+        renderer = 'octofit_tracker.fast.FastJSONRenderer' if fast else 'rest_framework.renderers.JSONRenderer'
+        rest_framework = dict(settings.REST_FRAMEWORK, DEFAULT_RENDERER_CLASSES=[renderer])
+        with override_settings(FAST_SERIALIZATION=fast, REST_FRAMEWORK=rest_framework):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.content
+
+    def test_responses_are_byte_identical(self):
+        """Test that fast list responses match the regular path byte for byte"""
+        for url in [
+            reverse('activity-list'),
+            reverse('activity-by-user') + '?user_id=fast_user&page_size=2',
+            reverse('activity-list') + '?fields=_id,user_name,distance',
+        ]:
+            self.assertEqual(self.get_bytes(url, fast=True), self.get_bytes(url, fast=False))
+
+    def test_renderer_matches_json_renderer(self):
+        """Test that FastJSONRenderer output equals JSONRenderer output"""
+        documents = list(get_collection(Activity).find())
+        data = ActivitySerializer(context={'request': None}).to_documents_representation(documents)
+        self.assertFalse(data.exact)
+        exact = fast.Documents(row for row in data if row['distance'] in (5.0, 0.0))
+        for payload in (data, exact, {'next': None, 'results': exact}):
+            self.assertEqual(FastJSONRenderer().render(payload), JSONRenderer().render(payload))
+
+
+class WorkoutCatalogTest(APITestCase):
+    """Test cases for the in-memory workout catalog"""
+
+    def setUp(self):
+        self.client = APIClient()
+        response_cache.clear()
+        get_collection(Workout).insert_many([
+            {'_id': 'catalog_legacy', 'name': 'Legacy Workout', 'description': 'JSON text',
+             'duration': 30, 'difficulty': 'beginner', 'category': 'catalog',
+             'exercises': '[{"name": "Squats", "reps": 10}]', 'created_at': datetime.now()},
+            {'_id': 'catalog_broken', 'name': 'Broken Workout', 'description': 'Bad JSON',
+             'duration': 30, 'difficulty': 'advanced', 'category': 'catalog',
+             'exercises': 'not json', 'created_at': datetime.now()},
+        ])
+        catalog.invalidate()
+
+    def count_finds(self):
+        return mock.patch.object(Collection, 'find', autospec=True, side_effect=Collection.find)
+
+    def test_reads_do_not_query_mongodb(self):
+        """Test that workout reads are served from the loaded catalog"""
+        self.client.get(reverse('workout-list'))
+        with self.count_finds() as find:
+            for url in [
+                reverse('workout-by-category') + '?category=catalog',
+                reverse('workout-by-difficulty') + '?difficulty=beginner',
+                reverse('workout-by-exercise') + '?name=squats',
+            ]:
+                self.assertEqual(self.client.get(url).status_code, status.HTTP_200_OK)
+        self.assertEqual(find.call_count, 0)
+
+    def test_retrieve_reads_the_stored_version(self):
+        """Test that a retrieve sees a write the loaded catalog has not"""
+        self.client.get(reverse('workout-list'))
+        get_collection(Workout).update_one(
+            {'_id': 'catalog_broken'}, {'$set': {'name': 'Renamed'}, '$inc': {'version': 1}}
+        )
+        response = self.client.get(reverse('workout-detail', args=['catalog_broken']))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['name'], 'Renamed')
+        self.assertEqual(response['ETag'], '"1"')
+
+    def test_legacy_json_exercises_are_served_parsed(self):
+        """Test that JSON text exercises are served as embedded documents without a write"""
+        with mock.patch.object(Collection, 'bulk_write', autospec=True) as bulk_write:
+            response = self.client.get(reverse('workout-by-category') + '?category=catalog')
+            detail = self.client.get(reverse('workout-detail', args=['catalog_legacy']))
+        bulk_write.assert_not_called()
+        exercises = {item['_id']: item['exercises'] for item in response.data['results']}
+        self.assertEqual(exercises, {
+            'catalog_legacy': [{'name': 'Squats', 'reps': 10}],
+            'catalog_broken': [],
+        })
+        self.assertEqual(detail.data['exercises'], [{'name': 'Squats', 'reps': 10}])
+
+    def test_convert_command_stores_embedded_documents(self):
+        """Test that convert_workout_exercises rewrites JSON text exercises once"""
+        out = StringIO()
+        call_command('convert_workout_exercises', stdout=out)
+        self.assertIn('Converted 2 workouts', out.getvalue())
+        stored = get_collection(Workout).find_one({'_id': 'catalog_legacy'})
+        self.assertEqual(stored['exercises'], [{'name': 'Squats', 'reps': 10}])
+        out = StringIO()
+        call_command('convert_workout_exercises', stdout=out)
+        self.assertIn('Converted 0 workouts', out.getvalue())
+
+    def test_write_refreshes_catalog(self):
+        """Test that a created workout is indexed by its exercises right away"""
+        version = catalog.get_catalog().version
+        response = self.client.post(reverse('workout-list'), {
+            '_id': 'catalog_new', 'name': 'New Workout', 'description': 'Created',
+            'duration': 20, 'difficulty': 'beginner', 'category': 'catalog',
+            'exercises': [{'name': 'Lunges', 'sets': 3}], 'created_at': datetime.now().isoformat(),
+        }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertGreater(catalog.get_catalog().version, version)
+        stored = get_collection(Workout).find_one({'_id': 'catalog_new'})
+        self.assertEqual(stored['exercises'], [{'name': 'Lunges', 'sets': 3}])
+        with self.count_finds() as find:
+            response = self.client.get(reverse('workout-by-exercise') + '?name=LUNGES')
+        self.assertEqual([item['_id'] for item in response.data['results']], ['catalog_new'])
+        self.assertEqual(find.call_count, 0)
+
+    def test_exercises_must_be_objects(self):
+        """Test that exercises other than a list of objects are rejected"""
+        response = self.client.post(reverse('workout-list'), {
+            '_id': 'catalog_bad', 'name': 'Bad Workout', 'description': 'Invalid',
+            'duration': 20, 'difficulty': 'beginner', 'category': 'catalog',
+            'exercises': 'Squats', 'created_at': datetime.now().isoformat(),
+        }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('exercises', response.data)
+
+
+class RecommendationTest(APITestCase):
+    """Test cases for workout recommendations"""
+
+    def setUp(self):
+        self.client = APIClient()
+        response_cache.clear()
+        # Not a model table, so the test database flush leaves it behind
+        mongo.get_db()[recommendations.USER_FEATURES].delete_many({})
+        get_collection(User).insert_one(
+            {'_id': 'recommend_user', 'name': 'Recommend User', 'team_id': 'recommend_team'}
+        )
+        get_collection(Workout).insert_many([
+            {'_id': f'recommend_{category}', 'name': f'{category} workout', 'description': '',
+             'duration': 60, 'difficulty': 'intermediate', 'category': category,
+             'exercises': [], 'created_at': datetime.now()}
+            for category in recommendations.CATEGORIES
+        ])
+        catalog.invalidate()
+
+    def post_activity(self, activity_id, activity_type):
+        return self.client.post(reverse('activity-list'), {
+            '_id': activity_id,
+            'user_id': 'recommend_user',
+            'activity_type': activity_type,
+            'duration': 60,
+            'distance': 0,
+            'calories_burned': 600,
+            'points_earned': 10,
+            'date': '2025-03-03T08:00:00Z',
+            'notes': ''
+        }, format='json')
+
+    def recommended(self, **params):
+        url = reverse('user-recommended-workouts', args=['recommend_user'])
+        return self.client.get(url, params)
+
+    def test_recommendations_follow_activity_writes(self):
+        """Test that activity creates and updates move the user's top workout"""
+        self.post_activity('recommend_1', 'Yoga')
+        self.post_activity('recommend_2', 'Yoga')
+        response = self.recommended(limit=2)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['results'][0]['category'], 'flexibility')
+        self.assertEqual(len(response.data['results']), 2)
+        scores = [item['score'] for item in response.data['results']]
+        self.assertEqual(scores, sorted(scores, reverse=True))
+
+        for activity_id in ('recommend_1', 'recommend_2'):
+            self.client.patch(
+                reverse('activity-detail', args=[activity_id]),
+                {'activity_type': 'Weightlifting'}, format='json'
+            )
+        response = self.recommended(limit=1)
+        self.assertEqual([item['category'] for item in response.data['results']], ['strength'])
+
+    def test_backfill_matches_incremental_features(self):
+        """Test that the backfill command rebuilds the same feature documents"""
+        self.post_activity('recommend_3', 'Running')
+        self.post_activity('recommend_4', 'CrossFit')
+        features = get_collection(User).database[recommendations.USER_FEATURES]
+        before = features.find_one({'_id': 'recommend_user'})
+        call_command('backfill_user_features', stdout=StringIO())
+        after = features.find_one({'_id': 'recommend_user'})
+        for field in ('activities', 'duration', 'calories_burned'):
+            self.assertEqual(before[field], after[field])
+        for category in recommendations.CATEGORIES:
+            self.assertAlmostEqual(before['minutes'][category], after['minutes'][category])
+
+    def test_users_without_history_get_recommendations(self):
+        """Test that a user with no activities still gets every workout ranked"""
+        response = self.recommended(limit=50)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        ranked = {item['_id'] for item in response.data['results']}
+        for category in recommendations.CATEGORIES:
+            self.assertIn(f'recommend_{category}', ranked)
+
+    def test_invalid_requests(self):
+        """Test that a bad limit is a 400 and an unknown user a 404"""
+        self.assertEqual(self.recommended(limit='many').status_code, status.HTTP_400_BAD_REQUEST)
+        url = reverse('user-recommended-workouts', args=['nobody'])
+        self.assertEqual(self.client.get(url).status_code, status.HTTP_404_NOT_FOUND)
+
+
+class SearchTest(APITestCase):
+    """Test cases for the full-text search index"""
+
+    def setUp(self):
+        self.client = APIClient()
+        response_cache.clear()
+        # Not model tables, so the test database flush leaves them behind
+        for collection in (search.POSTINGS, search.TERMS):
+            mongo.get_db()[collection].delete_many({})
+        get_collection(User).insert_one({'_id': 'search_user', 'name': 'Search User'})
+        for workout_id, name, exercises in [
+            ('search_squats', 'Quokka Ladder', [{'name': 'Quokka Squats', 'reps': 10}]),
+            ('search_mixed', 'Mixed Circuit', [{'name': 'Quokka Lunges', 'reps': 5}]),
+        ]:
+            self.client.post(reverse('workout-list'), {
+                '_id': workout_id, 'name': name, 'description': 'Searchable workout',
+                'duration': 30, 'difficulty': 'beginner', 'category': 'search',
+                'exercises': exercises, 'created_at': datetime.now().isoformat(),
+            }, format='json')
+
+    def post_activity(self, activity_id, notes):
+        return self.client.post(reverse('activity-list'), {
+            '_id': activity_id,
+            'user_id': 'search_user',
+            'activity_type': 'Running',
+            'duration': 30,
+            'distance': 5.0,
+            'calories_burned': 300,
+            'points_earned': 10,
+            'date': '2025-03-03T08:00:00Z',
+            'notes': notes
+        }, format='json')
+
+    def search_ids(self, basename, query):
+        response = self.client.get(reverse(f'{basename}-search'), {'q': query})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [item['_id'] for item in response.data['results']]
+
+    def test_workouts_are_ranked(self):
+        """Test that name matches rank above exercise-only matches"""
+        self.assertEqual(self.search_ids('workout', 'quokka'), ['search_squats', 'search_mixed'])
+        self.assertEqual(self.search_ids('workout', 'lunges'), ['search_mixed'])
+        self.assertEqual(self.search_ids('workout', 'the'), [])
+
+    def test_activity_notes_follow_writes(self):
+        """Test that creates, note updates and deletes keep the index current"""
+        self.post_activity('search_1', 'Hill repeats in the fog')
+        self.post_activity('search_2', 'Easy recovery jog')
+        self.assertEqual(self.search_ids('activity', 'fog'), ['search_1'])
+
+        self.client.patch(
+            reverse('activity-detail', args=['search_2']), {'notes': 'Foggy tempo, hill finish'},
+            format='json'
+        )
+        self.assertEqual(self.search_ids('activity', 'recovery'), [])
+        self.assertEqual(set(self.search_ids('activity', 'hill')), {'search_1', 'search_2'})
+
+        self.client.delete(reverse('activity-detail', args=['search_1']))
+        self.assertEqual(self.search_ids('activity', 'hill'), ['search_2'])
+
+    def test_rebuild_matches_incremental_index(self):
+        """Test that the rebuild command produces the same ranking"""
+        self.post_activity('search_3', 'Intervals at the velodrome')
+        before = self.client.get(reverse('workout-search'), {'q': 'quokka'}).data
+        call_command('rebuild_search_index', stdout=StringIO())
+        response_cache.clear()
+        after = self.client.get(reverse('workout-search'), {'q': 'quokka'}).data
+        self.assertEqual(before, after)
+        self.assertEqual(self.search_ids('activity', 'velodrome'), ['search_3'])
+
+    def test_admin_search_uses_index(self):
+        """Test that the activity admin finds notes and exact types through the index"""
+        self.post_activity('search_4', 'Sunrise loop')
+        activity_admin = admin_site._registry[Activity]
+        for term in ('sunrise', 'Running'):
+            queryset, duplicates = activity_admin.get_search_results(
+                RequestFactory().get('/'), Activity.objects.all(), term
+            )
+            self.assertIn('search_4', [activity._id for activity in queryset])
+            self.assertFalse(duplicates)
+
+    def test_admin_search_matches_object_id_user_ids(self):
+        """Test that the activity admin finds activities of ObjectId-stored users by user id"""
+        user_id = ObjectId()
+        get_collection(Activity).insert_one({
+            '_id': 'search_5', 'user_id': user_id, 'activity_type': 'Rowing', 'duration': 20,
+            'distance': 0, 'calories_burned': 100, 'points_earned': 40,
+            'date': datetime(2025, 3, 1), 'notes': '',
+        })
+        activity_admin = admin_site._registry[Activity]
+        queryset, _ = activity_admin.get_search_results(
+            RequestFactory().get('/'), Activity.objects.all(), str(user_id)
+        )
+        self.assertEqual([activity._id for activity in queryset], ['search_5'])
+
+    def test_query_is_required(self):
+        """Test that search without q is a 400"""
+        response = self.client.get(reverse('activity-search'))
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class PointsRulesTest(APITestCase):
+    """Test cases for server-side points rules"""
+
+    def setUp(self):
+        self.client = APIClient()
+        response_cache.clear()
+        get_collection(User).insert_one(
+            {'_id': 'points_user', 'name': 'Points User', 'team_id': 'points_team', 'total_points': 0}
+        )
+
+    def post_activity(self, activity_id, activity_type, duration, distance):
+        return self.client.post(reverse('activity-list'), {
+            '_id': activity_id,
+            'user_id': 'points_user',
+            'activity_type': activity_type,
+            'duration': duration,
+            'distance': distance,
+            'calories_burned': 300,
+            'points_earned': 9999,
+            'date': '2025-03-03T08:00:00Z',
+            'notes': ''
+        }, format='json')
+
+    def stored_points(self, activity_id):
+        return get_collection(Activity).find_one({'_id': activity_id})['points_earned']
+
+    def test_points_are_computed_on_create_and_update(self):
+        """Test that client points are ignored and writes are rescored"""
+        response = self.post_activity('points_1', 'Running', 30, 5.5)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['points_earned'], 115)
+        self.assertEqual(self.stored_points('points_1'), 115)
+
+        response = self.client.patch(
+            reverse('activity-detail', args=['points_1']), {'duration': 40}, format='json'
+        )
+        self.assertEqual(response.data['points_earned'], 135)
+        user = get_collection(User).find_one({'_id': 'points_user'})
+        self.assertEqual(user['total_points'], 135)
+
+    def test_put_resets_scored_fields_left_out(self):
+        """Test that a PUT without distance scores the activity with no distance"""
+        self.post_activity('points_4', 'Running', 30, 5.5)
+        response = self.client.put(reverse('activity-detail', args=['points_4']), {
+            'user_id': 'points_user',
+            'activity_type': 'Running',
+            'duration': 30,
+            'calories_burned': 300,
+            'date': '2025-03-03T08:00:00Z',
+        }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual((response.data['distance'], response.data['points_earned']), (0, 60))
+        self.assertEqual(self.stored_points('points_4'), 60)
+
+    def test_type_rules_apply_multipliers_and_caps(self):
+        """Test per-type multipliers and caps, matched ignoring case"""
+        rules = points.PointsRules({'TYPES': {
+            'yoga': {'MULTIPLIER': 1.5}, 'Cycling': {'PER_KM': 4, 'CAP': 100},
+        }})
+        activities = [
+            {'activity_type': 'Yoga', 'duration': 45, 'distance': 0},
+            {'activity_type': 'Cycling', 'duration': 30, 'distance': 20.0},
+            {'activity_type': 'Running', 'duration': 30, 'distance': 2.25},
+            {'activity_type': None, 'duration': None, 'distance': None},
+        ]
+        self.assertEqual([rules.points(activity) for activity in activities], [135, 100, 82, 0])
+        self.assertEqual(rules.points_array(activities).tolist(), [135, 100, 82, 0])
+        collection = get_collection(Activity)
+        collection.insert_many([
+            dict(activity, _id=f'expression_{index}') for index, activity in enumerate(activities)
+        ])
+        scored = collection.aggregate([
+            {'$match': {'_id': {'$regex': '^expression_'}}},
+            {'$sort': {'_id': 1}},
+            {'$project': {'points': rules.expression()}},
+        ])
+        self.assertEqual([document['points'] for document in scored], [135, 100, 82, 0])
+
+    def test_partial_update_is_rescored_in_one_write(self):
+        """Test that a PATCH of one scored field is rescored by the update itself"""
+        self.post_activity('points_5', 'Running', 30, 5.5)
+        with mock.patch.object(Collection, 'update_one', autospec=True) as update_one:
+            response = self.client.patch(
+                reverse('activity-detail', args=['points_5']), {'distance': 1.0}, format='json'
+            )
+        update_one.assert_not_called()
+        self.assertEqual(response.data['points_earned'], 70)
+        self.assertEqual(self.stored_points('points_5'), 70)
+
+    def test_recompute_rescores_and_rederives_totals(self):
+        """Test that recompute_points applies new rules to stored activities and totals"""
+        self.post_activity('points_2', 'Yoga', 60, 0)
+        self.post_activity('points_3', 'Running', 10, 1.0)
+        rules = points.PointsRules({'TYPES': {'Yoga': {'MULTIPLIER': 0.5}}})
+        with mock.patch.object(points, 'rules', rules):
+            call_command('recompute_points', workers=1, stdout=StringIO())
+        self.assertEqual(self.stored_points('points_2'), 60)
+        self.assertEqual(self.stored_points('points_3'), 30)
+        user = get_collection(User).find_one({'_id': 'points_user'})
+        self.assertEqual(user['total_points'], 90)
+        entry = get_collection(Leaderboard).find_one({'user_id': 'points_user'})
+        self.assertEqual((entry['total_points'], entry['activities_count']), (90, 2))
+        response = self.client.get(reverse('activity-stats') + '?user_id=points_user')
+        self.assertEqual(response.data['totals']['points_earned'], 90)
+
+
+class WriteBehindTest(APITestCase):
+    """Test cases for write-behind activity creation"""
+    
+    def setUp(self):
+        self.client = APIClient()
+        response_cache.clear()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        self.queue = WriteBehindQueue(
+            dict(WRITE_BEHIND_DEFAULTS, ENABLED=True, DIRECTORY=self.directory)
+        )
+        self.addCleanup(self.queue.reset)
+        # Flushed by the tests instead of the background thread
+        self.queue.start = mock.Mock()
+        for target in ('octofit_tracker.views.write_behind', 'octofit_tracker.async_views.write_behind'):
+            patcher = mock.patch(target, self.queue)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        get_collection(User).insert_one(
+            {'_id': 'queued_user', 'name': 'Queued User', 'team_id': 'queue_team', 'total_points': 0}
+        )
+        get_collection(Leaderboard).insert_one({
+            '_id': 'queued_entry', 'user_id': 'queued_user', 'user_name': 'Queued User',
+            'team_id': 'queue_team', 'total_points': 0, 'activities_count': 0, 'rank': 1,
+        })
+    
+    def post_activity(self, duration):
+        return self.client.post(reverse('activity-list'), {
+            'user_id': 'queued_user',
+            'activity_type': 'Running',
+            'duration': duration,
+            'distance': 0.0,
+            'calories_burned': 200,
+            'date': datetime.now().isoformat(),
+        }, format='json')
+    
+    def test_create_is_queued_and_visible_to_its_user(self):
+        """Test that a queued activity is returned by id and in the user's activities"""
+        response = self.post_activity(20)
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(response.data['points_earned'], 40)
+        activity_id = response.data['_id']
+        self.assertIsNone(get_collection(Activity).find_one({'_id': ObjectId(activity_id)}))
+        
+        response = self.client.get(reverse('activity-detail', kwargs={'_id': activity_id}))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['points_earned'], 40)
+        response = self.client.get(reverse('activity-by-user'), {'user_id': 'queued_user'})
+        self.assertEqual([item['_id'] for item in response.data['results']], [activity_id])
+        response = self.client.get(reverse('user-activities', kwargs={'_id': 'queued_user'}))
+        self.assertEqual([item['_id'] for item in response.data['results']], [activity_id])
+    
+    def test_flush_persists_in_one_insert_and_applies_points(self):
+        """Test that a flush inserts the queue in one batch and updates the totals"""
+        self.post_activity(10)
+        self.post_activity(15)
+        with mock.patch.object(
+            Collection, 'insert_many', autospec=True, side_effect=Collection.insert_many
+        ) as insert_many:
+            self.assertEqual(self.queue.flush(), 2)
+        self.assertEqual(insert_many.call_count, 1)
+        self.assertEqual(os.listdir(self.directory), [])
+        self.assertEqual(get_collection(Activity).count_documents({'user_id': 'queued_user'}), 2)
+        user = get_collection(User).find_one({'_id': 'queued_user'})
+        self.assertEqual(user['total_points'], 50)
+        entry = get_collection(Leaderboard).find_one({'user_id': 'queued_user'})
+        self.assertEqual(entry['activities_count'], 2)
+    
+    def test_recovery_replays_orphaned_segments_once(self):
+        """Test that a dead process's segment is persisted without applying points twice"""
+        activity_id = self.post_activity(10).data['_id']
+        self.queue.flush()
+        stored = get_collection(Activity).find_one({'_id': ObjectId(activity_id)})
+        queued = dict(stored, _id=ObjectId(), points_earned=30)
+        # A crashed process's segment: one activity it had persisted, one it had not, a torn line
+        with open(os.path.join(self.directory, 'activities-999999999-1.log'), 'w') as segment:
+            segment.write(json_util.dumps(stored) + '\n' + json_util.dumps(queued) + '\n{"_id"\n')
+        
+        queue = WriteBehindQueue(dict(WRITE_BEHIND_DEFAULTS, ENABLED=True, DIRECTORY=self.directory))
+        with mock.patch('octofit_tracker.writebehind.process_running', return_value=False):
+            self.assertEqual(queue.recover(), 1)
+        self.assertEqual(queue.stats()['duplicates'], 1)
+        self.assertEqual(os.listdir(self.directory), [])
+        user = get_collection(User).find_one({'_id': 'queued_user'})
+        self.assertEqual(user['total_points'], 50)
+    
+    def test_failed_insert_keeps_the_segment(self):
+        """Test that an insert error other than a duplicate key leaves the activity queued"""
+        activity_id = self.post_activity(10).data['_id']
+        with mock.patch(
+            'octofit_tracker.writebehind.insert_activities',
+            return_value={0: (10107, 'not writable primary')}
+        ):
+            self.assertEqual(self.queue.flush(), 0)
+        self.assertEqual(len(os.listdir(self.directory)), 1)
+        self.assertEqual(self.queue.stats()['flush_failures'], 1)
+        self.assertEqual([str(document['_id']) for document in self.queue.pending()], [activity_id])
+        
+        self.assertEqual(self.queue.flush(), 1)
+        self.assertEqual(os.listdir(self.directory), [])
+        self.assertEqual(self.queue.pending(), [])
+    
+    def test_client_id_is_rejected(self):
+        """Test that a queued activity cannot reuse an existing activity's id"""
+        get_collection(Activity).insert_one({'_id': 'taken_activity', 'user_id': 'queued_user'})
+        response = self.client.post(reverse('activity-list'), {
+            '_id': 'taken_activity', 'user_id': 'queued_user', 'activity_type': 'Running',
+            'duration': 10, 'calories_burned': 100, 'date': datetime.now().isoformat(),
+        }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('_id', response.data)
+        self.assertEqual(self.queue.pending(), [])
+    
+    def test_invalid_activity_is_not_queued(self):
+        """Test that validation errors are returned before anything is queued"""
+        response = self.client.post(
+            reverse('activity-list'), {'user_id': 'queued_user'}, format='json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.queue.pending(), [])
+
+
+class ConditionalUpdateTest(APITestCase):
+    """Test cases for single round-trip updates with If-Match preconditions"""
+    
+    def setUp(self):
+        self.client = APIClient()
+        response_cache.clear()
+        get_collection(Team).insert_one({
+            '_id': 'versioned_team', 'name': 'Versioned', 'description': 'Before',
+            'created_at': datetime.now(), 'member_count': 0,
+        })
+        get_collection(User).insert_one({
+            '_id': 'versioned_user', 'name': 'Versioned User', 'email': 'versioned@example.com',
+            'password': 'secret', 'team_id': 'versioned_team', 'role': 'member', 'total_points': 0,
+            'created_at': datetime.now(),
+        })
+    
+    def test_update_is_one_find_one_and_update(self):
+        """Test that an update makes no other read and returns the new document"""
+        url = reverse('team-detail', args=['versioned_team'])
+        with mock.patch.object(Collection, 'find_one', autospec=True,
+                               side_effect=Collection.find_one) as find_one, \
+                mock.patch.object(Collection, 'find_one_and_update', autospec=True,
+                                  side_effect=Collection.find_one_and_update) as find_one_and_update:
+            response = self.client.patch(url, {'description': 'After'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['description'], 'After')
+        self.assertEqual(response['ETag'], '"1"')
+        self.assertEqual(find_one_and_update.call_count, 1)
+        self.assertEqual(find_one.call_count, 0)
+    
+    def test_string_user_id_is_updated(self):
+        """Test that users with string ids are updated and the body `_id` is ignored"""
+        response = self.client.patch(
+            reverse('user-detail', args=['versioned_user']),
+            {'_id': 'renamed_user', 'role': 'captain'}, format='json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['role'], 'captain')
+        self.assertEqual(get_collection(User).find_one({'_id': 'versioned_user'})['role'], 'captain')
+    
+    def test_object_id_user_keeps_their_own_email(self):
+        """Test that an ObjectId-stored user can resend their email but not take another's"""
+        user_id = ObjectId()
+        get_collection(User).insert_one({
+            '_id': user_id, 'name': 'Sampled User', 'email': 'sampled@example.com',
+            'password': 'secret', 'team_id': 'versioned_team', 'role': 'member',
+            'total_points': 0, 'created_at': datetime.now(),
+        })
+        url = reverse('user-detail', args=[str(user_id)])
+        response = self.client.patch(
+            url, {'name': 'Renamed', 'email': 'sampled@example.com'}, format='json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(get_collection(User).find_one({'_id': user_id})['name'], 'Renamed')
+        response = self.client.patch(url, {'email': 'versioned@example.com'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('email', response.data)
+    
+    def test_if_match_prevents_lost_updates(self):
+        """Test that an update with a stale ETag fails with 412 and changes nothing"""
+        url = reverse('team-detail', args=['versioned_team'])
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(etag, '"0"')
+        response = self.client.patch(url, {'name': 'First'}, format='json', HTTP_IF_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        
+        response = self.client.patch(url, {'name': 'Second'}, format='json', HTTP_IF_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_412_PRECONDITION_FAILED)
+        response = self.client.get(url)
+        self.assertEqual(response.data['name'], 'First')
+        self.assertEqual(response['ETag'], '"1"')
+        response = self.client.patch(url, {'name': 'Second'}, format='json', HTTP_IF_MATCH='"1"')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+    
+    def test_missing_document_is_not_found(self):
+        """Test that updating a missing document is a 404 with or without If-Match"""
+        url = reverse('team-detail', args=['missing_team'])
+        response = self.client.patch(url, {'name': 'Nobody'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        response = self.client.patch(url, {'name': 'Nobody'}, format='json', HTTP_IF_MATCH='"0"')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class MetricsTest(APITestCase):
+    """Test cases for MetricsMiddleware and the Prometheus endpoint"""
+
+    def setUp(self):
+        self.client = APIClient()
+        response_cache.clear()
+        metrics.registry.reset()
+        Team.objects.create(
+            _id='metrics_team',
+            name='Metrics Team',
+            description='Test Description',
+            created_at=datetime.now(),
+            member_count=0
+        )
+
+    def scrape(self):
+        response = self.client.get('/api/metrics')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['Content-Type'], metrics.CONTENT_TYPE)
+        return response.content.decode().splitlines()
+
+    def test_requests_are_labelled_by_route_and_action(self):
+        """Test that latency, size and status are recorded per route and action"""
+        self.client.get(reverse('team-list'))
+        self.client.get(reverse('team-detail', args=['metrics_team']))
+        lines = self.scrape()
+        labels = 'route="team-list",action="list",method="GET"'
+        self.assertIn(f'octofit_http_requests_total{{{labels},status="200"}} 1', lines)
+        self.assertIn(f'octofit_http_request_duration_seconds_count{{{labels}}} 1', lines)
+        self.assertIn(f'octofit_http_response_size_bytes_count{{{labels}}} 1', lines)
+        self.assertIn(f'octofit_http_requests_in_flight{{{labels}}} 0', lines)
+        self.assertIn(
+            'octofit_http_requests_total{route="team-detail",action="retrieve",method="GET",status="200"} 1',
+            lines
+        )
+
+    def test_mongo_commands_are_counted_per_request(self):
+        """Test that the command listener attributes round trips to the request"""
+        self.client.get(reverse('team-list'))
+        lines = self.scrape()
+        labels = 'route="team-list",action="list",method="GET"'
+        self.assertIn(f'octofit_http_request_mongo_commands_bucket{{{labels},le="0"}} 0', lines)
+        self.assertIn(f'octofit_http_request_mongo_commands_bucket{{{labels},le="+Inf"}} 1', lines)
+        self.assertTrue(any(line.startswith('octofit_mongo_commands_total{command="find"') for line in lines))
+
+    def test_unknown_paths_share_one_label(self):
+        """Test that unresolved paths do not create a series each"""
+        self.client.get('/no-such-page/')
+        self.client.get('/another-missing-page/')
+        self.assertIn(
+            'octofit_http_requests_total{route="unmatched",action="",method="GET",status="404"} 2',
+            self.scrape()
+        )
+
+
+class SlowCommandLogTest(APITestCase):
+    """Test cases for the slow MongoDB command log"""
+
+    def setUp(self):
+        self.client = APIClient()
+        response_cache.clear()
+        slow_log.clear()
+        for name, value in (('enabled', True), ('threshold', 0), ('sample_rate', 1.0)):
+            patcher = mock.patch.object(slow_log, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        get_collection(Activity).insert_one({
+            '_id': 'slow_activity', 'user_id': 'slow_user', 'activity_type': 'Rowing',
+            'duration': 30, 'date': datetime(2025, 3, 1), 'notes': 'slow'
+        })
+
+    def wait_for_explain(self, entry):
+        deadline = time.monotonic() + 5
+        while entry.explain_status == 'pending' and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(entry.explain_status, 'done')
+
+    def test_commands_record_route_and_action(self):
+        """Test that a logged command names the view and action that issued it"""
+        self.client.get(reverse('activity-by-type') + '?type=Rowing')
+        entries = [entry for entry in slow_log.records()
+                   if entry.command_name == 'find' and entry.collection == 'activities']
+        self.assertTrue(entries)
+        self.assertEqual((entries[0].route, entries[0].action), ('activity-by-type', 'by_type'))
+
+    def test_sampled_explain_flags_collection_scans(self):
+        """Test that an unindexed read is explained as a COLLSCAN"""
+        list(get_collection(Activity).find({'notes': 'slow'}))
+        entry = next(entry for entry in slow_log.records() if entry.command_name == 'find')
+        self.wait_for_explain(entry)
+        self.assertTrue(entry.collscan)
+        self.assertIn('COLLSCAN', entry.plan_stages)
+
+    def test_plan_summary_reads_aggregate_explains(self):
+        """Test that winning plans nested in aggregate explains are summarized"""
+        explain = {'stages': [{'$cursor': {'queryPlanner': {'winningPlan': {
+            'stage': 'FETCH', 'inputStage': {'stage': 'IXSCAN', 'indexName': 'team_id_1'}
+        }}}}]}
+        self.assertEqual(
+            [plan_summary(plan) for plan in winning_plans(explain)],
+            [(['FETCH', 'IXSCAN'], ['team_id_1'])]
+        )
+
+    def test_admin_page_lists_entries(self):
+        """Test that the admin page renders the log and can clear it"""
+        self.client.get(reverse('activity-by-type') + '?type=Rowing')
+        factory = RequestFactory()
+        request = factory.get('/admin/slow-commands/')
+        request.user = mock.MagicMock(is_active=True, is_staff=True)
+        response = slow_commands(request).render()
+        self.assertContains(response, 'activity-by-type')
+        request = factory.post('/admin/slow-commands/')
+        request.user = mock.MagicMock(is_active=True, is_staff=True)
+        self.assertEqual(slow_commands(request).status_code, 302)
+        self.assertEqual(slow_log.records(), [])
+
+
+@override_settings(ROOT_URLCONF='octofit_tracker.urls_async')
+class AsyncReadTest(APITestCase):
+    """Test cases for the native async read views served under ASGI"""
+
+    def setUp(self):
+        self.client = AsyncClient(SERVER_NAME='localhost')
+        response_cache.clear()
+        get_collection(Leaderboard).insert_many([
+            {'_id': f'async_entry_{rank}', 'user_id': f'async_user_{rank}',
+             'user_name': f'Async User {rank}', 'team_id': 'async_team', 'total_points': 100 - rank,
+             'activities_count': 1, 'rank': rank, 'last_updated': datetime(2025, 3, 3)}
+            for rank in range(1, 4)
+        ])
+        leaderboard.invalidate_head()
+
+    async def test_leaderboard_pages_in_rank_order(self):
+        """Test that the async leaderboard list paginates like the DRF view"""
+        response = await self.client.get('/api/leaderboard/?page_size=2')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['X-Cache'], 'MISS')
+        data = response.json()
+        self.assertEqual([entry['rank'] for entry in data['results']], [1, 2])
+
+        response = await self.client.get(data['next'])
+        self.assertEqual([entry['rank'] for entry in response.json()['results']], [3])
+
+        response = await self.client.get('/api/leaderboard/?page_size=2')
+        self.assertEqual(response['X-Cache'], 'HIT')
+        self.assertEqual(response.json(), data)
+
+    async def test_top_and_errors(self):
+        """Test the async top route and the error responses"""
+        response = await self.client.get('/api/leaderboard/top/?limit=2')
+        self.assertEqual([entry['user_name'] for entry in response.json()],
+                         ['Async User 1', 'Async User 2'])
+
+        response = await self.client.get('/api/leaderboard/?cursor=bogus')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        response = await self.client.get('/api/activities/by_user/')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    async def test_writes_fall_through_to_viewset(self):
+        """Test that non-GET requests on async routes reach the DRF viewset"""
+        response = await self.client.post('/api/teams/', {}, content_type='application/json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('name', response.json())
+
+
+class PopulateScaleTest(TestCase):
+    """Test cases for the populate_db scale mode"""
+
+    def populate(self):
+        call_command(
+            'populate_db', users=120, teams=3, activities_per_user=4, seed=7,
+            workers=1, chunk_size=50, batch_size=32, stdout=StringIO()
+        )
+        return mongo.get_db()
+
+    def test_generated_data_is_consistent(self):
+        """Test that member counts, totals and ranks derive from the generated data"""
+        db = self.populate()
+        self.assertEqual(db.users.count_documents({}), 120)
+        self.assertEqual(sum(team['member_count'] for team in db.teams.find()), 120)
+        for user in db.users.find().limit(10):
+            points = sum(
+                activity['points_earned'] for activity in db.activities.find({'user_id': user['_id']})
+            )
+            self.assertEqual(user['total_points'], points)
+        entries = list(db.leaderboard.find())
+        self.assertEqual(len(entries), 120)
+        for entry in entries:
+            above = sum(1 for other in entries if other['total_points'] > entry['total_points'])
+            self.assertEqual(entry['rank'], above + 1)
+        # Activity notes are only indexed with --rebuild-search
+        self.assertEqual(db[search.POSTINGS].distinct('kind'), ['workout'])
+
+    def test_seed_is_reproducible(self):
+        """Test that the same seed generates the same users"""
+        first = sorted((user['_id'], user['total_points']) for user in self.populate().users.find())
+        second = sorted((user['_id'], user['total_points']) for user in self.populate().users.find())
+        self.assertEqual(first, second)
+
+
 class APIRootTest(APITestCase):
     """Test cases for API root endpoint"""
     
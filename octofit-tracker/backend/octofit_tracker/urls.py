@@ -20,9 +20,11 @@ from rest_framework import routers
 from rest_framework.decorators import api_view
 from rest_framework.response import Response
 from rest_framework.reverse import reverse
+from .admin import slow_commands
 from .views import (
     TeamViewSet, UserViewSet, ActivityViewSet,
-    LeaderboardViewSet, WorkoutViewSet
+    LeaderboardViewSet, WorkoutViewSet, mongo_pool_stats, response_cache_stats,
+    write_behind_stats, prometheus_metrics
 )
 
 # Configure base URL for Codespaces
@@ -59,7 +61,12 @@ def api_root(request, format=None):
 
 urlpatterns = [
     path('', api_root, name='api-root'),
+    path('api/pool-stats/', mongo_pool_stats, name='mongo-pool-stats'),
+    path('api/cache-stats/', response_cache_stats, name='response-cache-stats'),
+    path('api/write-behind-stats/', write_behind_stats, name='write-behind-stats'),
+    path('api/metrics', prometheus_metrics, name='metrics'),
     path('api/', include(router.urls)),
+    path('admin/slow-commands/', admin.site.admin_view(slow_commands), name='admin-slow-commands'),
     path('admin/', admin.site.urls),
     path('api-auth/', include('rest_framework.urls', namespace='rest_framework')),
 ]
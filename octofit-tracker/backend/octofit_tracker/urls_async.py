@@ -0,0 +1,17 @@
+"""octofit_tracker URL Configuration for ASGI
+
+Routes the hot read endpoints to the native async views in async_views and
+everything else to the regular URLconf. asgi.py selects this module through
+the OCTOFIT_URLCONF environment variable.
+"""
+from django.urls import path
+from . import async_views
+from .urls import urlpatterns as sync_urlpatterns
+
+urlpatterns = [
+    path('api/teams/', async_views.team_list, name='team-list'),
+    path('api/workouts/', async_views.workout_list, name='workout-list'),
+    path('api/leaderboard/', async_views.leaderboard_list, name='leaderboard-list'),
+    path('api/leaderboard/top/', async_views.leaderboard_top, name='leaderboard-top'),
+    path('api/activities/by_user/', async_views.activities_by_user, name='activity-by-user'),
+] + sync_urlpatterns
@@ -1,15 +1,58 @@
 from rest_framework import viewsets, status
-from rest_framework.decorators import action
+from rest_framework.decorators import action, api_view
 from rest_framework.response import Response
+from rest_framework.reverse import reverse
 from bson import ObjectId
+from django.http import HttpResponse, StreamingHttpResponse
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from django.views.decorators.http import require_GET
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.permissions import SAFE_METHODS
 from .models import Team, User, Activity, Leaderboard, Workout
+from .documents import VERSION, id_filter, to_instance
+from . import catalog, export, leaderboard, metrics, points, recommendations, rollups
+from .cache import CacheInvalidationMixin, cache_response, response_cache
+from .catalog import EMPTY_LISTING, get_catalog
+from .leaderboard import activity_deltas, apply_deltas
+from .mixins import MongoLookupMixin, MongoListMixin, MongoUpdateMixin, SearchMixin
+from .pagination import ActivityPagination, LeaderboardPagination
+from .recommendations import apply_feature_deltas, feature_deltas
+from .rollups import apply_rollup_deltas, assign_teams, rollup_deltas
+from .search import KINDS, POSTINGS, index_documents, remove_documents
+from .writebehind import insert_activities, write_behind
+from .mongo import pool_stats
 from .serializers import (
-    TeamSerializer, UserSerializer, ActivitySerializer,
+    TeamSerializer, UserSerializer, ActivitySerializer, BulkActivitySerializer,
     LeaderboardSerializer, WorkoutSerializer
 )
 
 
-class TeamViewSet(viewsets.ModelViewSet):
+def parse_date_range(params):
+    """
+    Return aware (start, end) datetimes from the date_from and date_to
+    query parameters, None when absent. A bare date covers the whole day on
+    either end of the range. Raises ValueError naming an invalid parameter.
+    """
+    bounds = []
+    for param, time_of_day in (('date_from', 'T00:00:00'), ('date_to', 'T23:59:59.999999')):
+        value = params.get(param, None)
+        if not value:
+            bounds.append(None)
+            continue
+        moment = parse_datetime(value)
+        if moment is None and parse_date(value) is not None:
+            moment = parse_datetime(value + time_of_day)
+        if moment is None:
+            raise ValueError(f'{param} must be an ISO date or datetime')
+        if timezone.is_naive(moment):
+            moment = timezone.make_aware(moment, timezone.utc)
+        bounds.append(moment)
+    return tuple(bounds)
+
+
+class TeamViewSet(CacheInvalidationMixin, MongoLookupMixin, MongoUpdateMixin, MongoListMixin,
+                  viewsets.ModelViewSet):
     """
     API endpoint for teams.
     Provides CRUD operations for Team model.
@@ -18,31 +61,25 @@ class TeamViewSet(viewsets.ModelViewSet):
     serializer_class = TeamSerializer
     lookup_field = '_id'
 
-    def get_object(self):
-        """Override to handle ObjectId conversion for MongoDB"""
-        queryset = self.filter_queryset(self.get_queryset())
-        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
-        lookup_value = self.kwargs[lookup_url_kwarg]
-        
-        # Find object by comparing string representation of _id
-        for obj in queryset:
-            if str(obj._id) == lookup_value:
-                self.check_object_permissions(self.request, obj)
-                return obj
-        
-        from rest_framework.exceptions import NotFound
-        raise NotFound('No Team matches the given query.')
+    @cache_response('teams')
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+
+    @cache_response('teams')
+    def retrieve(self, request, *args, **kwargs):
+        return super().retrieve(request, *args, **kwargs)
 
     @action(detail=True, methods=['get'])
-    def members(self, request, pk=None):
+    def members(self, request, _id=None):
         """Get all members of a specific team"""
         team = self.get_object()
-        users = User.objects.filter(team_id=team._id)
-        serializer = UserSerializer(users, many=True)
-        return Response(serializer.data)
+        return self.list_documents(
+            id_filter(team._id, 'team_id'), model=User, serializer_class=UserSerializer
+        )
 
 
-class UserViewSet(viewsets.ModelViewSet):
+class UserViewSet(CacheInvalidationMixin, MongoLookupMixin, MongoUpdateMixin, MongoListMixin,
+                  viewsets.ModelViewSet):
     """
     API endpoint for users.
     Provides CRUD operations for User model.
@@ -50,106 +87,362 @@ class UserViewSet(viewsets.ModelViewSet):
     queryset = User.objects.all()
     serializer_class = UserSerializer
     lookup_field = '_id'
-
-    def get_object(self):
-        """Override to handle ObjectId conversion for MongoDB"""
-        queryset = self.filter_queryset(self.get_queryset())
-        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
-        lookup_value = self.kwargs[lookup_url_kwarg]
-        
-        # Find object by comparing string representation of _id
-        for obj in queryset:
-            if str(obj._id) == lookup_value:
-                self.check_object_permissions(self.request, obj)
-                return obj
-        
-        from rest_framework.exceptions import NotFound
-        raise NotFound('No User matches the given query.')
-
-    def update(self, request, *args, **kwargs):
-        """Override update to use PyMongo directly for MongoDB"""
-        partial = kwargs.pop('partial', False)
-        instance = self.get_object()
-        
-        serializer = self.get_serializer(instance, data=request.data, partial=partial)
-        serializer.is_valid(raise_exception=True)
-        
-        # Update using PyMongo directly
-        from pymongo import MongoClient
-        client = MongoClient('mongodb://localhost:27017/')
-        db = client['octofit_db']
-        
-        update_data = {}
-        for key, value in serializer.validated_data.items():
-            if  key != '_id':  # Don't update _id
-                update_data[key] = value
-        
-        if update_data:
-            result = db.users.update_one(
-                {'_id': ObjectId(str(instance._id))},
-                {'$set': update_data}
-            )
-        
-        # Fetch updated user
-        updated_user = self.get_object()
-        serializer = self.get_serializer(updated_user)
-        
-        return Response(serializer.data)
+    max_recommendations = 50
 
     @action(detail=True, methods=['get'])
-    def activities(self, request, pk=None):
+    def activities(self, request, _id=None):
         """Get all activities for a specific user"""
         user = self.get_object()
-        activities = Activity.objects.filter(user_id=str(user.id))
-        serializer = ActivitySerializer(activities, many=True)
-        return Response(serializer.data)
+        pending = write_behind.pending_for_user(user._id) if write_behind.enabled else ()
+        return self.list_documents(
+            id_filter(user._id, 'user_id'),
+            model=Activity,
+            serializer_class=ActivitySerializer,
+            pagination_class=ActivityPagination,
+            pending=pending
+        )
+
+    @action(detail=True, methods=['get'])
+    @cache_response('users', recommendations.USER_FEATURES, 'workouts')
+    def recommended_workouts(self, request, _id=None):
+        """Get the workouts that best match the user's activity history"""
+        try:
+            limit = int(request.query_params.get('limit', 10))
+        except ValueError:
+            return Response(
+                {'error': 'limit must be an integer'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        limit = max(1, min(limit, self.max_recommendations))
+
+        user = self.get_object()
+        ranked = recommendations.recommend(user._id, limit)
+        selection = WorkoutSerializer(context=self.get_serializer_context())
+        data = self.serialize_documents([document for document, _ in ranked], selection, Workout)
+        for item, (_, score) in zip(data, ranked):
+            item['score'] = round(score, 4)
+        return Response({'user_id': str(user._id), 'results': data})
 
     @action(detail=False, methods=['get'])
     def by_team(self, request):
         """Get all users filtered by team"""
         team_id = request.query_params.get('team_id', None)
         if team_id:
-            users = User.objects.filter(team_id=team_id)
-            serializer = self.get_serializer(users, many=True)
-            return Response(serializer.data)
+            return self.list_documents({'team_id': team_id})
         return Response(
             {'error': 'team_id parameter is required'},
             status=status.HTTP_400_BAD_REQUEST
         )
 
 
-class ActivityViewSet(viewsets.ModelViewSet):
+class ActivityViewSet(CacheInvalidationMixin, MongoLookupMixin, MongoUpdateMixin, MongoListMixin,
+                      SearchMixin, viewsets.ModelViewSet):
     """
     API endpoint for activities.
     Provides CRUD operations for Activity model.
     """
     queryset = Activity.objects.all()
     serializer_class = ActivitySerializer
+    pagination_class = ActivityPagination
     lookup_field = '_id'
+    search_kind = 'activity'
+    bulk_max_records = 1000
+    export_batch_size = 1000
 
     def get_object(self):
-        """Override to handle ObjectId conversion for MongoDB"""
-        queryset = self.filter_queryset(self.get_queryset())
-        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
-        lookup_value = self.kwargs[lookup_url_kwarg]
-        
-        # Find object by comparing string representation of _id
-        for obj in queryset:
-            if str(obj._id) == lookup_value:
-                self.check_object_permissions(self.request, obj)
-                return obj
-        
-        from rest_framework.exceptions import NotFound
-        raise NotFound('No Activity matches the given query.')
+        """Retrieves also find activities still in the write-behind queue"""
+        if self.action == 'retrieve' and write_behind.enabled:
+            document = write_behind.pending_activity(self.kwargs[self.lookup_field])
+            if document is not None:
+                return to_instance(Activity, document)
+        return super().get_object()
+
+    def create(self, request, *args, **kwargs):
+        """
+        Create an activity. In write-behind mode the validated, scored
+        activity is queued and 202 returned with its id; it is persisted,
+        with its points, within WRITE_BEHIND['FLUSH_INTERVAL']. The id is
+        always a new ObjectId, so a duplicate key when the queue is
+        persisted can only mean the activity was inserted already.
+        """
+        if not write_behind.enabled:
+            return super().create(request, *args, **kwargs)
+        validator = BulkActivitySerializer(context=self.get_serializer_context())
+        document = dict(validator.run_validation(request.data))
+        if '_id' in document:
+            raise ValidationError({'_id': ['Assigned by the server when activities are queued.']})
+        document['_id'] = ObjectId()
+        document['points_earned'] = points.rules.points(document)
+        write_behind.enqueue(document)
+        activity_id = str(document['_id'])
+        location = reverse('activity-detail', kwargs={'_id': activity_id}, request=request)
+        return Response(
+            {'_id': activity_id, 'points_earned': document['points_earned'], 'status': 'queued'},
+            status=status.HTTP_202_ACCEPTED,
+            headers={'Location': location}
+        )
+
+    def perform_create(self, serializer):
+        """
+        Score and save the activity with its user's team and add its points
+        to the user's totals
+        """
+        document = dict(serializer.validated_data)
+        document['points_earned'] = points.rules.points(document)
+        assign_teams([document])
+        activity = serializer.save(
+            points_earned=document['points_earned'], team_id=document['team_id']
+        )
+        apply_deltas(activity_deltas(after={
+            'user_id': activity.user_id,
+            'points_earned': activity.points_earned,
+        }))
+        apply_rollup_deltas(rollup_deltas(after=document))
+        apply_feature_deltas(feature_deltas(after=document))
+
+    def get_changes(self, serializer):
+        """
+        A full update (PUT) sets every scored field, ones left out to their
+        default, so it is scored from the request alone
+        """
+        changes = super().get_changes(serializer)
+        if not serializer.partial:
+            for field in points.FIELDS:
+                if field not in changes:
+                    changes[field] = Activity._meta.get_field(field).get_default()
+        return changes
+
+    def get_update(self, changes, team_id=None):
+        """
+        Set `changes` and bump the version in one write. An update of some
+        of the scored fields is rescored from the stored ones by a second
+        pipeline stage, and an activity given to another user moves to that
+        user's team, `team_id`, only if the stored user differs.
+        """
+        rescore = 'points_earned' not in changes and any(
+            field in changes for field in points.FIELDS
+        )
+        if team_id is None and not rescore:
+            return super().get_update(changes)
+        stage = dict(
+            {field: {'$literal': value} for field, value in changes.items()},
+            **{VERSION: {'$add': [{'$ifNull': [f'${VERSION}', 0]}, 1]}}
+        )
+        if team_id is not None:
+            stage['team_id'] = {'$cond': [
+                {'$eq': ['$user_id', {'$literal': changes['user_id']}]}, '$team_id', team_id
+            ]}
+        pipeline = [{'$set': stage}]
+        if rescore:
+            pipeline.append({'$set': {'points_earned': points.rules.expression()}})
+        return pipeline
+
+    def perform_mongo_update(self, query, changes):
+        """
+        Rescore and update the activity in place and move points between totals.
+        Updates with every scored field are scored here; others are rescored
+        by the update pipeline, and the same rules score the returned document.
+        """
+        if all(field in changes for field in points.FIELDS):
+            changes['points_earned'] = points.rules.points(changes)
+        team_id = None
+        if 'user_id' in changes:
+            team_id = assign_teams([{'user_id': changes['user_id']}])[0]['team_id']
+        previous = self.get_collection().find_one_and_update(
+            query, self.get_update(changes, team_id)
+        )
+        if previous is None:
+            return None
+        updated = dict(previous, **changes)
+        if team_id is not None and str(previous.get('user_id')) != str(changes['user_id']):
+            updated['team_id'] = team_id
+        updated[VERSION] = previous.get(VERSION, 0) + 1
+        if 'points_earned' not in changes and any(field in changes for field in points.FIELDS):
+            updated['points_earned'] = points.rules.points(updated)
+        apply_deltas(activity_deltas(before=previous, after=updated))
+        apply_rollup_deltas(rollup_deltas(before=previous, after=updated))
+        apply_feature_deltas(feature_deltas(before=previous, after=updated))
+        if 'notes' in changes:
+            index_documents('activity', [updated])
+        return updated
+
+    def perform_destroy(self, instance):
+        """Delete the activity and remove its points from the user's totals"""
+        previous = self.get_collection().find_one_and_delete(id_filter(instance._id))
+        if previous is not None:
+            apply_deltas(activity_deltas(before=previous))
+            apply_rollup_deltas(rollup_deltas(before=previous))
+            apply_feature_deltas(feature_deltas(before=previous))
+            remove_documents('activity', [previous['_id']])
+
+    @action(detail=False, methods=['post'])
+    def bulk(self, request):
+        """
+        Create many activities in one request.
+        Records are validated in one pass, scored together, written with a
+        single unordered insert_many and their points applied with one bulk
+        write per collection. The response reports success or errors for
+        each item.
+        """
+        records = request.data
+        if not isinstance(records, list) or not records:
+            return Response(
+                {'error': 'request body must be a non-empty list of activities'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if len(records) > self.bulk_max_records:
+            return Response(
+                {'error': f'at most {self.bulk_max_records} activities per request'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        results = [None] * len(records)
+        documents = []
+        positions = []
+        validator = BulkActivitySerializer(context=self.get_serializer_context())
+        for index, record in enumerate(records):
+            try:
+                document = dict(validator.run_validation(record))
+            except ValidationError as exc:
+                results[index] = {'index': index, 'status': 'error', 'errors': exc.detail}
+                continue
+            document.setdefault('_id', ObjectId())
+            documents.append(document)
+            positions.append(index)
+        scores = points.rules.points_array(documents).tolist()
+        for document, points_earned in zip(documents, scores):
+            document['points_earned'] = points_earned
+
+        failed = insert_activities(documents)
+        for offset, document in enumerate(documents):
+            if offset in failed:
+                results[positions[offset]] = {
+                    'index': positions[offset],
+                    'status': 'error',
+                    'errors': {'non_field_errors': [failed[offset][1]]},
+                }
+            else:
+                results[positions[offset]] = {
+                    'index': positions[offset],
+                    'status': 'created',
+                    '_id': str(document['_id']),
+                }
+
+        created = sum(1 for result in results if result['status'] == 'created')
+        if created == len(records):
+            response_status = status.HTTP_201_CREATED
+        elif created:
+            response_status = status.HTTP_207_MULTI_STATUS
+        else:
+            response_status = status.HTTP_400_BAD_REQUEST
+        return Response({
+            'created': created,
+            'failed': len(records) - created,
+            'results': results,
+        }, status=response_status)
+
+    @action(detail=False, methods=['get'])
+    def export(self, request):
+        """
+        Stream activities as NDJSON or CSV.
+        Filters: user_id, type, date_from and date_to (ISO dates or datetimes).
+        Rows are read from a server-side cursor in batches and never
+        collected in memory.
+        """
+        output = request.query_params.get('output', 'ndjson')
+        if output not in export.FORMATS:
+            return Response(
+                {'error': f'output must be one of {", ".join(export.FORMATS)}'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        query = {}
+        user_id = request.query_params.get('user_id', None)
+        if user_id:
+            query.update(id_filter(user_id, 'user_id'))
+        activity_type = request.query_params.get('type', None)
+        if activity_type:
+            query['activity_type'] = activity_type
+        try:
+            start, end = parse_date_range(request.query_params)
+        except ValueError as exc:
+            return Response({'error': str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+        date_range = {}
+        if start is not None:
+            date_range['$gte'] = start
+        if end is not None:
+            date_range['$lte'] = end
+        if date_range:
+            query['date'] = date_range
+
+        cursor = self.get_collection().find(query, batch_size=self.export_batch_size)
+        batches = export.serialize_batches(
+            cursor, Activity, ActivitySerializer, self.export_batch_size
+        )
+        fields = ActivitySerializer.Meta.fields
+        response = StreamingHttpResponse(
+            export.stream(output, batches, fields), content_type=export.FORMATS[output]
+        )
+        response['Content-Disposition'] = f'attachment; filename="activities.{output}"'
+        return response
+
+    @action(detail=False, methods=['get'])
+    @cache_response(rollups.USER_DAILY)
+    def stats(self, request):
+        """
+        Get a user's activity totals per day, week or month from the daily
+        rollups. Filters: user_id (required), period, date_from and date_to.
+        """
+        user_id = request.query_params.get('user_id', None)
+        if not user_id:
+            return Response(
+                {'error': 'user_id parameter is required'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        period = request.query_params.get('period', 'day')
+        if period not in rollups.PERIODS:
+            return Response(
+                {'error': f'period must be one of {", ".join(rollups.PERIODS)}'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        try:
+            start, end = parse_date_range(request.query_params)
+        except ValueError as exc:
+            return Response({'error': str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(rollups.user_stats(user_id, start, end, period))
+
+    @action(detail=False, methods=['get'], url_path='stats/teams')
+    @cache_response(rollups.TEAM_WEEKLY)
+    def team_stats(self, request):
+        """
+        Get a team's weekly activity totals from the weekly rollups.
+        Filters: team_id (required), date_from and date_to.
+        """
+        team_id = request.query_params.get('team_id', None)
+        if not team_id:
+            return Response(
+                {'error': 'team_id parameter is required'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        try:
+            start, end = parse_date_range(request.query_params)
+        except ValueError as exc:
+            return Response({'error': str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(rollups.team_stats(team_id, start, end))
+
+    @action(detail=False, methods=['get'])
+    @cache_response('activities', POSTINGS)
+    def search(self, request):
+        """Search activity notes; ?q= terms, ranked best first"""
+        return self.search_documents(request)
 
     @action(detail=False, methods=['get'])
     def by_user(self, request):
         """Get all activities filtered by user"""
         user_id = request.query_params.get('user_id', None)
         if user_id:
-            activities = Activity.objects.filter(user_id=user_id)
-            serializer = self.get_serializer(activities, many=True)
-            return Response(serializer.data)
+            pending = write_behind.pending_for_user(user_id) if write_behind.enabled else ()
+            return self.list_documents(id_filter(user_id, 'user_id'), pending=pending)
         return Response(
             {'error': 'user_id parameter is required'},
             status=status.HTTP_400_BAD_REQUEST
@@ -160,107 +453,210 @@ class ActivityViewSet(viewsets.ModelViewSet):
         """Get all activities filtered by activity type"""
         activity_type = request.query_params.get('type', None)
         if activity_type:
-            activities = Activity.objects.filter(activity_type=activity_type)
-            serializer = self.get_serializer(activities, many=True)
-            return Response(serializer.data)
+            return self.list_documents({'activity_type': activity_type})
         return Response(
             {'error': 'type parameter is required'},
             status=status.HTTP_400_BAD_REQUEST
         )
 
 
-class LeaderboardViewSet(viewsets.ModelViewSet):
+class LeaderboardViewSet(CacheInvalidationMixin, MongoLookupMixin, MongoUpdateMixin, MongoListMixin,
+                         viewsets.ModelViewSet):
     """
     API endpoint for leaderboard.
     Provides CRUD operations for Leaderboard model.
     """
     queryset = Leaderboard.objects.all().order_by('rank')
     serializer_class = LeaderboardSerializer
+    pagination_class = LeaderboardPagination
     lookup_field = '_id'
+    max_neighbours = 50
 
-    def get_object(self):
-        """Override to handle ObjectId conversion for MongoDB"""
-        queryset = self.filter_queryset(self.get_queryset())
-        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
-        lookup_value = self.kwargs[lookup_url_kwarg]
-        
-        # Find object by comparing string representation of _id
-        for obj in queryset:
-            if str(obj._id) == lookup_value:
-                self.check_object_permissions(self.request, obj)
-                return obj
-        
-        from rest_framework.exceptions import NotFound
-        raise NotFound('No Leaderboard matches the given query.')
+    # Every write drops this process's cached head, which `top` reads
+    def perform_create(self, serializer):
+        super().perform_create(serializer)
+        leaderboard.invalidate_head()
+
+    def perform_mongo_update(self, query, changes):
+        document = super().perform_mongo_update(query, changes)
+        leaderboard.invalidate_head()
+        return document
+
+    def perform_destroy(self, instance):
+        super().perform_destroy(instance)
+        leaderboard.invalidate_head()
+
+    @cache_response('leaderboard')
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
 
     @action(detail=False, methods=['get'])
+    @cache_response('leaderboard')
     def by_team(self, request):
         """Get leaderboard filtered by team"""
         team_id = request.query_params.get('team_id', None)
         if team_id:
-            leaderboard = Leaderboard.objects.filter(team_id=team_id).order_by('rank')
-            serializer = self.get_serializer(leaderboard, many=True)
-            return Response(serializer.data)
+            return self.list_documents({'team_id': team_id})
         return Response(
             {'error': 'team_id parameter is required'},
             status=status.HTTP_400_BAD_REQUEST
         )
 
     @action(detail=False, methods=['get'])
+    @cache_response('leaderboard')
     def top(self, request):
-        """Get top N users from leaderboard"""
-        limit = int(request.query_params.get('limit', 10))
-        leaderboard = Leaderboard.objects.all().order_by('rank')[:limit]
-        serializer = self.get_serializer(leaderboard, many=True)
+        """Get top N users from the precomputed head of the leaderboard"""
+        try:
+            limit = int(request.query_params.get('limit', 10))
+        except ValueError:
+            return Response(
+                {'error': 'limit must be an integer'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        limit = max(1, min(limit, leaderboard.HEAD_SIZE))
+        entries = [to_instance(Leaderboard, entry) for entry in leaderboard.get_head()[:limit]]
+        serializer = self.get_serializer(entries, many=True)
         return Response(serializer.data)
 
+    @action(detail=False, methods=['get'])
+    @cache_response('leaderboard')
+    def rank(self, request):
+        """Get a user's rank and the k entries around them"""
+        user_id = request.query_params.get('user_id', None)
+        if not user_id:
+            return Response(
+                {'error': 'user_id parameter is required'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        try:
+            k = int(request.query_params.get('k', 5))
+        except ValueError:
+            return Response(
+                {'error': 'k must be an integer'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        k = max(0, min(k, self.max_neighbours))
+
+        entry = leaderboard.find_entry(user_id)
+        if entry is None:
+            raise NotFound('No Leaderboard matches the given query.')
+        above, below = leaderboard.neighbours(entry, k) if k else ([], [])
+
+        def serialize(documents):
+            instances = [to_instance(Leaderboard, document) for document in documents]
+            return self.get_serializer(instances, many=True).data
 
-class WorkoutViewSet(viewsets.ModelViewSet):
+        return Response({
+            'rank': entry['rank'],
+            'entry': self.get_serializer(to_instance(Leaderboard, entry)).data,
+            'above': serialize(above),
+            'below': serialize(below),
+        })
+
+
+class WorkoutViewSet(CacheInvalidationMixin, MongoLookupMixin, MongoUpdateMixin, MongoListMixin,
+                     SearchMixin, viewsets.ModelViewSet):
     """
     API endpoint for workouts.
     Provides CRUD operations for Workout model.
+    Lists and searches are served from the in-memory workout catalog;
+    retrieves read the stored document, so the ETag is its current version.
     """
     queryset = Workout.objects.all()
     serializer_class = WorkoutSerializer
     lookup_field = '_id'
+    search_kind = 'workout'
 
-    def get_object(self):
-        """Override to handle ObjectId conversion for MongoDB"""
-        queryset = self.filter_queryset(self.get_queryset())
-        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
-        lookup_value = self.kwargs[lookup_url_kwarg]
-        
-        # Find object by comparing string representation of _id
-        for obj in queryset:
-            if str(obj._id) == lookup_value:
-                self.check_object_permissions(self.request, obj)
-                return obj
-        
-        from rest_framework.exceptions import NotFound
-        raise NotFound('No Workout matches the given query.')
+    def list_catalog(self, listing):
+        """Serialize one keyset page of a catalog listing"""
+        selection = self.get_serializer()
+        documents = self.paginator.paginate_sorted(listing.documents, listing.keys, self.request)
+        return self.paginator.get_paginated_response(self.serialize_documents(documents, selection))
+
+    def perform_mongo_update(self, query, changes):
+        """Update the workout and reindex it; ORM saves are reindexed by signal"""
+        document = super().perform_mongo_update(query, changes)
+        if document is not None and not changes.keys().isdisjoint(KINDS['workout'].fields):
+            index_documents('workout', [document])
+        return document
+
+    def get_search_documents(self, doc_ids, selection):
+        by_id = get_catalog().by_id
+        return {doc_id: by_id[doc_id] for doc_id in doc_ids if doc_id in by_id}
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        # After CacheInvalidationMixin has bumped the workouts generation
+        if request.method not in SAFE_METHODS and status.is_success(response.status_code):
+            catalog.refresh()
+        return response
+
+    @cache_response('workouts')
+    def list(self, request, *args, **kwargs):
+        return self.list_catalog(get_catalog().all)
 
     @action(detail=False, methods=['get'])
+    @cache_response('workouts')
     def by_difficulty(self, request):
         """Get workouts filtered by difficulty"""
         difficulty = request.query_params.get('difficulty', None)
         if difficulty:
-            workouts = Workout.objects.filter(difficulty=difficulty)
-            serializer = self.get_serializer(workouts, many=True)
-            return Response(serializer.data)
+            return self.list_catalog(get_catalog().by_difficulty.get(difficulty, EMPTY_LISTING))
         return Response(
             {'error': 'difficulty parameter is required'},
             status=status.HTTP_400_BAD_REQUEST
         )
 
     @action(detail=False, methods=['get'])
+    @cache_response('workouts')
     def by_category(self, request):
         """Get workouts filtered by category"""
         category = request.query_params.get('category', None)
         if category:
-            workouts = Workout.objects.filter(category=category)
-            serializer = self.get_serializer(workouts, many=True)
-            return Response(serializer.data)
+            return self.list_catalog(get_catalog().by_category.get(category, EMPTY_LISTING))
         return Response(
             {'error': 'category parameter is required'},
             status=status.HTTP_400_BAD_REQUEST
         )
+
+    @action(detail=False, methods=['get'])
+    @cache_response('workouts')
+    def by_exercise(self, request):
+        """Get workouts that include an exercise, matched by name ignoring case"""
+        name = request.query_params.get('name', None)
+        if name:
+            return self.list_catalog(get_catalog().by_exercise.get(name.lower(), EMPTY_LISTING))
+        return Response(
+            {'error': 'name parameter is required'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+    @action(detail=False, methods=['get'])
+    @cache_response('workouts', POSTINGS)
+    def search(self, request):
+        """Search workout names, descriptions and exercise names; ?q= terms, ranked best first"""
+        return self.search_documents(request)
+
+
+@api_view(['GET'])
+def mongo_pool_stats(request):
+    """MongoDB connection pool statistics for this worker process"""
+    return Response(pool_stats())
+
+
+@api_view(['GET'])
+def response_cache_stats(request):
+    """Response cache hit and miss counters for this worker process"""
+    return Response(response_cache.stats())
+
+
+@api_view(['GET'])
+def write_behind_stats(request):
+    """Write-behind queue counters for this worker process"""
+    return Response(write_behind.stats())
+
+
+@require_GET
+def prometheus_metrics(request):
+    """Request and MongoDB metrics for this worker process, for Prometheus to scrape"""
+    return HttpResponse(metrics.registry.render(), content_type=metrics.CONTENT_TYPE)
@@ -0,0 +1,383 @@
+"""
+Write-behind activity creation.
+
+With WRITE_BEHIND['ENABLED'], POST /api/activities/ validates and scores the
+activity, appends it to a local queue and returns 202 with its assigned id
+instead of waiting for MongoDB. A background thread persists queued
+activities every FLUSH_INTERVAL seconds, or as soon as BATCH_SIZE are
+waiting, through insert_activities(), the same unordered insert_many and
+bulk delta writes as the bulk endpoint.
+
+The queue is a set of append-only JSON lines segment files in DIRECTORY,
+named after the writing process, so workers sharing the directory never
+write to the same file. Every append is flushed, and fsynced with FSYNC,
+before the request returns. A flush closes the current segment, persists
+it and deletes it. Segments left behind by a process that is no longer
+running are claimed by renaming them and persisted on startup (wsgi.py and
+asgi.py start the queue) or with `manage.py flush_write_behind`.
+
+Replaying a segment is idempotent: queued activities carry the ObjectId
+assigned when they were queued (clients cannot choose it), so one already
+inserted fails with a duplicate key and its points are not applied twice. Any other write error keeps the whole segment queued and
+the flush is retried. A crash between an insert and its delta writes can
+leave totals short; `manage.py recompute_points` re-derives them.
+
+Until an activity is persisted it is only in the queue. pending_activity()
+and pending_for_user() see the queued activities of every process, so the
+submitting user sees their activity by id and at the top of their activity
+lists straight away. This process's activities are kept in memory per
+segment; other processes' segments are read incrementally, only the lines
+appended since the last read.
+"""
+import atexit
+import os
+import re
+import threading
+from contextlib import suppress
+from datetime import timezone
+from bson import json_util
+from django.conf import settings
+from pymongo.errors import BulkWriteError
+from .cache import invalidate
+from .leaderboard import activity_deltas, apply_bulk_deltas, merge_deltas
+from .mongo import get_db
+from .recommendations import apply_feature_deltas, feature_deltas, merge_feature_deltas
+from .rollups import apply_rollup_deltas, assign_teams, merge_rollup_deltas, rollup_deltas
+from .search import index_documents
+
+DEFAULTS = {
+    'ENABLED': False,
+    'DIRECTORY': 'write-behind',
+    'FLUSH_INTERVAL': 0.5,
+    'BATCH_SIZE': 1000,
+    'FSYNC': True,
+}
+
+SEGMENT = re.compile(r'^activities-(\d+)-(\d+)\.log$')
+DUPLICATE_KEY = 11000
+
+
+def insert_activities(documents):
+    """
+    Insert scored activity documents, with their user's team, with one
+    unordered insert_many and apply the points, rollups, features and search
+    postings of those inserted.
+    Returns {offset: (code, message)} for the documents that failed.
+    """
+    failed = {}
+    if not documents:
+        return failed
+    assign_teams(documents)
+    try:
+        get_db().activities.insert_many(documents, ordered=False)
+    except BulkWriteError as exc:
+        for error in exc.details.get('writeErrors', []):
+            failed[error['index']] = (error.get('code'), error.get('errmsg', 'write failed'))
+
+    deltas = {}
+    daily = {}
+    features = {}
+    created = []
+    for offset, document in enumerate(documents):
+        if offset in failed:
+            continue
+        created.append(document)
+        merge_deltas(deltas, activity_deltas(after=document))
+        merge_rollup_deltas(daily, rollup_deltas(after=document))
+        merge_feature_deltas(features, feature_deltas(after=document))
+    apply_bulk_deltas(deltas)
+    apply_rollup_deltas(daily)
+    apply_feature_deltas(features)
+    index_documents('activity', created, created=True)
+    if created:
+        invalidate('activities')
+    return failed
+
+
+def as_stored(document):
+    """Return `document` as PyMongo reads it back: datetimes naive in UTC"""
+    return {
+        key: value.astimezone(timezone.utc).replace(tzinfo=None)
+        if getattr(value, 'tzinfo', None) is not None else value
+        for key, value in document.items()
+    }
+
+
+class FlushError(Exception):
+    """A queued activity failed to insert for a reason other than a duplicate key"""
+
+
+def parse_lines(data):
+    """Return the activities in complete JSON lines; a line torn by a crash is skipped"""
+    documents = []
+    for line in data.splitlines():
+        try:
+            documents.append(json_util.loads(line))
+        except ValueError:
+            continue
+    return documents
+
+
+def read_segment(path, offset=0):
+    """
+    Return (activities, end offset) for the complete lines of a segment
+    from `offset` on. A missing segment has no activities.
+    """
+    try:
+        with open(path, 'rb') as segment:
+            segment.seek(offset)
+            data = segment.read()
+    except FileNotFoundError:
+        return [], offset
+    # A line still being appended is read once it is complete
+    end = data.rfind(b'\n') + 1
+    return parse_lines(data[:end]), offset + end
+
+
+def process_running(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class WriteBehindQueue:
+    """Durable local queue of activities waiting to be persisted"""
+
+    def __init__(self, config):
+        self.enabled = config['ENABLED']
+        self.directory = str(config['DIRECTORY'])
+        self.flush_interval = config['FLUSH_INTERVAL']
+        self.batch_size = config['BATCH_SIZE']
+        self.fsync = config['FSYNC']
+        self._reset()
+
+    def reset(self):
+        """Forget this process's queue state; segments on disk are left alone"""
+        if getattr(self, '_file', None) is not None:
+            with suppress(OSError):
+                self._file.close()
+        self._reset()
+
+    def _reset(self):
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        self._file = None
+        self._sequence = 0
+        # Segments this process wrote or claimed and has not persisted yet,
+        # with their activities as stored
+        self._segments = []
+        self._pending = {}
+        # {path: (offset read up to, activities)} of other processes' segments
+        self._foreign = {}
+        self._waiting = 0
+        self._counters = {'queued': 0, 'persisted': 0, 'duplicates': 0, 'recovered': 0,
+                          'flush_failures': 0}
+        self._last_error = None
+
+    def start(self):
+        """Recover orphaned segments and start the flusher thread, once per process"""
+        with self._lock:
+            if self._thread is not None:
+                return
+            os.makedirs(self.directory, exist_ok=True)
+            self._thread = threading.Thread(target=self._run, name='write-behind-flush', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        self.recover()
+        while True:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            self.flush()
+
+    def _segment_path(self, pid, sequence):
+        return os.path.join(self.directory, f'activities-{pid}-{sequence}.log')
+
+    def _next_path(self):
+        # A restarted server may reuse the pid of segments it has not recovered yet
+        while True:
+            self._sequence += 1
+            path = self._segment_path(os.getpid(), self._sequence)
+            if not os.path.exists(path):
+                return path
+
+    def enqueue(self, document):
+        """Append a validated, scored activity with a new ObjectId `_id` to the queue"""
+        self.start()
+        line = json_util.dumps(document).encode('utf-8') + b'\n'
+        with self._lock:
+            if self._file is None:
+                path = self._next_path()
+                self._file = open(path, 'ab', buffering=0)
+                self._segments.append(path)
+                self._pending[path] = []
+            self._file.write(line)
+            self._pending[self._segments[-1]].append(as_stored(document))
+            if self.fsync:
+                os.fsync(self._file.fileno())
+            self._waiting += 1
+            self._counters['queued'] += 1
+            full = self._waiting >= self.batch_size
+        if full:
+            self._wake.set()
+
+    def _rotate(self):
+        """Close the segment being written so the next append starts a new one"""
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+            self._waiting = 0
+            return list(self._segments)
+
+    def flush(self):
+        """Persist every closed segment of this process; return the activities inserted"""
+        with self._flush_lock:
+            inserted = 0
+            for path in self._rotate():
+                try:
+                    inserted += self._persist(path)
+                except Exception as exc:  # Kept on disk and retried on the next flush
+                    self._counters['flush_failures'] += 1
+                    self._last_error = f'{type(exc).__name__}: {exc}'
+                    break
+                with suppress(FileNotFoundError):
+                    os.remove(path)
+                with self._lock:
+                    self._segments.remove(path)
+                    self._pending.pop(path, None)
+            return inserted
+
+    def _persist(self, path):
+        """
+        Insert a segment's activities. Raises FlushError, keeping the segment,
+        if any fails for a reason other than having been inserted already.
+        """
+        documents, _ = read_segment(path)
+        inserted = 0
+        for start in range(0, len(documents), self.batch_size):
+            batch = documents[start:start + self.batch_size]
+            failed = insert_activities(batch)
+            # Duplicates are activities a crashed process had already inserted
+            errors = [message for code, message in failed.values() if code != DUPLICATE_KEY]
+            inserted += len(batch) - len(failed)
+            self._counters['persisted'] += len(batch) - len(failed)
+            self._counters['duplicates'] += len(failed) - len(errors)
+            if errors:
+                # Those inserted are duplicates when the segment is retried
+                raise FlushError(f'{len(errors)} activities not inserted: {errors[0]}')
+        return inserted
+
+    def segments(self):
+        """Paths of every queued segment in the directory, oldest first per process"""
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return []
+        found = []
+        for name in names:
+            match = SEGMENT.match(name)
+            if match:
+                found.append((int(match.group(1)), int(match.group(2)), name))
+        return [os.path.join(self.directory, name) for _, _, name in sorted(found)]
+
+    def recover(self):
+        """
+        Claim the segments of processes that are no longer running, and any
+        left under this pid by an earlier process, then persist them.
+        Returns the number of activities inserted.
+        """
+        pid = os.getpid()
+        for path in self.segments():
+            owner = int(SEGMENT.match(os.path.basename(path)).group(1))
+            with self._lock:
+                if path in self._segments or (owner != pid and process_running(owner)):
+                    continue
+                claimed = self._next_path()
+                try:
+                    # Atomic, so one process wins each orphaned segment
+                    os.rename(path, claimed)
+                except FileNotFoundError:
+                    continue
+                self._segments.insert(0, claimed)
+                self._pending[claimed] = [
+                    as_stored(document) for document in read_segment(claimed)[0]
+                ]
+                self._counters['recovered'] += 1
+        return self.flush()
+
+    def pending(self):
+        """Activities queued by any process and not yet persisted"""
+        paths = self.segments()
+        with self._lock:
+            own = {path: list(documents) for path, documents in self._pending.items()}
+        documents = []
+        foreign = {}
+        for path in paths:
+            if path in own:
+                documents.extend(own.pop(path))
+                continue
+            offset, seen = self._foreign.get(path, (0, []))
+            added, offset = read_segment(path, offset)
+            seen = seen + [as_stored(document) for document in added]
+            foreign[path] = (offset, seen)
+            documents.extend(seen)
+        # Own segments being renamed or persisted meanwhile are still pending
+        for rest in own.values():
+            documents.extend(rest)
+        # Segments that are gone were persisted or claimed
+        self._foreign = foreign
+        return documents
+
+    def pending_activity(self, activity_id):
+        """Return the queued activity with `activity_id`, or None"""
+        activity_id = str(activity_id)
+        for document in self.pending():
+            if str(document['_id']) == activity_id:
+                return document
+        return None
+
+    def pending_for_user(self, user_id):
+        """Return the queued activities of one user"""
+        user_id = str(user_id)
+        return [document for document in self.pending() if str(document.get('user_id')) == user_id]
+
+    def stats(self):
+        return dict(
+            self._counters,
+            enabled=self.enabled,
+            pending_segments=len(self.segments()),
+            last_error=self._last_error,
+        )
+
+    def close(self):
+        """Persist what this process queued; used at exit"""
+        if self._thread is not None:
+            self.flush()
+
+    def reset_after_fork(self):
+        # The parent's segments stay the parent's and its thread did not
+        # survive the fork; the child starts its own on first use
+        self._reset()
+
+
+def _build_queue():
+    return WriteBehindQueue(dict(DEFAULTS, **getattr(settings, 'WRITE_BEHIND', {})))
+
+
+write_behind = _build_queue()
+atexit.register(write_behind.close)
+
+
+def _reset_after_fork():
+    write_behind.reset_after_fork()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
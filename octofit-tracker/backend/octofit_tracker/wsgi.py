@@ -14,3 +14,9 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'octofit_tracker.settings')
 
 application = get_wsgi_application()
+
+from octofit_tracker.writebehind import write_behind  # noqa: E402  (needs the app registry)
+
+if write_behind.enabled:
+    # Persist any activities a stopped server left in the queue
+    write_behind.start()
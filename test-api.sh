@@ -1,7 +1,10 @@
 #!/bin/bash
 
 # API Testing Script for OctoFit Tracker
-# This script tests all REST API endpoints
+# Calls every routed endpoint once and fails on any error. Any other
+# arguments are passed to the load harness, e.g.:
+#   ./test-api.sh --load --duration 60 --concurrency 32
+#   ./test-api.sh --load --rate 200 --output load.json
 
 echo "========================================="
 echo "Testing OctoFit Tracker API"
@@ -18,49 +21,20 @@ else
     echo "Testing on localhost: $BASE_URL"
 fi
 
-echo ""
-echo "========================================="
-echo "1. Testing API Root"
-echo "========================================="
-curl -s "${BASE_URL}/api/" | python -m json.tool 2>/dev/null || curl -s "${BASE_URL}/api/"
-
-echo ""
-echo ""
-echo "========================================="
-echo "2. Testing Teams Endpoint"
-echo "========================================="
-curl -s "${BASE_URL}/api/teams/" | python -m json.tool 2>/dev/null || curl -s "${BASE_URL}/api/teams/"
+BACKEND_DIR="$(cd "$(dirname "$0")/octofit-tracker/backend" && pwd)"
 
-echo ""
-echo ""
-echo "========================================="
-echo "3. Testing Users Endpoint"
-echo "========================================="
-curl -s "${BASE_URL}/api/users/" | python -m json.tool 2>/dev/null || curl -s "${BASE_URL}/api/users/"
-
-echo ""
-echo ""
-echo "========================================="
-echo "4. Testing Activities Endpoint"
-echo "========================================="
-curl -s "${BASE_URL}/api/activities/" | python -m json.tool 2>/dev/null || curl -s "${BASE_URL}/api/activities/"
-
-echo ""
-echo ""
-echo "========================================="
-echo "5. Testing Leaderboard Endpoint"
-echo "========================================="
-curl -s "${BASE_URL}/api/leaderboard/" | python -m json.tool 2>/dev/null || curl -s "${BASE_URL}/api/leaderboard/"
+if [ "$1" == "--load" ]; then
+    shift
+    MODE=()
+else
+    MODE=(--smoke)
+fi
 
-echo ""
-echo ""
-echo "========================================="
-echo "6. Testing Workouts Endpoint"
-echo "========================================="
-curl -s "${BASE_URL}/api/workouts/" | python -m json.tool 2>/dev/null || curl -s "${BASE_URL}/api/workouts/"
+cd "$BACKEND_DIR" && python -m benchmarks.load --base-url "$BASE_URL" "${MODE[@]}" "$@"
+STATUS=$?
 
-echo ""
 echo ""
 echo "========================================="
 echo "Testing Complete!"
 echo "========================================="
+exit $STATUS